@@ -0,0 +1,53 @@
+"""monthly rollups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+ROLLUP_KINDS = ("REQUEST", "ALLOCATION")
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "monthly_rollups",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("month", sa.String(7), nullable=False),
+        sa.Column("kind", sa.Enum(*ROLLUP_KINDS, name="rollupkind"), nullable=False),
+        sa.Column("beamline", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.UniqueConstraint("month", "kind", "beamline", "status", name="uq_monthly_rollups_bucket"),
+    )
+    # Backfill from the tables as they are at this revision, independent of the app code.
+    postgres = op.get_bind().dialect.name == "postgresql"
+
+    def month(column: str) -> str:
+        return f"to_char({column}, 'YYYY-MM')" if postgres else f"strftime('%Y-%m', {column})"
+
+    def kind(value: str) -> str:
+        return f"CAST('{value}' AS rollupkind)" if postgres else f"'{value}'"
+
+    op.execute(
+        "INSERT INTO monthly_rollups (month, kind, beamline, status, count) "
+        f"SELECT {month('created_at')}, {kind('REQUEST')}, '', CAST(status AS VARCHAR), count(id) "
+        f"FROM beamtime_requests GROUP BY {month('created_at')}, status"
+    )
+    op.execute(
+        "INSERT INTO monthly_rollups (month, kind, beamline, status, count) "
+        f"SELECT {month('created_at')}, {kind('ALLOCATION')}, beamline, CAST(status AS VARCHAR), count(id) "
+        f"FROM allocations GROUP BY {month('created_at')}, beamline, status"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("monthly_rollups")
@@ -0,0 +1,22 @@
+"""allocation beamline slot index
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_allocations_beamline_slot_date", "allocations", ["beamline", "slot_date"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_allocations_beamline_slot_date", table_name="allocations")
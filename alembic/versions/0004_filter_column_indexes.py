@@ -0,0 +1,36 @@
+"""filter column indexes
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+# (index name, table, columns).  (beamline, slot_date) was added in 0003, and
+# (project_id, status) doubles as the index for project_id alone.
+INDEXES = (
+    ("ix_research_projects_pi_id", "research_projects", ["pi_id"]),
+    ("ix_research_projects_manager_id", "research_projects", ["manager_id"]),
+    ("ix_beamtime_requests_created_at", "beamtime_requests", ["created_at"]),
+    ("ix_beamtime_requests_project_id_status", "beamtime_requests", ["project_id", "status"]),
+    ("ix_allocations_request_id", "allocations", ["request_id"]),
+    ("ix_allocations_created_at", "allocations", ["created_at"]),
+    ("ix_approvals_allocation_id", "approvals", ["allocation_id"]),
+)
+
+
+def upgrade() -> None:
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
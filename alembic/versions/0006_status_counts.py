@@ -0,0 +1,68 @@
+"""status counts
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+COUNTER_SCOPES = ("PROJECT", "MANAGER", "BEAMLINE")
+ROLLUP_KINDS = ("REQUEST", "ALLOCATION")
+
+# revision identifiers, used by Alembic.
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "status_counts",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("scope", sa.Enum(*COUNTER_SCOPES, name="counterscope"), nullable=False),
+        sa.Column("owner", sa.String(), nullable=False),
+        # 0002 already created the rollupkind type on PostgreSQL.
+        sa.Column(
+            "kind",
+            sa.Enum(*ROLLUP_KINDS, name="rollupkind").with_variant(
+                postgresql.ENUM(*ROLLUP_KINDS, name="rollupkind", create_type=False), "postgresql"
+            ),
+            nullable=False,
+        ),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.UniqueConstraint("scope", "owner", "kind", "status", name="uq_status_counts_bucket"),
+    )
+    # Backfill from the tables as they are at this revision, independent of the app code.
+    postgres = op.get_bind().dialect.name == "postgresql"
+
+    def enum(value: str, name: str) -> str:
+        return f"CAST('{value}' AS {name})" if postgres else f"'{value}'"
+
+    owners = (("PROJECT", "CAST(p.id AS VARCHAR)"), ("MANAGER", "CAST(p.manager_id AS VARCHAR)"))
+    for scope, owner in owners:
+        op.execute(
+            "INSERT INTO status_counts (scope, owner, kind, status, count) "
+            f"SELECT {enum(scope, 'counterscope')}, {owner}, {enum('REQUEST', 'rollupkind')}, "
+            "CAST(r.status AS VARCHAR), count(*) "
+            "FROM beamtime_requests AS r JOIN research_projects AS p ON p.id = r.project_id "
+            f"GROUP BY {owner}, r.status"
+        )
+    for scope, owner in (*owners, ("BEAMLINE", "a.beamline")):
+        op.execute(
+            "INSERT INTO status_counts (scope, owner, kind, status, count) "
+            f"SELECT {enum(scope, 'counterscope')}, {owner}, {enum('ALLOCATION', 'rollupkind')}, "
+            "CAST(a.status AS VARCHAR), count(*) "
+            "FROM allocations AS a JOIN beamtime_requests AS r ON r.id = a.request_id "
+            "JOIN research_projects AS p ON p.id = r.project_id "
+            f"GROUP BY {owner}, a.status"
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("status_counts")
+    sa.Enum(name="counterscope").drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,36 @@
+"""change versions
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+CHANGE_CHANNELS = ("TABLE", "BEAMLINE", "USER")
+
+# revision identifiers, used by Alembic.
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "change_versions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("channel", sa.Enum(*CHANGE_CHANNELS, name="changechannel"), nullable=False),
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.Column("changed_at", sa.DateTime(), nullable=False),
+        sa.UniqueConstraint("channel", "key", name="uq_change_versions_key"),
+    )
+    op.create_index("ix_change_versions_version", "change_versions", ["version"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_change_versions_version", table_name="change_versions")
+    op.drop_table("change_versions")
+    sa.Enum(name="changechannel").drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,427 @@
+"""Beamline utilization, idle gaps, oversubscription and PI/project shares.
+
+The allocation and request tables are loaded once as NumPy columns and kept
+until one of the tables they come from is written (tracked by the response
+cache's table versions), so a report over any window is a set of array passes
+rather than a scan of a decade of rows.
+
+Allocations in the window are laid onto an hourly occupancy grid with one row
+per beamline: each slot adds +1 at its start hour and -1 at its end hour, and a
+cumulative sum along the row gives the number of concurrent slots per hour.
+Utilization, double bookings and idle gaps are reductions over that grid;
+demand and shares are ``bincount``s over factorized ids.  A decade on 60
+beamlines is a 60 x 87,600 grid.
+
+Time is counted in whole hours from the start of the window; slots that start
+or end mid-hour occupy the whole hour on the grid.
+
+NumPy is only imported on first use, since it is slow to import.
+"""
+
+import enum
+from datetime import date, time, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .metrics import run_in_threadpool
+from .response_cache import TableVersions, table_versions
+
+# Roughly ten years; larger windows would only make the grid grow.
+MAX_WINDOW_DAYS = 3660
+
+SLOT_TABLES = (models.Allocation.__tablename__,)
+REQUEST_TABLES = (models.BeamtimeRequest.__tablename__, models.ResearchProject.__tablename__)
+
+
+class Granularity(str, enum.Enum):
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+
+
+class ShareGrouping(str, enum.Enum):
+    PI = "pi"
+    PROJECT = "project"
+
+
+class Window(NamedTuple):
+    start: date
+    end: date  # inclusive
+
+    @property
+    def hours(self) -> int:
+        return ((self.end - self.start).days + 1) * 24
+
+
+def analysis_window(start: date, end: date) -> Window:
+    if end < start:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end must not be before start")
+    if (end - start).days + 1 > MAX_WINDOW_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Analysis windows are limited to {MAX_WINDOW_DAYS} days",
+        )
+    return Window(start, end)
+
+
+def lookback_days(longest_hours: int) -> int:
+    """How many days before a window a slot of ``longest_hours`` can start and still reach into it."""
+
+    return -(-longest_hours // 24)
+
+
+def _numpy():
+    import numpy
+
+    return numpy
+
+
+class SlotColumns(NamedTuple):
+    beamlines: List[str]
+    beamline: Any  # index into ``beamlines``
+    day: Any  # ``date.toordinal()`` of slot_date
+    clock: Any  # hours after midnight
+    duration: Any
+    request_id: Any
+    longest: int  # hours of the longest slot
+
+
+class RequestColumns(NamedTuple):
+    id: Any  # sorted
+    day: Any
+    duration: Any
+    active: Any  # not rejected
+    project_id: Any
+    pi_id: Any
+
+
+def _clock_hours(value: str) -> float:
+    try:
+        clock = time.fromisoformat(value)
+    except ValueError:
+        return float("nan")
+    return clock.hour + clock.minute / 60
+
+
+def _ordinals(np, dates):
+    return np.fromiter((value.toordinal() for value in dates), dtype=np.int64, count=len(dates))
+
+
+def slot_columns(rows: Sequence) -> SlotColumns:
+    np = _numpy()
+    beamline, slot_date, slot_time, duration, request_id = list(zip(*rows)) or [()] * 5
+    names, codes = np.unique(np.array(beamline, dtype=str), return_inverse=True)
+    # Slot times repeat heavily, so only the distinct values are parsed.
+    clocks, clock_index = np.unique(np.array(slot_time, dtype=str), return_inverse=True)
+    clock = np.array([_clock_hours(value) for value in clocks])[clock_index]
+    valid = np.isfinite(clock)
+    durations = np.array(duration, dtype=np.int64)[valid]
+    return SlotColumns(
+        names.tolist(),
+        codes[valid],
+        _ordinals(np, slot_date)[valid],
+        clock[valid],
+        durations,
+        np.array(request_id, dtype=np.int64)[valid],
+        int(durations.max()) if len(durations) else 0,
+    )
+
+
+def request_columns(rows: Sequence) -> RequestColumns:
+    np = _numpy()
+    request_id, requested_date, duration, request_status, project_id, pi_id = list(zip(*rows)) or [()] * 6
+    return RequestColumns(
+        np.array(request_id, dtype=np.int64),
+        _ordinals(np, requested_date),
+        np.array(duration, dtype=np.int64),
+        np.array([value is not models.RequestStatus.REJECTED for value in request_status], dtype=bool),
+        np.array(project_id, dtype=np.int64),
+        np.array(pi_id, dtype=np.int64),
+    )
+
+
+async def load_slot_columns(db: AsyncSession) -> SlotColumns:
+    allocation = models.Allocation
+    # Core execution on the connection skips ORM row processing.
+    connection = await db.connection()
+    result = await connection.execute(
+        select(
+            allocation.beamline,
+            allocation.slot_date,
+            allocation.slot_time,
+            allocation.duration_hours,
+            allocation.request_id,
+        )
+    )
+    return await run_in_threadpool(slot_columns, result.all())
+
+
+async def load_request_columns(db: AsyncSession) -> RequestColumns:
+    request = models.BeamtimeRequest
+    project = models.ResearchProject
+    connection = await db.connection()
+    result = await connection.execute(
+        select(request.id, request.requested_date, request.duration_hours, request.status, project.id, project.pi_id)
+        .join(project, request.project_id == project.id)
+        .order_by(request.id)
+    )
+    return await run_in_threadpool(request_columns, result.all())
+
+
+class ColumnCache:
+    """Whole-table columns, reloaded after a committed write to their tables.
+
+    The versions are read before loading, so a write racing a load only makes
+    the next caller reload.
+    """
+
+    def __init__(self, versions: TableVersions):
+        self.versions = versions
+        self._entries: Dict[str, Tuple[tuple, Any]] = {}
+
+    async def _get(self, name: str, tables, load: Callable[[], Awaitable[Any]]):
+        versions, _ = self.versions.snapshot(tables)
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == versions:
+            return entry[1]
+        columns = await load()
+        self._entries[name] = (versions, columns)
+        return columns
+
+    async def slots(self, db: AsyncSession) -> SlotColumns:
+        return await self._get("slots", SLOT_TABLES, lambda: load_slot_columns(db))
+
+    async def requests(self, db: AsyncSession) -> RequestColumns:
+        return await self._get("requests", REQUEST_TABLES, lambda: load_request_columns(db))
+
+
+column_cache = ColumnCache(table_versions)
+
+
+def get_column_cache() -> ColumnCache:
+    return column_cache
+
+
+class Slots(NamedTuple):
+    """Slots overlapping a window, in hours from its start."""
+
+    beamlines: List[str]
+    beamline: Any  # index into ``beamlines``
+    start: Any
+    end: Any
+    request_id: Any
+
+
+def window_slots(columns: SlotColumns, window: Window, beamline: Optional[str] = None) -> Slots:
+    np = _numpy()
+    origin = window.start.toordinal()
+    mask = (columns.day >= origin - lookback_days(columns.longest)) & (columns.day <= window.end.toordinal())
+    if beamline is not None:
+        code = columns.beamlines.index(beamline) if beamline in columns.beamlines else -1
+        mask &= columns.beamline == code
+    start = (columns.day[mask] - origin) * 24 + columns.clock[mask]
+    end = start + columns.duration[mask]
+    inside = (end > 0) & (start < window.hours)
+    used, codes = np.unique(columns.beamline[mask][inside], return_inverse=True)
+    names = [columns.beamlines[code] for code in used.tolist()]
+    return Slots(names, codes, start[inside], end[inside], columns.request_id[mask][inside])
+
+
+def window_demand(columns: RequestColumns, window: Window):
+    """Mask of the requests that are not rejected and requested within the window."""
+
+    return columns.active & (columns.day >= window.start.toordinal()) & (columns.day <= window.end.toordinal())
+
+
+def occupancy(slots: Slots, hours: int):
+    """Concurrent slots per beamline and hour, shape ``(beamlines, hours)``."""
+
+    np = _numpy()
+    first = np.clip(np.floor(slots.start), 0, hours).astype(np.int64)
+    last = np.clip(np.ceil(slots.end), 0, hours).astype(np.int64)
+    row = slots.beamline * (hours + 1)
+    size = len(slots.beamlines) * (hours + 1)
+    steps = np.bincount(row + first, minlength=size) - np.bincount(row + last, minlength=size)
+    return np.cumsum(steps.reshape(len(slots.beamlines), hours + 1)[:, :-1], axis=1, dtype=np.int32)
+
+
+def bucket_starts(window: Window, granularity: Granularity) -> List[date]:
+    if granularity is Granularity.MONTH:
+        starts = [window.start]
+        month = window.start.replace(day=1)
+        while True:
+            month = (month + timedelta(days=32)).replace(day=1)
+            if month > window.end:
+                return starts
+            starts.append(month)
+    step = 1 if granularity is Granularity.DAY else 7
+    return [window.start + timedelta(days=day) for day in range(0, (window.end - window.start).days + 1, step)]
+
+
+def _bucket_edges(np, window: Window, starts: List[date]):
+    return np.array([(start - window.start).days * 24 for start in starts] + [window.hours])
+
+
+def _ratios(np, numerator, denominator) -> List[Optional[float]]:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = np.round(numerator / denominator, 4)
+    return [float(ratio) if np.isfinite(ratio) else None for ratio in ratios]
+
+
+def utilization(columns: SlotColumns, window: Window, beamline: Optional[str], granularity: Granularity) -> dict:
+    np = _numpy()
+    slots = window_slots(columns, window, beamline)
+    grid = occupancy(slots, window.hours)
+    starts = bucket_starts(window, granularity)
+    edges = _bucket_edges(np, window, starts)
+    capacity = np.diff(edges)
+    booked = np.add.reduceat(grid > 0, edges[:-1], axis=1, dtype=np.int64)
+    double_booked = np.add.reduceat(grid > 1, edges[:-1], axis=1, dtype=np.int64)
+    totals = booked.sum(axis=1)
+    return {
+        "start": window.start,
+        "end": window.end,
+        "granularity": granularity.value,
+        "bucket_starts": starts,
+        "capacity_hours": capacity.tolist(),
+        "beamlines": [
+            {
+                "beamline": name,
+                "booked_hours": booked[index].tolist(),
+                "double_booked_hours": double_booked[index].tolist(),
+                "utilization": np.round(booked[index] / capacity, 4).tolist(),
+                "total_booked_hours": int(totals[index]),
+                "total_utilization": round(float(totals[index]) / window.hours, 4),
+            }
+            for index, name in enumerate(slots.beamlines)
+        ],
+    }
+
+
+def idle_gaps(columns: SlotColumns, window: Window, beamline: Optional[str], min_hours: int = 1) -> List[dict]:
+    """Runs of unbooked hours per beamline; the window edges bound the first and last gap."""
+
+    np = _numpy()
+    slots = window_slots(columns, window, beamline)
+    busy = occupancy(slots, window.hours) > 0
+    padded = np.pad(busy, ((0, 0), (1, 1)), constant_values=True).view(np.int8)
+    steps = np.diff(padded, axis=1)
+    # Row-major order pairs every gap's start with its own end.
+    row, first = np.nonzero(steps == -1)
+    lengths = np.nonzero(steps == 1)[1] - first
+    keep = lengths >= min_hours
+    row, first, lengths = row[keep], first[keep], lengths[keep]
+
+    count = len(slots.beamlines)
+    gap_count = np.bincount(row, minlength=count)
+    idle = np.bincount(row, weights=lengths, minlength=count)
+    order = np.lexsort((first, -lengths, row))
+    longest_rows, longest_at = np.unique(row[order], return_index=True)
+    longest = dict(zip(longest_rows.tolist(), order[longest_at].tolist()))
+    origin = np.datetime64(window.start, "h")
+
+    report = []
+    for index, name in enumerate(slots.beamlines):
+        item = {
+            "beamline": name,
+            "gap_count": int(gap_count[index]),
+            "idle_hours": int(idle[index]),
+            "mean_gap_hours": round(float(idle[index]) / gap_count[index], 2) if gap_count[index] else 0.0,
+            "longest_gap_hours": 0,
+            "longest_gap_start": None,
+        }
+        if index in longest:
+            position = longest[index]
+            item["longest_gap_hours"] = int(lengths[position])
+            item["longest_gap_start"] = (origin + int(first[position])).astype(object)
+        report.append(item)
+    return report
+
+
+def oversubscription(
+    columns: SlotColumns, requests: RequestColumns, window: Window, granularity: Granularity
+) -> dict:
+    """Requested hours against booked hours and beamline capacity per bucket.
+
+    Capacity counts every beamline with a booking in the window as available
+    around the clock; requests carry no beamline, so demand is facility-wide.
+    """
+
+    np = _numpy()
+    slots = window_slots(columns, window)
+    starts = bucket_starts(window, granularity)
+    edges = _bucket_edges(np, window, starts)
+    booked = np.add.reduceat(occupancy(slots, window.hours) > 0, edges[:-1], axis=1, dtype=np.int64)
+    capacity = np.diff(edges) * len(slots.beamlines)
+    booked_hours = booked.sum(axis=0) if slots.beamlines else np.zeros(len(starts), dtype=np.int64)
+
+    demand = window_demand(requests, window)
+    hour = (requests.day[demand] - window.start.toordinal()) * 24
+    bucket = np.searchsorted(edges, hour, side="right") - 1
+    requested = np.bincount(bucket, weights=requests.duration[demand], minlength=len(starts))
+    return {
+        "start": window.start,
+        "end": window.end,
+        "granularity": granularity.value,
+        "beamline_count": len(slots.beamlines),
+        "bucket_starts": starts,
+        "capacity_hours": capacity.tolist(),
+        "booked_hours": booked_hours.tolist(),
+        "requested_hours": requested.astype(np.int64).tolist(),
+        "oversubscription": _ratios(np, requested, capacity),
+        "requested_per_booked": _ratios(np, requested, booked_hours),
+    }
+
+
+def shares(
+    columns: SlotColumns,
+    requests: RequestColumns,
+    window: Window,
+    beamline: Optional[str],
+    grouping: ShareGrouping,
+    limit: int,
+) -> dict:
+    """Booked and requested hours per PI or project, largest booked share first."""
+
+    np = _numpy()
+    owners = requests.pi_id if grouping is ShareGrouping.PI else requests.project_id
+    slots = window_slots(columns, window, beamline)
+    # Join slots to their request's owner by binary search on the sorted ids.
+    position = np.minimum(np.searchsorted(requests.id, slots.request_id), max(len(requests.id) - 1, 0))
+    if len(requests.id):
+        known = requests.id[position] == slots.request_id
+    else:
+        known = np.zeros(len(slots.request_id), dtype=bool)
+    booked = (np.minimum(slots.end, window.hours) - np.maximum(slots.start, 0))[known]
+    demand = window_demand(requests, window)
+    requested = requests.duration[demand]
+
+    ids, owner = np.unique(np.concatenate([owners[position[known]], owners[demand]]), return_inverse=True)
+    booked_hours = np.bincount(owner[: len(booked)], weights=booked, minlength=len(ids))
+    requested_hours = np.bincount(owner[len(booked):], weights=requested, minlength=len(ids))
+    total_booked, total_requested = float(booked_hours.sum()), float(requested_hours.sum())
+    top = np.lexsort((ids, -booked_hours))[:limit]
+    return {
+        "start": window.start,
+        "end": window.end,
+        "grouping": grouping.value,
+        "owner_count": len(ids),
+        "total_booked_hours": round(total_booked, 2),
+        "total_requested_hours": round(total_requested, 2),
+        "items": [
+            {
+                "id": int(ids[index]),
+                "booked_hours": round(float(booked_hours[index]), 2),
+                "booked_share": round(float(booked_hours[index]) / total_booked, 4) if total_booked else 0.0,
+                "requested_hours": round(float(requested_hours[index]), 2),
+                "requested_share": (
+                    round(float(requested_hours[index]) / total_requested, 4) if total_requested else 0.0
+                ),
+            }
+            for index in top.tolist()
+        ],
+    }
@@ -0,0 +1,126 @@
+"""One beamline's calendar as parallel arrays grouped by day.
+
+``GET /beamlines/{beamline}/calendar`` reads a date range of one beamline
+through ``ix_allocations_beamline_slot_date`` and answers with columns rather
+than one keyed object per slot:
+
+* ``days``: offsets from ``start`` of the days that have bookings;
+* ``occupied_hours``: hours of each of those days covered by any slot;
+* ``slot_counts``: how many slots start on each day.  The ``slots`` columns
+  list them in day, then start time order, so day ``i`` owns the next
+  ``slot_counts[i]`` entries.
+
+``detail=hours`` leaves out the slot columns and the joins that fill them,
+which is what month and year zoom levels need: a year is two short integer
+arrays.  Hours are counted whole, like the analytics grid, and include the
+hours that slots started on earlier days spill into the window; how far back
+to look comes from the beamline's longest slot.
+"""
+
+import enum
+from collections import Counter
+from datetime import date, time, timedelta
+from typing import Dict, Sequence
+
+from fastapi import HTTPException, status
+from sqlalchemy import Select, func, select
+
+from . import models
+from .analytics import Window, lookback_days
+
+# Two years covers a full cycle at the coarsest zoom level.
+MAX_CALENDAR_DAYS = 731
+
+SLOT_FIELDS = ("id", "request_id", "project_title", "slot_time", "duration_hours", "status")
+
+
+class CalendarDetail(str, enum.Enum):
+    SLOTS = "slots"
+    HOURS = "hours"
+
+
+def calendar_window(start: date, end: date) -> Window:
+    if end < start:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end must not be before start")
+    if (end - start).days + 1 > MAX_CALENDAR_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Calendar ranges are limited to {MAX_CALENDAR_DAYS} days",
+        )
+    return Window(start, end)
+
+
+def longest_slot_query(beamline: str) -> Select:
+    return select(func.max(models.Allocation.duration_hours)).where(models.Allocation.beamline == beamline)
+
+
+def calendar_query(beamline: str, window: Window, detail: CalendarDetail, longest_hours: int) -> Select:
+    """Slots overlapping ``window``; the joins for ``SLOT_FIELDS`` only come with ``detail=slots``.
+
+    ``longest_hours`` is the beamline's longest slot, which bounds how early a
+    slot reaching into the window can start.
+    """
+
+    allocation = models.Allocation
+    query = select(allocation.slot_date, allocation.slot_time, allocation.duration_hours).where(
+        allocation.beamline == beamline,
+        allocation.slot_date >= window.start - timedelta(days=lookback_days(longest_hours)),
+        allocation.slot_date <= window.end,
+    )
+    if detail is CalendarDetail.SLOTS:
+        query = (
+            query.add_columns(
+                allocation.id,
+                allocation.request_id,
+                models.ResearchProject.title.label("project_title"),
+                allocation.status,
+            )
+            .join(models.BeamtimeRequest, models.BeamtimeRequest.id == allocation.request_id)
+            .join(models.ResearchProject, models.ResearchProject.id == models.BeamtimeRequest.project_id)
+        )
+    return query.order_by(allocation.slot_date, allocation.slot_time, allocation.id)
+
+
+def _seconds(slot_time: str) -> int:
+    clock = time.fromisoformat(slot_time)
+    return clock.hour * 3600 + clock.minute * 60 + clock.second
+
+
+def build_calendar(rows: Sequence, beamline: str, window: Window, detail: CalendarDetail) -> dict:
+    span = window.hours
+    occupied = bytearray(span)
+    origin = window.start.toordinal()
+    # A handful of distinct start times, so parse each once instead of building datetimes per row.
+    offsets: Dict[str, int] = {}
+    listed = []
+    for row in rows:
+        slot_date, slot_time, duration_hours = row[:3]
+        offset = offsets.get(slot_time)
+        if offset is None:
+            offset = offsets[slot_time] = _seconds(slot_time)
+        begin = (slot_date.toordinal() - origin) * 86400 + offset
+        first = max(0, begin // 3600)
+        last = min(span, -(-(begin + duration_hours * 3600) // 3600))
+        if last > first:
+            occupied[first:last] = b"\x01" * (last - first)
+        if begin >= 0:
+            listed.append(row)
+
+    starts = Counter((row.slot_date - window.start).days for row in listed)
+    hours = [occupied.count(1, hour, hour + 24) for hour in range(0, span, 24)]
+    days = sorted({day for day, count in enumerate(hours) if count} | set(starts))
+    calendar = {
+        "beamline": beamline,
+        "start": window.start,
+        "end": window.end,
+        "days": days,
+        "occupied_hours": [hours[day] for day in days],
+        "total_occupied_hours": sum(hours),
+        "slot_counts": None,
+        "slots": None,
+    }
+    if detail is CalendarDetail.SLOTS:
+        calendar["slot_counts"] = [starts[day] for day in days]
+        columns = dict(zip(listed[0]._fields, map(list, zip(*listed)))) if listed else {}
+        calendar["slots"] = {field: columns.get(field, []) for field in SLOT_FIELDS}
+    return calendar
@@ -0,0 +1,236 @@
+"""Cross-worker invalidation of in-process caches through the database.
+
+Each worker keeps process-local state: table versions behind the response
+cache and the analytics columns, the booked-slot index and the role cache.
+With several workers, a commit in one leaves the others stale.  When the feed
+is started (``cross_worker_invalidation``), every committing transaction
+stamps what it changed into ``change_versions`` as ``(channel, key)`` rows:
+
+* ``TABLE``: tables written, which drive ETags and the analytics reload;
+* ``BEAMLINE``: beamlines whose booked slots changed;
+* ``USER``: users whose role may have changed.
+
+Stamps carry a database-wide sequence number (``max(version) + 1``) assigned
+under the write lock, so on SQLite version order is commit order.  A daemon
+thread in every worker reads the rows above the last version it saw and
+applies them to its caches, so other workers catch up within one poll
+interval.  Table versions are taken from the shared sequence rather than
+counted per process, which keeps ETags identical across workers.
+
+Slot reservations need more than eventual consistency: :meth:`ChangeFeed.claim`
+locks the beamlines being booked and then applies every change committed
+before it, so the conflict check sees other workers' bookings and no other
+worker can book those beamlines until this transaction ends.  SQLite has a
+single writer anyway, so there the lock is its database write lock; on
+PostgreSQL it is one transaction-scoped advisory lock per beamline, so
+bookings on different beamlines do not wait for each other.  Only stamping,
+which lasts from ``before_commit`` to the commit, takes a database-wide
+advisory lock there, to keep version order equal to commit order.
+"""
+
+import logging
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import event, false, func, insert, select, text, tuple_, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from . import models
+from .conflicts import RESERVATIONS_KEY, STALE_BEAMLINES_KEY, slot_index
+from .dependencies import role_cache
+from .response_cache import WRITTEN_TABLES_KEY, table_versions
+
+logger = logging.getLogger(__name__)
+
+PENDING_CHANGES_KEY = "pending_changes"
+STAMPED_CHANGES_KEY = "stamped_changes"
+# Any constant works; it only has to be the same in every worker.
+POSTGRES_LOCK_ID = 0x6265616D
+
+_versions = models.ChangeVersion.__table__
+ChangeKey = Tuple[models.ChangeChannel, str]
+# Version and time of a stamp.
+Stamp = Tuple[int, datetime]
+
+
+def _lock_writers(db: Session) -> None:
+    """Hold off other stamping transactions until ``db``'s transaction ends."""
+
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:lock)"), {"lock": POSTGRES_LOCK_ID})
+    else:
+        # A write that matches no rows still takes SQLite's database write lock.
+        db.execute(update(_versions).where(false()).values(version=_versions.c.version))
+
+
+def _lock_beamlines(db: Session, beamlines: Iterable[str]) -> None:
+    """Hold off other bookings on ``beamlines`` until ``db``'s transaction ends."""
+
+    if db.get_bind().dialect.name != "postgresql":
+        _lock_writers(db)
+        return
+    # A fixed order, so two batches sharing beamlines cannot deadlock.
+    for beamline in sorted(set(beamlines)):
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(:lock, hashtext(:beamline))"),
+            {"lock": POSTGRES_LOCK_ID, "beamline": beamline},
+        )
+
+
+def _stamp(db: Session, keys: Set[ChangeKey]) -> Dict[ChangeKey, Stamp]:
+    """Give ``keys`` the next version in the shared sequence."""
+
+    if db.get_bind().dialect.name == "postgresql":
+        _lock_writers(db)
+    now = datetime.utcnow()
+    next_version = select(func.coalesce(func.max(_versions.c.version), 0) + 1).scalar_subquery()
+    stamped = dict(
+        ((channel, key), (version, now))
+        for channel, key, version in db.execute(
+            update(_versions)
+            .where(tuple_(_versions.c.channel, _versions.c.key).in_(keys))
+            .values(version=next_version, changed_at=now)
+            .returning(_versions.c.channel, _versions.c.key, _versions.c.version)
+        )
+    )
+    missing = keys - set(stamped)
+    if missing:
+        version = stamped[next(iter(stamped))][0] if stamped else db.scalar(select(next_version))
+        db.execute(
+            insert(_versions),
+            [{"channel": channel, "key": key, "version": version, "changed_at": now} for channel, key in missing],
+        )
+        stamped.update(dict.fromkeys(missing, (version, now)))
+    return stamped
+
+
+class ChangeFeed:
+    def __init__(self):
+        self.enabled = False
+        self.seen = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.handlers: Dict[models.ChangeChannel, Callable[[Dict[str, Stamp]], None]] = {
+            models.ChangeChannel.TABLE: _advance_tables,
+            models.ChangeChannel.BEAMLINE: lambda changed: slot_index.invalidate(changed),
+            models.ChangeChannel.USER: _invalidate_roles,
+        }
+
+    def publish(self, db: Session, channel: models.ChangeChannel, keys: Iterable) -> None:
+        """Stamp ``keys`` when ``db`` commits; a no-op unless the feed runs."""
+
+        if self.enabled:
+            db.info.setdefault(PENDING_CHANGES_KEY, set()).update((channel, str(key)) for key in keys)
+
+    def claim(self, db: Session, beamlines: Iterable[str]) -> None:
+        """Lock ``beamlines`` against other bookings and catch up before reserving slots on them."""
+
+        if not self.enabled:
+            return
+        _lock_beamlines(db, beamlines)
+        self.poll(db.connection())
+
+    def poll(self, connection: Connection) -> int:
+        """Apply changes committed since the last poll; returns how many rows were read.
+
+        A worker's own changes come back too.  Re-applying them is harmless,
+        and reloading a beamline this worker booked on picks up the committed
+        row even if a concurrent reload had dropped the reservation.
+        """
+
+        rows = connection.execute(
+            select(_versions.c.channel, _versions.c.key, _versions.c.version, _versions.c.changed_at).where(
+                _versions.c.version > self.seen
+            )
+        ).all()
+        changed: Dict[models.ChangeChannel, Dict[str, Stamp]] = {}
+        for channel, key, version, changed_at in rows:
+            changed.setdefault(channel, {})[key] = (version, changed_at)
+        if rows:
+            with self._lock:
+                self.seen = max(self.seen, max(row.version for row in rows))
+        for channel, keys in changed.items():
+            self.handlers[channel](keys)
+        return len(rows)
+
+    def start(self, engine: Engine, interval: float) -> None:
+        """Catch up with the shared versions, then poll every ``interval`` seconds."""
+
+        # Versions now come from the database and survive restarts.
+        table_versions.reset()
+        table_versions.epoch = "shared"
+        self.seen = 0
+        with engine.connect() as connection:
+            self.poll(connection)
+        self.enabled = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(engine, interval), name="change-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.enabled = False
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        # Local counters restart from the shared values, so old ETags must not match.
+        table_versions.epoch = uuid.uuid4().hex[:12]
+
+    def _run(self, engine: Engine, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                with engine.connect() as connection:
+                    self.poll(connection)
+            except Exception:
+                logger.exception("Polling change_versions failed")
+
+
+def _advance_tables(changed: Dict[str, Stamp]) -> None:
+    for table, (version, changed_at) in changed.items():
+        table_versions.advance(table, version, changed_at.replace(tzinfo=timezone.utc))
+
+
+def _invalidate_roles(changed: Dict[str, Stamp]) -> None:
+    for user_id in changed:
+        role_cache.invalidate(int(user_id))
+
+
+change_feed = ChangeFeed()
+
+
+@event.listens_for(Session, "before_commit")
+def _stamp_changes(session: Session) -> None:
+    if not change_feed.enabled:
+        return
+    session.flush()
+    pending: Set[ChangeKey] = session.info.pop(PENDING_CHANGES_KEY, set())
+    # Taking the written tables here means the response cache does not count
+    # them locally; the shared versions replace its per-process counter.
+    pending.update((models.ChangeChannel.TABLE, table) for table in session.info.pop(WRITTEN_TABLES_KEY, ()))
+    pending.update((models.ChangeChannel.BEAMLINE, slot.beamline) for slot in session.info.get(RESERVATIONS_KEY, ()))
+    pending.update((models.ChangeChannel.BEAMLINE, beamline) for beamline in session.info.get(STALE_BEAMLINES_KEY, ()))
+    pending.discard((models.ChangeChannel.TABLE, _versions.name))
+    if pending:
+        session.info[STAMPED_CHANGES_KEY] = _stamp(session, pending)
+        session.info.pop(WRITTEN_TABLES_KEY, None)
+
+
+@event.listens_for(Session, "after_commit")
+def _advance_own_tables(session: Session) -> None:
+    # Without waiting for the poller, so this worker's next ETag reflects the write.
+    stamped = session.info.pop(STAMPED_CHANGES_KEY, None)
+    if stamped:
+        _advance_tables(
+            {key: stamp for (channel, key), stamp in stamped.items() if channel is models.ChangeChannel.TABLE}
+        )
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_unstamped_changes(session: Session, transaction) -> None:
+    if transaction.parent is None:
+        session.info.pop(PENDING_CHANGES_KEY, None)
+        session.info.pop(STAMPED_CHANGES_KEY, None)
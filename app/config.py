@@ -0,0 +1,66 @@
+from functools import lru_cache
+from typing import Literal, Optional
+
+from pydantic import BaseSettings, Field
+from sqlalchemy.engine import make_url
+
+# Sync drivers mapped to the async driver used for the same backend.
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+class Settings(BaseSettings):
+    database_url: str = Field(
+        "sqlite:///./beamtime.db", env=["DATABASE_URL", "SQLALCHEMY_DATABASE_URL"]
+    )
+    async_database_url: Optional[str] = Field(None, env="ASYNC_DATABASE_URL")
+
+    # Connection pool (ignored for in-memory SQLite, which keeps SQLAlchemy's default pool).
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+
+    # Connect-time PRAGMAs applied to every SQLite connection.
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+
+    # Startup schema handling: create missing tables, only verify them (when
+    # Alembic owns the schema) or skip the step entirely.
+    schema_on_startup: Literal["create", "check", "skip"] = "create"
+
+    # Multi-worker mode: share cache invalidations through the change_versions
+    # table, polled by every worker at this interval.  ``python -m app.serve``
+    # turns it on when it starts more than one worker.
+    cross_worker_invalidation: bool = False
+    invalidation_poll_ms: float = 250.0
+
+    # Opt-in sampling profiler: requests slower than the threshold dump folded stacks.
+    profile_slow_requests_ms: Optional[float] = None
+    profile_dir: str = "profiles"
+    profile_interval_ms: float = 5.0
+
+    class Config:
+        env_prefix = "BEAMTIME_"
+
+    def resolved_async_database_url(self) -> str:
+        if self.async_database_url:
+            return self.async_database_url
+        url = make_url(self.database_url)
+        drivername = ASYNC_DRIVERS.get(url.drivername)
+        if drivername is None:
+            raise ValueError(
+                f"No async driver known for {url.drivername!r}; set ASYNC_DATABASE_URL explicitly"
+            )
+        return url.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+@lru_cache()
+def get_settings() -> Settings:
+    return Settings()
@@ -0,0 +1,247 @@
+"""In-process index of booked beamline slots used to reject double bookings.
+
+Each beamline keeps its slots sorted by start time, so an overlap query is a
+binary search followed by a short backwards walk bounded by the longest slot
+on that beamline.  Beamlines are loaded lazily from the database (through the
+``(beamline, slot_date)`` index) the first time they are checked.
+
+New slots are *reserved* in the index before the row is inserted, which keeps
+two concurrent requests from booking the same hours.  Session events promote a
+reservation once its transaction commits and drop it again if the transaction
+rolls back, so the index only ever reflects committed rows plus in-flight
+reservations.
+"""
+
+import bisect
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from . import models
+
+RESERVATIONS_KEY = "slot_reservations"
+STALE_BEAMLINES_KEY = "stale_beamlines"
+
+
+def slot_bounds(slot_date: date, slot_time: str, duration_hours: int):
+    """Return the ``[start, end)`` datetimes covered by a slot.
+
+    Raises ``ValueError`` when ``slot_time`` is not an ``HH:MM`` style time.
+    """
+
+    start = datetime.combine(slot_date, time.fromisoformat(slot_time))
+    return start, start + timedelta(hours=duration_hours)
+
+
+class SlotConflict(Exception):
+    def __init__(self, allocation_ids: List[Optional[int]]):
+        super().__init__("Beamline slot overlaps an existing allocation")
+        self.allocation_ids = allocation_ids
+
+
+class Slot:
+    __slots__ = ("beamline", "start", "end", "allocation_id", "allocation")
+
+    def __init__(self, beamline: str, start: datetime, end: datetime, allocation_id: Optional[int] = None):
+        self.beamline = beamline
+        self.start = start
+        self.end = end
+        self.allocation_id = allocation_id
+        self.allocation: Optional[models.Allocation] = None
+
+
+class BeamlineSlots:
+    """Slots of one beamline, sorted by start time."""
+
+    def __init__(self):
+        self._starts: List[datetime] = []
+        self._slots: List[Slot] = []
+        self._longest = timedelta(0)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def add(self, slot: Slot) -> None:
+        position = bisect.bisect_right(self._starts, slot.start)
+        self._starts.insert(position, slot.start)
+        self._slots.insert(position, slot)
+        self._longest = max(self._longest, slot.end - slot.start)
+
+    def remove(self, slot: Slot) -> None:
+        position = bisect.bisect_left(self._starts, slot.start)
+        while position < len(self._slots) and self._starts[position] == slot.start:
+            if self._slots[position] is slot:
+                del self._starts[position]
+                del self._slots[position]
+                return
+            position += 1
+
+    def overlapping(self, start: datetime, end: datetime) -> List[Slot]:
+        # Only slots starting before ``end`` can overlap, and none of those
+        # starting earlier than ``start - longest`` can still be running.
+        position = bisect.bisect_left(self._starts, end) - 1
+        horizon = start - self._longest
+        found = []
+        while position >= 0 and self._starts[position] >= horizon:
+            slot = self._slots[position]
+            if slot.end > start:
+                found.append(slot)
+            position -= 1
+        found.reverse()
+        return found
+
+
+class SlotIndex:
+    def __init__(self):
+        self._beamlines: Dict[str, BeamlineSlots] = {}
+        self._lock = threading.RLock()
+
+    def _load(self, db: Session, beamline: str) -> BeamlineSlots:
+        slots = self._beamlines.get(beamline)
+        if slots is not None:
+            return slots
+        # Query without holding the lock: under an AsyncSession the query yields to
+        # the event loop, and other requests on the same thread would re-enter it.
+        loaded = BeamlineSlots()
+        rows = db.query(
+            models.Allocation.id,
+            models.Allocation.slot_date,
+            models.Allocation.slot_time,
+            models.Allocation.duration_hours,
+        ).filter(models.Allocation.beamline == beamline)
+        for row in rows:
+            try:
+                start, end = slot_bounds(row.slot_date, row.slot_time, row.duration_hours)
+            except ValueError:
+                continue
+            loaded.add(Slot(beamline, start, end, row.id))
+        with self._lock:
+            return self._beamlines.setdefault(beamline, loaded)
+
+    def conflicts(self, db: Session, beamline: str, start: datetime, end: datetime) -> List[Slot]:
+        slots = self._load(db, beamline)
+        with self._lock:
+            return slots.overlapping(start, end)
+
+    def reserve(self, db: Session, beamline: str, start: datetime, end: datetime) -> Slot:
+        """Claim ``[start, end)`` on ``beamline`` for the current transaction of ``db``.
+
+        Raises ``SlotConflict`` if the hours are already booked or reserved.
+        """
+
+        while True:
+            slots = self._load(db, beamline)
+            with self._lock:
+                # Invalidated while loading: load the beamline again.
+                if self._beamlines.get(beamline) is not slots:
+                    continue
+                overlapping = slots.overlapping(start, end)
+                if overlapping:
+                    raise SlotConflict([slot.allocation_id for slot in overlapping])
+                slot = Slot(beamline, start, end)
+                slots.add(slot)
+                break
+        db.info.setdefault(RESERVATIONS_KEY, []).append(slot)
+        return slot
+
+    def release(self, slots: Iterable[Slot]) -> None:
+        with self._lock:
+            for slot in slots:
+                beamline_slots = self._beamlines.get(slot.beamline)
+                if beamline_slots is not None:
+                    beamline_slots.remove(slot)
+
+    def invalidate(self, beamlines: Optional[Iterable[str]] = None) -> None:
+        with self._lock:
+            if beamlines is None:
+                self._beamlines.clear()
+                return
+            for beamline in beamlines:
+                self._beamlines.pop(beamline, None)
+
+
+slot_index = SlotIndex()
+
+
+def _slot_changed(instance: models.Allocation) -> bool:
+    attrs = inspect(instance).attrs
+    return any(
+        attrs[name].history.has_changes()
+        for name in ("beamline", "slot_date", "slot_time", "duration_hours")
+    )
+
+
+def _beamline_history(instance: models.Allocation) -> Set[str]:
+    history = inspect(instance).attrs.beamline.history
+    return {value for value in (*history.deleted, *history.unchanged, *history.added) if value}
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flushed_allocations(session: Session, flush_context) -> None:
+    for slot in session.info.get(RESERVATIONS_KEY, ()):
+        if slot.allocation is not None and slot.allocation.id is not None:
+            slot.allocation_id = slot.allocation.id
+    reserved = {id(slot.allocation) for slot in session.info.get(RESERVATIONS_KEY, ())}
+    stale: Set[str] = session.info.setdefault(STALE_BEAMLINES_KEY, set())
+    for instance in session.new:
+        if isinstance(instance, models.Allocation) and id(instance) not in reserved:
+            stale.add(instance.beamline)
+    for instance in session.deleted:
+        if isinstance(instance, models.Allocation):
+            stale.add(instance.beamline)
+    for instance in session.dirty:
+        if isinstance(instance, models.Allocation) and _slot_changed(instance):
+            stale.update(_beamline_history(instance))
+
+
+@event.listens_for(Session, "after_commit")
+def _promote_reservations(session: Session) -> None:
+    for slot in session.info.pop(RESERVATIONS_KEY, ()):
+        slot.allocation = None
+    stale = session.info.pop(STALE_BEAMLINES_KEY, None)
+    if stale:
+        slot_index.invalidate(stale)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _release_uncommitted(session: Session, transaction) -> None:
+    if transaction.parent is not None:
+        return
+    reservations = session.info.pop(RESERVATIONS_KEY, None)
+    if reservations:
+        slot_index.release(reservations)
+    session.info.pop(STALE_BEAMLINES_KEY, None)
+
+
+def find_conflicts(db: Session, proposals: List) -> List[Dict]:
+    """Check proposed slots against booked slots and against each other.
+
+    ``proposals`` are objects with ``beamline``, ``slot_date``, ``slot_time``
+    and ``duration_hours``; one result is returned per proposal, in order.
+    """
+
+    batch: Dict[str, BeamlineSlots] = {}
+    bounds = []
+    for position, proposal in enumerate(proposals):
+        start, end = slot_bounds(proposal.slot_date, proposal.slot_time, proposal.duration_hours)
+        bounds.append((proposal.beamline, start, end))
+        batch.setdefault(proposal.beamline, BeamlineSlots()).add(Slot(proposal.beamline, start, end, position))
+
+    results = []
+    for position, (beamline, start, end) in enumerate(bounds):
+        booked = slot_index.conflicts(db, beamline, start, end)
+        results.append(
+            {
+                "index": position,
+                "conflicting_allocation_ids": [slot.allocation_id for slot in booked if slot.allocation_id is not None],
+                "conflicting_indexes": [
+                    slot.allocation_id
+                    for slot in batch[beamline].overlapping(start, end)
+                    if slot.allocation_id != position
+                ],
+            }
+        )
+    return results
@@ -0,0 +1,219 @@
+"""Request and allocation counts by status, per project, manager and beamline.
+
+Dashboards read these counters instead of counting full listings.  Requests
+are counted per project and per manager; allocations per project, per
+manager and per beamline.  Every write that creates a request or allocation
+or changes its status applies its deltas in the same transaction with one
+``INSERT ... ON CONFLICT DO UPDATE`` over all touched buckets, so concurrent
+first writes to a new bucket add up instead of colliding on its unique key.
+``rebuild_status_counts`` recomputes everything from the source tables.
+"""
+
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Integer, String, cast, func, insert, literal, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from . import models, writes
+
+# (scope, owner, kind, status); ``owner`` is a project or manager id as text, or a beamline.
+CounterKey = Tuple[models.CounterScope, str, models.RollupKind, str]
+
+_counts = models.StatusCount.__table__
+KEY_FIELDS = ("scope", "owner", "kind", "status")
+
+# Summary field and statuses reported for each kind.
+SUMMARY_FIELDS = {
+    models.RollupKind.REQUEST: ("requests", models.RequestStatus),
+    models.RollupKind.ALLOCATION: ("allocations", models.AllocationStatus),
+}
+
+
+def request_keys(project_id: int, manager_id: int, status: models.RequestStatus) -> List[CounterKey]:
+    kind = models.RollupKind.REQUEST
+    return [
+        (models.CounterScope.PROJECT, str(project_id), kind, status.value),
+        (models.CounterScope.MANAGER, str(manager_id), kind, status.value),
+    ]
+
+
+def allocation_keys(
+    project_id: int, manager_id: int, beamline: str, status: models.AllocationStatus
+) -> List[CounterKey]:
+    kind = models.RollupKind.ALLOCATION
+    return [
+        (models.CounterScope.PROJECT, str(project_id), kind, status.value),
+        (models.CounterScope.MANAGER, str(manager_id), kind, status.value),
+        (models.CounterScope.BEAMLINE, beamline, kind, status.value),
+    ]
+
+
+def apply(db: Session, deltas: Dict[CounterKey, int]) -> None:
+    writes.add_counts(db, _counts, KEY_FIELDS, deltas)
+
+
+def record_request_created(db: Session, project_id: int, manager_id: int, status: models.RequestStatus) -> None:
+    apply(db, dict.fromkeys(request_keys(project_id, manager_id, status), 1))
+
+
+def record_request_status_change(
+    db: Session,
+    project_id: int,
+    manager_id: int,
+    previous: models.RequestStatus,
+    status: models.RequestStatus,
+) -> None:
+    if previous == status:
+        return
+    deltas = Counter(dict.fromkeys(request_keys(project_id, manager_id, status), 1))
+    deltas.subtract(dict.fromkeys(request_keys(project_id, manager_id, previous), 1))
+    apply(db, deltas)
+
+
+def record_allocations_created(
+    db: Session, allocations: Iterable[Tuple[int, int, str, models.AllocationStatus]]
+) -> None:
+    """Count allocations given as ``(project_id, manager_id, beamline, status)``."""
+
+    deltas = Counter()
+    for allocation in allocations:
+        deltas.update(allocation_keys(*allocation))
+    apply(db, deltas)
+
+
+def record_allocation_status_changes(
+    db: Session,
+    changes: Iterable[Tuple[int, int, str, models.AllocationStatus]],
+    status: models.AllocationStatus,
+) -> None:
+    """Move allocations given as ``(project_id, manager_id, beamline, previous)`` into ``status``."""
+
+    deltas = Counter()
+    for project_id, manager_id, beamline, previous in changes:
+        if previous != status:
+            deltas.subtract(allocation_keys(project_id, manager_id, beamline, previous))
+            deltas.update(allocation_keys(project_id, manager_id, beamline, status))
+    apply(db, deltas)
+
+
+def record_manager_change(db: Session, project_id: int, previous: int, manager_id: int) -> None:
+    """Move a project's counts from its previous manager to ``manager_id``."""
+
+    if previous == manager_id:
+        return
+    rows = db.execute(
+        select(_counts.c.kind, _counts.c.status, _counts.c.count).where(
+            _counts.c.scope == models.CounterScope.PROJECT, _counts.c.owner == str(project_id)
+        )
+    )
+    deltas = Counter()
+    for kind, status, count in rows:
+        deltas[models.CounterScope.MANAGER, str(previous), kind, status] -= count
+        deltas[models.CounterScope.MANAGER, str(manager_id), kind, status] += count
+    apply(db, deltas)
+
+
+def rebuild_status_counts(db: Session) -> None:
+    """Recompute every counter from the source tables in set-based statements."""
+
+    project = models.ResearchProject
+    request = models.BeamtimeRequest
+    allocation = models.Allocation
+    columns = ["scope", "owner", "kind", "status", "count"]
+
+    db.execute(_counts.delete())
+    owners = (
+        (models.CounterScope.PROJECT, cast(project.id, String)),
+        (models.CounterScope.MANAGER, cast(project.manager_id, String)),
+    )
+    for scope, owner in owners:
+        db.execute(
+            insert(_counts).from_select(
+                columns,
+                select(
+                    literal(scope.value),
+                    owner,
+                    literal(models.RollupKind.REQUEST.value),
+                    request.status,
+                    func.count(),
+                )
+                .select_from(request)
+                .join(project, project.id == request.project_id)
+                .group_by(owner, request.status),
+            )
+        )
+    for scope, owner in (*owners, (models.CounterScope.BEAMLINE, allocation.beamline)):
+        db.execute(
+            insert(_counts).from_select(
+                columns,
+                select(
+                    literal(scope.value),
+                    owner,
+                    literal(models.RollupKind.ALLOCATION.value),
+                    allocation.status,
+                    func.count(),
+                )
+                .select_from(allocation)
+                .join(request, request.id == allocation.request_id)
+                .join(project, project.id == request.project_id)
+                .group_by(owner, allocation.status),
+            )
+        )
+
+
+def summary(
+    rows: Iterable[Tuple[Optional[models.RollupKind], Optional[str], Optional[int]]],
+    kinds: Iterable[models.RollupKind] = tuple(models.RollupKind),
+) -> dict:
+    """Counts by status for each of ``kinds``, with zeros for statuses never counted.
+
+    Rows with a NULL kind (an outer join that found no counters) are skipped.
+    """
+
+    report = {"requests": {}, "allocations": {}}
+    for kind in kinds:
+        field, statuses = SUMMARY_FIELDS[kind]
+        report[field] = {status.value: 0 for status in statuses}
+    for kind, status, count in rows:
+        if kind is not None:
+            report[SUMMARY_FIELDS[kind][0]][status] = count
+    return report
+
+
+def owner_counts(scope: models.CounterScope, owner: str) -> Select:
+    return select(_counts.c.kind, _counts.c.status, _counts.c.count).where(
+        _counts.c.scope == scope, _counts.c.owner == owner
+    )
+
+
+def project_counts(project_id: int) -> Select:
+    """Counters of a project; no rows means the project does not exist."""
+
+    project = models.ResearchProject
+    return (
+        select(_counts.c.kind, _counts.c.status, _counts.c.count)
+        .select_from(project)
+        .outerjoin(
+            _counts,
+            (_counts.c.scope == models.CounterScope.PROJECT) & (_counts.c.owner == cast(project.id, String)),
+        )
+        .where(project.id == project_id)
+    )
+
+
+def pi_counts(pi_id: int) -> Select:
+    """Project counters summed over every project of a PI."""
+
+    project = models.ResearchProject
+    return (
+        select(_counts.c.kind, _counts.c.status, cast(func.sum(_counts.c.count), Integer))
+        .select_from(project)
+        .join(
+            _counts,
+            (_counts.c.scope == models.CounterScope.PROJECT) & (_counts.c.owner == cast(project.id, String)),
+        )
+        .where(project.pi_id == pi_id)
+        .group_by(_counts.c.kind, _counts.c.status)
+    )
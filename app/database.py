@@ -1,11 +1,152 @@
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from .config import Settings, get_settings
+
+settings = get_settings()
+
+SQLALCHEMY_DATABASE_URL = settings.database_url
+ASYNC_DATABASE_URL = settings.resolved_async_database_url()
+
+
+class PoolStats:
+    """Checkout counters for one pool; wait times are in seconds."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, waited: float) -> None:
+        self.checkouts += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+
+class _TimedCheckoutMixin:
+    """Measure how long callers wait for a connection to become available."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.timeouts += 1
+            raise
+        self.stats.record(time.perf_counter() - started)
+        return connection
+
+
+class InstrumentedQueuePool(_TimedCheckoutMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./beamtime.db"
+def pool_status(engine) -> dict:
+    pool = engine.pool
+    stats = getattr(pool, "stats", None)
+    if stats is None:
+        return {"pool_class": type(pool).__name__}
+    return {
+        "pool_class": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "checkouts": stats.checkouts,
+        "timeouts": stats.timeouts,
+        "total_wait_seconds": stats.total_wait,
+        "max_wait_seconds": stats.max_wait,
+    }
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+
+def _is_memory_sqlite(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _engine_options(url, settings: Settings, pool_class) -> dict:
+    options = {}
+    if url.get_backend_name() == "sqlite" and not url.drivername.endswith("aiosqlite"):
+        options["connect_args"] = {"check_same_thread": False}
+    if not _is_memory_sqlite(url):
+        options.update(
+            poolclass=pool_class,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle,
+            pool_pre_ping=settings.db_pool_pre_ping,
+        )
+    return options
+
+
+def _install_sqlite_pragmas(engine: Engine, settings: Settings) -> None:
+    pragmas = [
+        f"PRAGMA journal_mode={settings.sqlite_journal_mode}",
+        f"PRAGMA synchronous={settings.sqlite_synchronous}",
+        f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}",
+        f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}",
+    ]
+
+    @event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def create_db_engine(url: str, settings: Settings = settings) -> Engine:
+    parsed = make_url(url)
+    engine = create_engine(parsed, **_engine_options(parsed, settings, InstrumentedQueuePool))
+    if parsed.get_backend_name() == "sqlite":
+        _install_sqlite_pragmas(engine, settings)
+    return engine
+
+
+def create_async_db_engine(url: str, settings: Settings = settings) -> AsyncEngine:
+    parsed = make_url(url)
+    engine = create_async_engine(parsed, **_engine_options(parsed, settings, InstrumentedAsyncQueuePool))
+    if parsed.get_backend_name() == "sqlite":
+        _install_sqlite_pragmas(engine.sync_engine, settings)
+    return engine
+
+
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_db_engine(ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
+
+
+def prepare_schema(engine: Engine, mode: str) -> None:
+    """Create missing tables (``create``), verify they exist (``check``) or do nothing (``skip``)."""
+
+    if mode == "skip":
+        return
+    if mode == "create":
+        Base.metadata.create_all(bind=engine)
+        return
+    existing = set(inspect(engine).get_table_names())
+    missing = sorted(set(Base.metadata.tables) - existing)
+    if missing:
+        raise RuntimeError(
+            f"Database schema is missing tables {', '.join(missing)}; run `alembic upgrade head`"
+        )
@@ -1,22 +1,44 @@
+from typing import NamedTuple
+
 from fastapi import HTTPException, status, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .database import SessionLocal
+from .cache import TTLCache
+from .database import AsyncSessionLocal
 from .models import User, UserRole
 
+ROLE_CACHE_TTL_SECONDS = 60.0
+ROLE_CACHE_MAXSIZE = 4096
+
+
+class CachedUser(NamedTuple):
+    id: int
+    role: UserRole
+
+
+role_cache = TTLCache(maxsize=ROLE_CACHE_MAXSIZE, ttl=ROLE_CACHE_TTL_SECONDS)
+
+
+def get_role_cache() -> TTLCache:
+    return role_cache
+
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def ensure_role(db: Session, user_id: int, role: UserRole) -> User:
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+async def ensure_role_async(
+    db: AsyncSession, user_id: int, role: UserRole, cache: TTLCache = role_cache
+) -> CachedUser:
+    user = cache.get(user_id)
+    if user is None:
+        row = (await db.execute(select(User.id, User.role).where(User.id == user_id))).first()
+        if not row:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+        user = CachedUser(row.id, row.role)
+        cache.set(user_id, user)
     if user.role != role:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -0,0 +1,182 @@
+"""In-process pub/sub bus for allocation and request status changes.
+
+Write handlers publish after their transaction commits.  Events get
+monotonically increasing ids and are kept in a bounded ring buffer, so an SSE
+client reconnecting with ``Last-Event-ID`` replays what it missed.  A client
+whose id has already fallen out of the buffer (or who cannot keep up) gets a
+``reset`` event and should re-fetch its listing.
+
+Publishers are not necessarily on the subscriber's thread (scripts, threadpool
+work), so publishing hands events to each subscriber's event loop with
+``call_soon_threadsafe``.
+"""
+
+import asyncio
+import json
+import threading
+from collections import deque
+from typing import AsyncIterator, List, NamedTuple, Optional, Set
+
+from fastapi.encoders import jsonable_encoder
+
+EVENT_BUFFER_SIZE = 2048
+SUBSCRIBER_QUEUE_SIZE = 1024
+HEARTBEAT_SECONDS = 15.0
+RETRY_MILLISECONDS = 3000
+
+RESET_EVENT = "reset"
+
+
+class Event(NamedTuple):
+    id: int
+    type: str
+    data: dict
+    beamline: Optional[str] = None
+    project_id: Optional[int] = None
+    manager_id: Optional[int] = None
+
+
+class EventFilter(NamedTuple):
+    beamline: Optional[str] = None
+    project_id: Optional[int] = None
+    manager_id: Optional[int] = None
+
+    def matches(self, event: Event) -> bool:
+        return (
+            (self.beamline is None or event.beamline == self.beamline)
+            and (self.project_id is None or event.project_id == self.project_id)
+            and (self.manager_id is None or event.manager_id == self.manager_id)
+        )
+
+
+class _Subscriber:
+    __slots__ = ("loop", "queue", "overflowed")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def deliver(self, event: Event) -> None:
+        # Runs on the subscriber's loop.
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class EventBus:
+    def __init__(self, buffer_size: int = EVENT_BUFFER_SIZE):
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._subscribers: Set[_Subscriber] = set()
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def last_event_id(self) -> int:
+        return self._last_id
+
+    def publish(
+        self,
+        type: str,
+        data,
+        beamline: Optional[str] = None,
+        project_id: Optional[int] = None,
+        manager_id: Optional[int] = None,
+    ) -> Event:
+        with self._lock:
+            self._last_id += 1
+            event = Event(self._last_id, type, jsonable_encoder(data), beamline, project_id, manager_id)
+            self._buffer.append(event)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, event)
+            except RuntimeError:
+                # The subscriber's loop is closed; its stream is gone.
+                self._unsubscribe(subscriber)
+        return event
+
+    def _unsubscribe(self, subscriber: _Subscriber) -> None:
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _replay(self, after: int) -> Optional[List[Event]]:
+        """Buffered events newer than ``after``, or None when some were evicted."""
+
+        if after >= self._last_id:
+            return []
+        if not self._buffer or self._buffer[0].id > after + 1:
+            return None
+        return [event for event in self._buffer if event.id > after]
+
+    async def subscribe(
+        self,
+        filters: EventFilter,
+        last_event_id: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+    ) -> AsyncIterator[Optional[Event]]:
+        """Yield matching events; ``None`` marks ``idle_timeout`` seconds without one."""
+
+        subscriber = _Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            # Register and snapshot under one lock so nothing falls between replay and live delivery.
+            self._subscribers.add(subscriber)
+            backlog = self._replay(last_event_id) if last_event_id is not None else []
+            seen = self._last_id
+        try:
+            if backlog is None:
+                yield Event(seen, RESET_EVENT, {"reason": "history_unavailable"})
+                backlog = []
+            for event in backlog:
+                if filters.matches(event):
+                    yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), idle_timeout)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is None:
+                    yield Event(seen, RESET_EVENT, {"reason": "subscriber_overflow"})
+                    return
+                if event.id <= seen:
+                    continue
+                seen = event.id
+                if filters.matches(event):
+                    yield event
+        finally:
+            self._unsubscribe(subscriber)
+
+
+def format_sse(event: Event) -> str:
+    return f"id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data, separators=(',', ':'))}\n\n"
+
+
+async def sse_stream(
+    bus: EventBus,
+    filters: EventFilter,
+    last_event_id: Optional[int] = None,
+    heartbeat: float = HEARTBEAT_SECONDS,
+) -> AsyncIterator[str]:
+    """Encode ``bus`` events as ``text/event-stream`` chunks, with comment heartbeats."""
+
+    yield f"retry: {RETRY_MILLISECONDS}\n\n"
+    events = bus.subscribe(filters, last_event_id, idle_timeout=heartbeat)
+    try:
+        async for event in events:
+            yield ": keepalive\n\n" if event is None else format_sse(event)
+    finally:
+        await events.aclose()
+
+
+event_bus = EventBus()
+
+
+def get_event_bus() -> EventBus:
+    return event_bus
+
@@ -0,0 +1,293 @@
+"""Streaming CSV, Arrow and Parquet exports of allocations and monthly rollups.
+
+Rows come from a server-side cursor in batches of ``EXPORT_BATCH_SIZE`` and
+each batch is encoded and handed on before the next is fetched, so memory
+stays bounded by one batch whatever the date range.  Arrow batches are written
+as Arrow IPC stream messages or as one Parquet row group per batch.
+
+pyarrow is only imported on first use, since it is slow to import.  The
+same encoders back the HTTP endpoints and the command line::
+
+    python -m app.export allocations --format parquet --start 2024-01-01 --end 2024-12-31 -o 2024.parquet
+    python -m app.export monthly --start-year 2020 --end-year 2024 -o rollup.csv
+"""
+
+import argparse
+import csv
+import enum
+import io
+import sys
+from datetime import date
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models, queries
+from .pagination import filter_allocations
+from .reports import rollup_filters
+
+EXPORT_BATCH_SIZE = 10_000
+
+
+class ExportFormat(str, enum.Enum):
+    CSV = "csv"
+    ARROW = "arrow"
+    PARQUET = "parquet"
+
+
+MEDIA_TYPES = {
+    ExportFormat.CSV: "text/csv",
+    ExportFormat.ARROW: "application/vnd.apache.arrow.stream",
+    ExportFormat.PARQUET: "application/vnd.apache.parquet",
+}
+
+# Column name and logical type; the types map onto Arrow types below.
+Column = Tuple[str, str]
+
+ALLOCATION_COLUMNS: List[Column] = [
+    ("allocation_id", "int"),
+    ("request_id", "int"),
+    ("project_id", "int"),
+    ("project_title", "str"),
+    ("pi_id", "int"),
+    ("manager_id", "int"),
+    ("beamline", "str"),
+    ("slot_date", "date"),
+    ("slot_time", "str"),
+    ("duration_hours", "int"),
+    ("allocation_status", "str"),
+    ("request_status", "str"),
+    ("requested_date", "date"),
+    ("created_at", "datetime"),
+]
+
+MONTHLY_COLUMNS: List[Column] = [
+    ("month", "str"),
+    ("kind", "str"),
+    ("beamline", "str"),
+    ("status", "str"),
+    ("count", "int"),
+]
+
+
+def allocation_export_query(
+    beamline: Optional[str] = None, start: Optional[date] = None, end: Optional[date] = None
+) -> Select:
+    return filter_allocations(queries.allocation_export_rows(), beamline, start, end)
+
+
+def monthly_export_query(
+    start_year: int,
+    end_year: int,
+    kind: Optional[models.RollupKind] = None,
+    beamline: Optional[str] = None,
+) -> Select:
+    rollup = models.MonthlyRollup
+    return (
+        select(rollup.month, rollup.kind, rollup.beamline, rollup.status, rollup.count)
+        .where(*rollup_filters(start_year, end_year, kind, beamline))
+        .order_by(rollup.month, rollup.kind, rollup.beamline, rollup.status)
+    )
+
+
+def _plain(value):
+    return value.value if isinstance(value, enum.Enum) else value
+
+
+class _Sink:
+    """Write-only file object whose contents are drained after every batch."""
+
+    def __init__(self):
+        self.closed = False
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class CsvEncoder:
+    def __init__(self, columns: Sequence[Column]):
+        self.columns = columns
+
+    def begin(self) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow([name for name, _ in self.columns])
+        return buffer.getvalue().encode()
+
+    def encode(self, rows: Sequence[Sequence]) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows([_plain(value) for value in row] for row in rows)
+        return buffer.getvalue().encode()
+
+    def finish(self) -> bytes:
+        return b""
+
+
+def _pyarrow():
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    return pyarrow
+
+
+class ArrowEncoder:
+    def __init__(self, columns: Sequence[Column], parquet: bool = False):
+        self.pa = pa = _pyarrow()
+        types = {"int": pa.int64(), "str": pa.string(), "date": pa.date32(), "datetime": pa.timestamp("us")}
+        self.schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        self.parquet = parquet
+        self.sink = _Sink()
+        self.writer = None
+
+    def begin(self) -> bytes:
+        if self.parquet:
+            self.writer = self.pa.parquet.ParquetWriter(self.sink, self.schema, compression="zstd")
+        else:
+            self.writer = self.pa.ipc.new_stream(self.sink, self.schema)
+        return self.sink.drain()
+
+    def encode(self, rows: Sequence[Sequence]) -> bytes:
+        columns = [
+            self.pa.array([_plain(row[position]) for row in rows], type=field.type)
+            for position, field in enumerate(self.schema)
+        ]
+        batch = self.pa.RecordBatch.from_arrays(columns, schema=self.schema)
+        if self.parquet:
+            self.writer.write_batch(batch, row_group_size=len(rows))
+        else:
+            self.writer.write_batch(batch)
+        return self.sink.drain()
+
+    def finish(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+
+def encoder_for(export_format: ExportFormat, columns: Sequence[Column]):
+    if export_format is ExportFormat.CSV:
+        return CsvEncoder(columns)
+    return ArrowEncoder(columns, parquet=export_format is ExportFormat.PARQUET)
+
+
+def encode_batches(encoder, batches: Iterable[Sequence[Sequence]]) -> Iterator[bytes]:
+    yield encoder.begin()
+    for rows in batches:
+        if rows:
+            yield encoder.encode(rows)
+    yield encoder.finish()
+
+
+def stream_export(
+    db: AsyncSession,
+    query: Select,
+    columns: Sequence[Column],
+    export_format: ExportFormat,
+    filename: str,
+) -> StreamingResponse:
+    """Stream ``query`` encoded as ``export_format``.
+
+    Like ``stream_ndjson`` the generator closes the session itself, because
+    the body is produced after the request dependencies have been torn down.
+    """
+
+    encoder = encoder_for(export_format, columns)
+
+    async def generate() -> AsyncIterator[bytes]:
+        try:
+            yield encoder.begin()
+            result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+            async for rows in result.partitions():
+                yield encoder.encode(rows)
+            yield encoder.finish()
+        finally:
+            await db.close()
+
+    extension = "arrows" if export_format is ExportFormat.ARROW else export_format.value
+    return StreamingResponse(
+        generate(),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'},
+    )
+
+
+def export_to_file(db: Session, query: Select, columns: Sequence[Column], export_format: ExportFormat, output) -> int:
+    """Write ``query`` to the binary file object ``output``; returns the row count."""
+
+    encoder = encoder_for(export_format, columns)
+    result = db.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    count = 0
+
+    def batches():
+        nonlocal count
+        for rows in result.partitions():
+            count += len(rows)
+            yield rows
+
+    for chunk in encode_batches(encoder, batches()):
+        output.write(chunk)
+    return count
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Export allocations or monthly rollups.")
+    parser.add_argument("dataset", choices=("allocations", "monthly"))
+    parser.add_argument("--format", type=ExportFormat, default=ExportFormat.CSV, choices=list(ExportFormat))
+    parser.add_argument("--output", "-o", help="file to write (default: stdout)")
+    parser.add_argument("--beamline")
+    parser.add_argument("--start", type=date.fromisoformat, help="first slot date (allocations)")
+    parser.add_argument("--end", type=date.fromisoformat, help="last slot date (allocations)")
+    parser.add_argument("--start-year", type=int, help="first year (monthly)")
+    parser.add_argument("--end-year", type=int, help="last year (monthly)")
+    parser.add_argument("--kind", type=models.RollupKind, choices=list(models.RollupKind))
+    args = parser.parse_args(argv)
+
+    if args.dataset == "allocations":
+        query, columns = allocation_export_query(args.beamline, args.start, args.end), ALLOCATION_COLUMNS
+    else:
+        if args.start_year is None:
+            parser.error("--start-year is required for the monthly export")
+        query = monthly_export_query(args.start_year, args.end_year or args.start_year, args.kind, args.beamline)
+        columns = MONTHLY_COLUMNS
+
+    with SessionLocal() as db:
+        if args.output:
+            with open(args.output, "wb") as output:
+                count = export_to_file(db, query, columns, args.format, output)
+        else:
+            count = export_to_file(db, query, columns, args.format, sys.stdout.buffer)
+    print(f"Exported {count} rows", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
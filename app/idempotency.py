@@ -0,0 +1,214 @@
+"""``Idempotency-Key`` support for write endpoints.
+
+A client that retries a POST with the same ``Idempotency-Key`` header gets the
+stored response of the first attempt instead of running the write again.
+The dependency claims the key by inserting its row before the handler runs,
+so a retry racing the first attempt waits on the key's unique index instead of
+competing for the same slots or rows; once the first attempt commits, the
+retry rolls back and replays its response.  Handlers call
+:meth:`Idempotency.save` just before ``commit()`` to fill in the response, so
+the key and the rows it protects commit or roll back together.
+
+Stored responses live in ``idempotency_keys`` for ``IDEMPOTENCY_TTL_SECONDS``
+(expired rows are swept by the write path every ``SWEEP_INTERVAL_SECONDS``),
+and each worker keeps recent ones in an LRU so the retry burst right after a
+timeout is answered without a query.  Reusing a key for a different method,
+path, query or body is a 422.  Errors are not stored: a request that failed
+runs again when retried.
+"""
+
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, NamedTuple, Optional, Tuple
+
+from fastapi import Depends, Header, HTTPException, Request, Response, status
+from sqlalchemy import delete, event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import TTLCache
+from .dependencies import get_async_db
+from .serialization import dumps
+
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600.0
+IDEMPOTENCY_CACHE_TTL_SECONDS = 600.0
+IDEMPOTENCY_CACHE_MAXSIZE = 2048
+SWEEP_INTERVAL_SECONDS = 300.0
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+PENDING_KEY = "idempotency_pending"
+
+_keys = models.IdempotencyKey.__table__
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: int
+    body: bytes
+
+
+class IdempotentReplay(Exception):
+    """Answers a request with a stored response instead of running its handler."""
+
+    def __init__(self, stored: StoredResponse):
+        super().__init__(stored.status_code)
+        self.stored = stored
+
+
+async def replay_response(request: Request, exc: IdempotentReplay) -> Response:
+    return Response(
+        exc.stored.body,
+        status_code=exc.stored.status_code,
+        media_type="application/json",
+        headers={REPLAYED_HEADER: "true"},
+    )
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: float, cache_maxsize: int, cache_ttl: float, sweep_interval: float):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.recent = TTLCache(maxsize=cache_maxsize, ttl=min(cache_ttl, ttl))
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def lookup(self, db: Session, key: str) -> Optional[StoredResponse]:
+        stored = self.recent.get(key)
+        if stored is not None:
+            return stored
+        row = db.execute(
+            select(_keys.c.fingerprint, _keys.c.status_code, _keys.c.body, _keys.c.expires_at).where(
+                _keys.c.key == key
+            )
+        ).first()
+        if row is None:
+            return None
+        if row.expires_at <= datetime.utcnow():
+            # Not swept yet; drop it with this request's write so the key can be reused.
+            db.execute(delete(_keys).where(_keys.c.key == key))
+            return None
+        stored = StoredResponse(row.fingerprint, row.status_code, row.body)
+        self.recent.set(key, stored)
+        return stored
+
+    def sweep_due(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_sweep:
+                return False
+            self._next_sweep = now + self.sweep_interval
+            return True
+
+    def sweep(self, db: Session) -> int:
+        return db.execute(delete(_keys).where(_keys.c.expires_at <= datetime.utcnow())).rowcount
+
+
+idempotency_store = IdempotencyStore(
+    IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_CACHE_MAXSIZE, IDEMPOTENCY_CACHE_TTL_SECONDS, SWEEP_INTERVAL_SECONDS
+)
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    return idempotency_store
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_committed_keys(session: Session) -> None:
+    for store, key, stored in session.info.pop(PENDING_KEY, ()):
+        store.recent.set(key, stored)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _forget_uncommitted_keys(session: Session, transaction) -> None:
+    if transaction.parent is None:
+        session.info.pop(PENDING_KEY, None)
+
+
+def _check(stored: StoredResponse, fingerprint: str) -> StoredResponse:
+    if stored.fingerprint != fingerprint:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used for a different request",
+        )
+    return stored
+
+
+class Idempotency:
+    """The ``Idempotency-Key`` of one request; ``save`` is a no-op without one."""
+
+    def __init__(self, store: IdempotencyStore, key: Optional[str] = None, fingerprint: str = ""):
+        self.store = store
+        self.key = key
+        self.fingerprint = fingerprint
+
+    def claim(self, db: Session) -> None:
+        """Insert this key's row in the caller's transaction, before anything else is written.
+
+        A concurrent request holding the key makes this wait until its
+        transaction ends; raises :class:`IdempotentReplay` after rolling back if
+        it committed.
+        """
+
+        if self.key is None:
+            return
+        if self.store.sweep_due():
+            self.store.sweep(db)
+        expires_at = datetime.utcnow() + timedelta(seconds=self.store.ttl)
+        try:
+            db.execute(
+                insert(_keys).values(
+                    key=self.key, fingerprint=self.fingerprint, status_code=0, body=b"", expires_at=expires_at
+                )
+            )
+        except IntegrityError:
+            db.rollback()
+            winner = self.store.lookup(db, self.key)
+            if winner is None:
+                raise
+            raise IdempotentReplay(_check(winner, self.fingerprint))
+
+    def save(self, db: Session, content: Any, status_code: int = status.HTTP_200_OK) -> None:
+        """Store ``content`` as the claimed key's response in the caller's transaction."""
+
+        if self.key is None:
+            return
+        stored = StoredResponse(self.fingerprint, status_code, dumps(content))
+        db.execute(update(_keys).where(_keys.c.key == self.key).values(status_code=status_code, body=stored.body))
+        db.info.setdefault(PENDING_KEY, []).append((self.store, self.key, stored))
+
+
+async def _keyed_request(
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=MAX_KEY_LENGTH),
+) -> Optional[Tuple[str, str]]:
+    if idempotency_key is None:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (request.method, request.url.path, str(sorted(request.query_params.multi_items()))):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    digest.update(await request.body())
+    return idempotency_key, digest.hexdigest()
+
+
+async def get_idempotency(
+    keyed: Optional[Tuple[str, str]] = Depends(_keyed_request),
+    db: AsyncSession = Depends(get_async_db),
+    store: IdempotencyStore = Depends(get_idempotency_store),
+) -> Idempotency:
+    """Replay the stored response for a known key; otherwise claim it and hand it to the handler."""
+
+    if keyed is None:
+        return Idempotency(store)
+    key, fingerprint = keyed
+    stored = await db.run_sync(store.lookup, key)
+    if stored is not None:
+        raise IdempotentReplay(_check(stored, fingerprint))
+    idempotency = Idempotency(store, key, fingerprint)
+    await db.run_sync(idempotency.claim)
+    return idempotency
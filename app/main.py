@@ -1,229 +1,864 @@
-from collections import defaultdict
-from datetime import datetime
-from typing import List
-
-from fastapi import Depends, FastAPI, HTTPException, status
-from sqlalchemy.orm import Session
-
-from . import models, schemas
-from .database import Base, engine
-from .dependencies import ensure_role, get_db
-
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="Beamtime Management API")
-
-
-@app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = models.User(**user.dict())
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
-
-
-@app.put("/users/{user_id}", response_model=schemas.User)
-def update_user(user_id: int, payload: schemas.UserUpdate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import analytics, counters, models, queries, reports, scheduler, schemas, writes
+from .analytics import ColumnCache, Granularity, ShareGrouping, analysis_window, get_column_cache
+from .cache import TTLCache
+from .calendars import CalendarDetail, build_calendar, calendar_query, calendar_window, longest_slot_query
+from .changes import change_feed
+from .conflicts import SlotConflict, find_conflicts, slot_bounds, slot_index
+from .config import Settings
+from .database import async_engine, engine, pool_status, prepare_schema, settings
+from .dependencies import ensure_role_async, get_async_db, get_role_cache
+from .events import EventBus, EventFilter, get_event_bus, sse_stream
+from .export import (
+    ALLOCATION_COLUMNS,
+    MONTHLY_COLUMNS,
+    ExportFormat,
+    allocation_export_query,
+    monthly_export_query,
+    stream_export,
+)
+from .idempotency import Idempotency, IdempotentReplay, get_idempotency, replay_response
+from .metrics import MetricsMiddleware, memory_gauges, registry, run_in_threadpool
+from .pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    filter_allocations,
+    paginate,
+    stream_ndjson,
+)
+from .response_cache import ResponseCache, get_response_cache
+from .search import DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT, SearchKind, search
+from .serialization import FastJSONResponse, dumps, records
+
+# Tables whose committed writes invalidate each cached listing.
+MANAGER_REQUESTS_TABLES = (
+    models.User.__tablename__,
+    models.ResearchProject.__tablename__,
+    models.BeamtimeRequest.__tablename__,
+)
+ALLOCATION_TABLE_TABLES = (
+    models.Allocation.__tablename__,
+    models.BeamtimeRequest.__tablename__,
+    models.ResearchProject.__tablename__,
+)
+
+router = APIRouter()
+
+
+@router.post("/users/", response_model=schemas.User)
+async def create_user(
+    user: schemas.UserCreate,
+    db: AsyncSession = Depends(get_async_db),
+    idempotency: Idempotency = Depends(get_idempotency),
+):
+    created = schemas.User.from_orm(await db.run_sync(writes.insert_returning, models.User, user.dict()))
+    await db.run_sync(idempotency.save, created)
+    await db.commit()
+    return created
+
+
+@router.put("/users/{user_id}", response_model=schemas.User)
+async def update_user(
+    user_id: int,
+    payload: schemas.UserUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+):
+    db_user = await db.run_sync(writes.update_returning, models.User, user_id, payload.dict(exclude_unset=True))
     if not db_user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    for field, value in payload.dict(exclude_unset=True).items():
-        setattr(db_user, field, value)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    updated = schemas.User.from_orm(db_user)
+    change_feed.publish(db, models.ChangeChannel.USER, [user_id])
+    await db.commit()
+    roles.invalidate(user_id)
+    return updated
+
+
+@router.get("/cache/roles", response_model=schemas.CacheStats)
+async def role_cache_stats(roles: TTLCache = Depends(get_role_cache)):
+    return roles.stats()
+
+
+@router.get("/database/pool", response_model=schemas.DatabasePoolStatus)
+async def database_pool_status():
+    return {"sync_pool": pool_status(engine), "async_pool": pool_status(async_engine)}
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(roles: TTLCache = Depends(get_role_cache)):
+    gauges = memory_gauges()
+    cache = roles.stats()
+    for field in ("size", "hits", "misses"):
+        gauges.append((f"beamtime_role_cache_{field}", f"Role cache {field}.", {}, cache[field]))
+    for name, pool_engine in (("sync", engine), ("async", async_engine)):
+        for field, value in pool_status(pool_engine).items():
+            if field != "pool_class":
+                gauges.append((f"beamtime_db_pool_{field}", f"Connection pool {field}.", {"pool": name}, value))
+    return PlainTextResponse(registry.render(gauges), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/events", response_class=StreamingResponse)
+async def events(
+    request: Request,
+    beamline: Optional[str] = None,
+    project_id: Optional[int] = None,
+    manager_id: Optional[int] = None,
+    last_event_id: Optional[int] = None,
+    bus: EventBus = Depends(get_event_bus),
+):
+    """Server-sent allocation and request status events.
+
+    Resumes after ``Last-Event-ID`` (sent by ``EventSource`` on reconnect) or the
+    ``last_event_id`` query parameter.  The bus and its event ids live in one
+    process, so the stream is refused while the cross-worker change feed runs:
+    a client would miss other workers' events and could not resume reliably.
+    """
+
+    if change_feed.enabled:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="/events is only available with a single worker",
+        )
+    header = request.headers.get("last-event-id")
+    if header:
+        try:
+            last_event_id = int(header)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Last-Event-ID")
+    filters = EventFilter(beamline=beamline, project_id=project_id, manager_id=manager_id)
+    return StreamingResponse(
+        sse_stream(bus, filters, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
-@app.get("/users/{user_id}/projects", response_model=List[schemas.Project])
-def list_projects_for_pi(user_id: int, db: Session = Depends(get_db)):
-    ensure_role(db, user_id, models.UserRole.PI)
-    return db.query(models.ResearchProject).filter(models.ResearchProject.pi_id == user_id).all()
+@router.get("/users/{user_id}/projects", response_model=List[schemas.Project])
+async def list_projects_for_pi(
+    user_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+):
+    await ensure_role_async(db, user_id, models.UserRole.PI, roles)
+    rows = (await db.execute(queries.project_rows().where(models.ResearchProject.pi_id == user_id))).all()
+    return FastJSONResponse(records(rows))
 
 
-@app.post("/projects/", response_model=schemas.Project)
-def create_project(project: schemas.ProjectCreate, db: Session = Depends(get_db)):
-    ensure_role(db, project.manager_id, models.UserRole.PROJECT_MANAGER)
-    ensure_role(db, project.pi_id, models.UserRole.PI)
-    db_project = models.ResearchProject(**project.dict())
-    db.add(db_project)
-    db.commit()
-    db.refresh(db_project)
-    return db_project
+@router.get("/users/{user_id}/summary", response_model=schemas.StatusSummary)
+async def pi_summary(
+    user_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+):
+    await ensure_role_async(db, user_id, models.UserRole.PI, roles)
+    return counters.summary((await db.execute(counters.pi_counts(user_id))).all())
 
 
-@app.put("/projects/{project_id}", response_model=schemas.Project)
-def update_project(project_id: int, payload: schemas.ProjectUpdate, db: Session = Depends(get_db)):
-    db_project = db.query(models.ResearchProject).filter(models.ResearchProject.id == project_id).first()
+@router.post("/projects/", response_model=schemas.Project)
+async def create_project(
+    project: schemas.ProjectCreate,
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+    idempotency: Idempotency = Depends(get_idempotency),
+):
+    await ensure_role_async(db, project.manager_id, models.UserRole.PROJECT_MANAGER, roles)
+    await ensure_role_async(db, project.pi_id, models.UserRole.PI, roles)
+    db_project = await db.run_sync(writes.insert_returning, models.ResearchProject, project.dict())
+    created = schemas.Project.from_orm(db_project)
+    await db.run_sync(idempotency.save, created)
+    await db.commit()
+    return created
+
+
+@router.put("/projects/{project_id}", response_model=schemas.Project)
+async def update_project(
+    project_id: int,
+    payload: schemas.ProjectUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+):
+    update_data = payload.dict(exclude_unset=True)
+    previous_manager_id = None
+    if "manager_id" in update_data:
+        previous_manager_id = await db.scalar(
+            select(models.ResearchProject.manager_id).where(models.ResearchProject.id == project_id)
+        )
+    db_project = await db.run_sync(writes.update_returning, models.ResearchProject, project_id, update_data)
     if not db_project:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found")
-    update_data = payload.dict(exclude_unset=True)
+    # Role checks come after the write so that an unknown project is still a 404;
+    # raising here leaves the UPDATE uncommitted.
     if "manager_id" in update_data:
-        ensure_role(db, update_data["manager_id"], models.UserRole.PROJECT_MANAGER)
+        await ensure_role_async(db, update_data["manager_id"], models.UserRole.PROJECT_MANAGER, roles)
     if "pi_id" in update_data:
-        ensure_role(db, update_data["pi_id"], models.UserRole.PI)
-    for field, value in update_data.items():
-        setattr(db_project, field, value)
-    db.commit()
-    db.refresh(db_project)
-    return db_project
+        await ensure_role_async(db, update_data["pi_id"], models.UserRole.PI, roles)
+    if previous_manager_id is not None:
+        await db.run_sync(counters.record_manager_change, project_id, previous_manager_id, db_project.manager_id)
+    updated = schemas.Project.from_orm(db_project)
+    await db.commit()
+    return updated
 
 
-@app.delete("/projects/{project_id}")
-def delete_project(project_id: int, db: Session = Depends(get_db)):
-    db_project = db.query(models.ResearchProject).filter(models.ResearchProject.id == project_id).first()
+@router.delete("/projects/{project_id}")
+async def delete_project(project_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_project = await db.get(models.ResearchProject, project_id)
     if not db_project:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found")
-    db.delete(db_project)
-    db.commit()
+    await db.delete(db_project)
+    await db.commit()
     return {"detail": "Project deleted"}
 
 
-@app.post("/projects/{project_id}/requests", response_model=schemas.BeamtimeRequest)
-def create_request(project_id: int, payload: schemas.BeamtimeRequestCreate, pi_id: int, db: Session = Depends(get_db)):
-    project = db.query(models.ResearchProject).filter(models.ResearchProject.id == project_id).first()
-    if not project:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found")
-    ensure_role(db, pi_id, models.UserRole.PI)
-    if project.pi_id != pi_id:
+@router.post("/projects/{project_id}/requests", response_model=schemas.BeamtimeRequest)
+async def create_request(
+    project_id: int,
+    payload: schemas.BeamtimeRequestCreate,
+    pi_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+    idempotency: Idempotency = Depends(get_idempotency),
+):
+    inserted = await db.run_sync(writes.insert_request_for_pi, project_id, pi_id, payload.dict())
+    if inserted is None:
+        owner = await db.scalar(
+            select(models.ResearchProject.pi_id).where(models.ResearchProject.id == project_id)
+        )
+        if owner is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found")
+    await ensure_role_async(db, pi_id, models.UserRole.PI, roles)
+    if inserted is None:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="PI does not own project")
-    db_request = models.BeamtimeRequest(project_id=project_id, **payload.dict())
-    db.add(db_request)
-    db.commit()
-    db.refresh(db_request)
-    return db_request
+    db_request, manager_id = inserted
+    await db.run_sync(reports.record_request_created, db_request)
+    await db.run_sync(counters.record_request_created, project_id, manager_id, db_request.status)
+    created = schemas.BeamtimeRequest.from_orm(db_request)
+    await db.run_sync(idempotency.save, created)
+    await db.commit()
+    return created
+
+
+@router.get("/projects/{project_id}/summary", response_model=schemas.StatusSummary)
+async def project_summary(project_id: int, db: AsyncSession = Depends(get_async_db)):
+    rows = (await db.execute(counters.project_counts(project_id))).all()
+    if not rows:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found")
+    return counters.summary(rows)
 
 
-@app.get("/projects/{project_id}/requests", response_model=List[schemas.BeamtimeRequest])
-def list_requests(project_id: int, db: Session = Depends(get_db)):
-    project = db.query(models.ResearchProject).filter(models.ResearchProject.id == project_id).first()
-    if not project:
+@router.get("/projects/{project_id}/requests", response_model=List[schemas.BeamtimeRequest])
+async def list_requests(project_id: int, db: AsyncSession = Depends(get_async_db)):
+    rows = (await db.execute(queries.project_requests(project_id))).all()
+    if not rows:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found")
-    return db.query(models.BeamtimeRequest).filter(models.BeamtimeRequest.project_id == project_id).all()
+    return FastJSONResponse(records([row for row in rows if row.id is not None], queries.REQUEST_FIELDS))
 
 
-@app.get("/managers/{manager_id}/requests", response_model=List[schemas.BeamtimeRequest])
-def manager_requests(manager_id: int, db: Session = Depends(get_db)):
-    ensure_role(db, manager_id, models.UserRole.PROJECT_MANAGER)
-    project_ids = [p.id for p in db.query(models.ResearchProject).filter(models.ResearchProject.manager_id == manager_id)]
-    if not project_ids:
-        return []
-    return db.query(models.BeamtimeRequest).filter(models.BeamtimeRequest.project_id.in_(project_ids)).all()
+@router.get("/managers/{manager_id}/requests", response_model=List[schemas.BeamtimeRequest])
+async def manager_requests(
+    manager_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+    cache: ResponseCache = Depends(get_response_cache),
+):
+    async def build():
+        await ensure_role_async(db, manager_id, models.UserRole.PROJECT_MANAGER, roles)
+        rows = (await db.execute(queries.manager_requests(manager_id))).all()
+        return records(rows), {}
+
+    return await cache.respond(request, MANAGER_REQUESTS_TABLES, build)
+
+
+@router.get("/managers/{manager_id}/summary", response_model=schemas.StatusSummary)
+async def manager_summary(
+    manager_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+):
+    await ensure_role_async(db, manager_id, models.UserRole.PROJECT_MANAGER, roles)
+    rows = await db.execute(counters.owner_counts(models.CounterScope.MANAGER, str(manager_id)))
+    return counters.summary(rows.all())
+
+
+@router.get("/beamlines/{beamline}/summary", response_model=schemas.StatusSummary)
+async def beamline_summary(beamline: str, db: AsyncSession = Depends(get_async_db)):
+    rows = await db.execute(counters.owner_counts(models.CounterScope.BEAMLINE, beamline))
+    return counters.summary(rows.all(), kinds=(models.RollupKind.ALLOCATION,))
+
+
+@router.get("/beamlines/{beamline}/calendar", response_model=schemas.BeamlineCalendar)
+async def beamline_calendar(
+    beamline: str,
+    request: Request,
+    start: date,
+    end: date,
+    detail: CalendarDetail = CalendarDetail.SLOTS,
+    db: AsyncSession = Depends(get_async_db),
+    cache: ResponseCache = Depends(get_response_cache),
+):
+    """Bookings of one beamline grouped by day as parallel arrays; ``detail=hours`` for month/year zoom."""
 
+    window = calendar_window(start, end)
+    tables = ALLOCATION_TABLE_TABLES if detail is CalendarDetail.SLOTS else analytics.SLOT_TABLES
 
-@app.patch("/requests/{request_id}/status", response_model=schemas.BeamtimeRequest)
-def update_request_status(
+    async def build():
+        longest = await db.scalar(longest_slot_query(beamline))
+        rows = (await db.execute(calendar_query(beamline, window, detail, longest or 0))).all()
+        return build_calendar(rows, beamline, window, detail), {}
+
+    return await cache.respond(request, tables, build)
+
+
+@router.patch("/requests/{request_id}/status", response_model=schemas.BeamtimeRequest)
+async def update_request_status(
     request_id: int,
     payload: schemas.BeamtimeRequestUpdate,
     manager_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+    bus: EventBus = Depends(get_event_bus),
 ):
-    ensure_role(db, manager_id, models.UserRole.PROJECT_MANAGER)
-    db_request = db.query(models.BeamtimeRequest).filter(models.BeamtimeRequest.id == request_id).first()
+    await ensure_role_async(db, manager_id, models.UserRole.PROJECT_MANAGER, roles)
+    db_request = (await db.scalars(queries.request_with_project(request_id))).first()
     if not db_request:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Request not found")
     project = db_request.project
     if project.manager_id != manager_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Manager not assigned to project")
+    previous_status = db_request.status
     db_request.status = payload.status
-    db.commit()
-    db.refresh(db_request)
-    return db_request
+    await db.run_sync(reports.record_request_status_change, db_request, previous_status)
+    await db.run_sync(
+        counters.record_request_status_change, project.id, project.manager_id, previous_status, payload.status
+    )
+    updated = schemas.BeamtimeRequest.from_orm(db_request)
+    await db.commit()
+    bus.publish("request.status_changed", updated, project_id=updated.project_id, manager_id=manager_id)
+    return updated
 
 
-@app.post("/requests/{request_id}/allocations", response_model=schemas.Allocation)
-def create_allocation(
+@router.post("/requests/{request_id}/allocations", response_model=schemas.Allocation)
+async def create_allocation(
     request_id: int,
     payload: schemas.AllocationCreate,
     allocator_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+    bus: EventBus = Depends(get_event_bus),
+    idempotency: Idempotency = Depends(get_idempotency),
 ):
-    ensure_role(db, allocator_id, models.UserRole.ALLOCATOR)
-    request = db.query(models.BeamtimeRequest).filter(models.BeamtimeRequest.id == request_id).first()
-    if not request:
+    await ensure_role_async(db, allocator_id, models.UserRole.ALLOCATOR, roles)
+    owner = (await db.execute(queries.request_owner(request_id))).first()
+    if not owner:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Request not found")
-    db_allocation = models.Allocation(request_id=request_id, **payload.dict())
-    db.add(db_allocation)
-    db.commit()
-    db.refresh(db_allocation)
-    return db_allocation
-
+    start, end = slot_bounds(payload.slot_date, payload.slot_time, payload.duration_hours)
+    await db.run_sync(change_feed.claim, [payload.beamline])
+    try:
+        slot = await db.run_sync(slot_index.reserve, payload.beamline, start, end)
+    except SlotConflict as exc:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": str(exc), "conflicting_allocation_ids": exc.allocation_ids},
+        )
+    db_allocation = await db.run_sync(
+        writes.insert_returning, models.Allocation, {"request_id": request_id, **payload.dict()}
+    )
+    slot.allocation_id = db_allocation.id
+    await db.run_sync(reports.record_allocation_created, db_allocation)
+    await db.run_sync(
+        counters.record_allocations_created,
+        [(owner.project_id, owner.manager_id, db_allocation.beamline, db_allocation.status)],
+    )
+    created = schemas.Allocation.from_orm(db_allocation)
+    await db.run_sync(idempotency.save, created)
+    await db.commit()
+    bus.publish(
+        "allocation.created",
+        created,
+        beamline=created.beamline,
+        project_id=owner.project_id,
+        manager_id=owner.manager_id,
+    )
+    return created
 
-@app.get("/allocations/", response_model=List[schemas.Allocation])
-def list_allocations(db: Session = Depends(get_db)):
-    return db.query(models.Allocation).all()
 
+@router.post("/allocations/bulk", response_model=schemas.AllocationBulkResult)
+async def bulk_create_allocations(
+    payload: schemas.AllocationBulkCreate,
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+    bus: EventBus = Depends(get_event_bus),
+    idempotency: Idempotency = Depends(get_idempotency),
+):
+    await ensure_role_async(db, payload.allocator_id, models.UserRole.ALLOCATOR, roles)
+    request_ids = {item.request_id for item in payload.items}
+    # Request id -> (project id, manager id), for existence checks and event routing.
+    existing = {
+        request_id: (project_id, manager_id)
+        for request_id, project_id, manager_id in await db.execute(
+            select(models.BeamtimeRequest.id, models.ResearchProject.id, models.ResearchProject.manager_id)
+            .join(models.ResearchProject, models.ResearchProject.id == models.BeamtimeRequest.project_id)
+            .where(models.BeamtimeRequest.id.in_(request_ids))
+        )
+    }
+
+    errors = []
+    rows = []
+    slots = []
+    await db.run_sync(change_feed.claim, {item.beamline for item in payload.items})
+    for index, item in enumerate(payload.items):
+        if item.request_id not in existing:
+            errors.append({"index": index, "detail": "Request not found"})
+            continue
+        start, end = slot_bounds(item.slot_date, item.slot_time, item.duration_hours)
+        try:
+            slots.append(await db.run_sync(slot_index.reserve, item.beamline, start, end))
+        except SlotConflict as exc:
+            errors.append(
+                {"index": index, "detail": str(exc), "conflicting_allocation_ids": exc.allocation_ids}
+            )
+            continue
+        rows.append(item.dict())
+
+    if errors and payload.atomic:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Batch rejected", "errors": errors},
+        )
 
-@app.get("/allocations/table", response_model=List[schemas.AllocationTableRow])
-def allocation_table(db: Session = Depends(get_db)):
-    allocations = (
-        db.query(models.Allocation, models.ResearchProject)
-        .join(models.BeamtimeRequest, models.BeamtimeRequest.id == models.Allocation.request_id)
-        .join(models.ResearchProject, models.ResearchProject.id == models.BeamtimeRequest.project_id)
-        .all()
-    )
-    table = [
-        schemas.AllocationTableRow(
-            project_title=project.title,
+    created = []
+    if rows:
+        allocations = (
+            await db.scalars(
+                insert(models.Allocation).returning(models.Allocation, sort_by_parameter_order=True),
+                rows,
+            )
+        ).all()
+        for slot, allocation in zip(slots, allocations):
+            slot.allocation_id = allocation.id
+        await db.run_sync(reports.record_allocations_created, allocations)
+        await db.run_sync(
+            counters.record_allocations_created,
+            (
+                (*existing[allocation.request_id], allocation.beamline, allocation.status)
+                for allocation in allocations
+            ),
+        )
+        # Serialize before commit expires the returned rows.
+        created = [schemas.Allocation.from_orm(allocation) for allocation in allocations]
+    result = {"created": created, "errors": errors}
+    await db.run_sync(idempotency.save, result)
+    await db.commit()
+    for allocation in created:
+        project_id, manager_id = existing[allocation.request_id]
+        bus.publish(
+            "allocation.created",
+            allocation,
             beamline=allocation.beamline,
-            slot_date=allocation.slot_date,
-            slot_time=allocation.slot_time,
-            duration_hours=allocation.duration_hours,
-            status=allocation.status,
+            project_id=project_id,
+            manager_id=manager_id,
         )
-        for allocation, project in allocations
-    ]
-    return table
+    return result
+
+
+@router.post("/allocations/schedule", response_model=schemas.ScheduleProposal)
+async def propose_schedule(
+    payload: schemas.ScheduleProposalCreate,
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+):
+    """Draft a conflict-free schedule for approved, unallocated requests.
+
+    Nothing is written; post the returned ``items`` to ``/allocations/bulk`` to book them.
+    """
 
+    await ensure_role_async(db, payload.allocator_id, models.UserRole.ALLOCATOR, roles)
+    free, candidates = await db.run_sync(
+        scheduler.schedule_inputs, payload.start, payload.end, payload.beamlines, payload.blackouts, payload.request_ids
+    )
+    return await run_in_threadpool(
+        scheduler.draft_schedule, payload.start, free, candidates, payload.step_hours, payload.max_shift_hours
+    )
 
-@app.post("/allocations/{allocation_id}/approve", response_model=schemas.Approval)
-def approve_allocation(
+
+@router.post("/allocations/conflicts", response_model=List[schemas.SlotConflictResult])
+async def check_allocation_conflicts(
+    payload: List[schemas.AllocationCreate], db: AsyncSession = Depends(get_async_db)
+):
+    return await db.run_sync(find_conflicts, payload)
+
+
+@router.get("/allocations/", response_model=List[schemas.Allocation])
+async def list_allocations(
+    beamline: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+):
+    query = filter_allocations(queries.allocation_rows(), beamline, start, end, cursor)
+    if stream:
+        return stream_ndjson(db, query, lambda row: dumps(row._asdict()))
+    allocations, next_cursor = await paginate(
+        db, query, limit, key=lambda allocation: (allocation.slot_date, allocation.id)
+    )
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return FastJSONResponse(records(allocations), headers=headers)
+
+
+@router.get("/allocations/table", response_model=List[schemas.AllocationTableRow])
+async def allocation_table(
+    request: Request,
+    beamline: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    cache: ResponseCache = Depends(get_response_cache),
+):
+    query = filter_allocations(queries.allocation_table_rows(), beamline, start, end, cursor)
+    if stream:
+        fields = queries.ALLOCATION_TABLE_FIELDS
+        return stream_ndjson(db, query, lambda row: dumps(dict(zip(fields, row))))
+
+    async def build():
+        rows, next_cursor = await paginate(db, query, limit, key=lambda row: (row.slot_date, row.id))
+        headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+        return records(rows, queries.ALLOCATION_TABLE_FIELDS), headers
+
+    return await cache.respond(request, ALLOCATION_TABLE_TABLES, build)
+
+
+@router.post("/allocations/{allocation_id}/approve", response_model=schemas.Approval)
+async def approve_allocation(
     allocation_id: int,
     payload: schemas.ApprovalCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+    bus: EventBus = Depends(get_event_bus),
+    idempotency: Idempotency = Depends(get_idempotency),
 ):
-    ensure_role(db, payload.approver_id, models.UserRole.APPROVER)
-    allocation = db.query(models.Allocation).filter(models.Allocation.id == allocation_id).first()
+    await ensure_role_async(db, payload.approver_id, models.UserRole.APPROVER, roles)
+    allocation = (await db.scalars(queries.allocation_with_project(allocation_id))).first()
     if not allocation:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Allocation not found")
-    approval = models.Approval(allocation_id=allocation_id, **payload.dict())
-    db.add(approval)
+    approval = schemas.Approval.from_orm(
+        await db.run_sync(
+            writes.insert_returning, models.Approval, {"allocation_id": allocation_id, **payload.dict()}
+        )
+    )
+    project = allocation.request.project
     if payload.approved:
+        previous_status = allocation.status
         allocation.status = models.AllocationStatus.CONFIRMED
-    db.commit()
-    db.refresh(approval)
+        await db.run_sync(reports.record_allocation_status_change, allocation, previous_status)
+        await db.run_sync(
+            counters.record_allocation_status_changes,
+            [(project.id, project.manager_id, allocation.beamline, previous_status)],
+            models.AllocationStatus.CONFIRMED,
+        )
+    event = {"allocation_id": allocation_id, "status": allocation.status, "approval": approval}
+    routing = {"beamline": allocation.beamline, "project_id": project.id, "manager_id": project.manager_id}
+    await db.run_sync(idempotency.save, approval)
+    await db.commit()
+    bus.publish("allocation.approved" if payload.approved else "allocation.rejected", event, **routing)
     return approval
 
 
-@app.get("/reports/monthly", response_model=List[schemas.MonthlyReportItem])
-def monthly_report(year: int, db: Session = Depends(get_db)):
-    report = defaultdict(lambda: {"requests": 0, "allocations": 0})
-    start = datetime(year, 1, 1)
-    end = datetime(year, 12, 31, 23, 59, 59)
+@router.post("/allocations/approvals", response_model=schemas.ApprovalBatchResult)
+async def approve_allocations(
+    payload: schemas.ApprovalBatchCreate,
+    db: AsyncSession = Depends(get_async_db),
+    roles: TTLCache = Depends(get_role_cache),
+    bus: EventBus = Depends(get_event_bus),
+    idempotency: Idempotency = Depends(get_idempotency),
+):
+    """Approve or reject many allocations in one transaction.
+
+    Approved allocations are confirmed with a single ``UPDATE``; every decision
+    on an existing allocation records an ``Approval`` row.
+    """
+
+    await ensure_role_async(db, payload.approver_id, models.UserRole.APPROVER, roles)
+    decisions = {decision.allocation_id: decision for decision in payload.decisions}
+    allocation = models.Allocation
+    rows = {
+        row.id: row
+        for row in await db.execute(
+            select(
+                allocation.id,
+                allocation.beamline,
+                allocation.status,
+                allocation.created_at,
+                models.ResearchProject.id.label("project_id"),
+                models.ResearchProject.manager_id,
+            )
+            .join(models.BeamtimeRequest, models.BeamtimeRequest.id == allocation.request_id)
+            .join(models.ResearchProject, models.ResearchProject.id == models.BeamtimeRequest.project_id)
+            .where(allocation.id.in_(decisions))
+            .with_for_update(of=allocation)
+        )
+    }
+
+    confirmed = [row for allocation_id, row in rows.items() if decisions[allocation_id].approved]
+    if confirmed:
+        await db.execute(
+            update(allocation)
+            .where(allocation.id.in_([row.id for row in confirmed]))
+            .values(status=models.AllocationStatus.CONFIRMED),
+            execution_options={"synchronize_session": False},
+        )
+        await db.run_sync(
+            reports.record_allocation_status_changes,
+            [(row.created_at, row.beamline, row.status) for row in confirmed],
+            models.AllocationStatus.CONFIRMED,
+        )
+        await db.run_sync(
+            counters.record_allocation_status_changes,
+            [(row.project_id, row.manager_id, row.beamline, row.status) for row in confirmed],
+            models.AllocationStatus.CONFIRMED,
+        )
 
-    requests = (
-        db.query(models.BeamtimeRequest)
-        .filter(models.BeamtimeRequest.created_at.between(start, end))
-        .all()
-    )
-    for req in requests:
-        month = req.created_at.strftime("%Y-%m")
-        report[month]["requests"] += 1
-
-    allocations = (
-        db.query(models.Allocation)
-        .filter(models.Allocation.created_at.between(start, end))
-        .all()
+    approval_ids = {}
+    if rows:
+        inserted = await db.execute(
+            # A Core insert keeps NULL notes in the parameter sets, so all rows share one
+            # multi-row statement; rows come back keyed by allocation id, in any order.
+            insert(models.Approval.__table__).returning(models.Approval.allocation_id, models.Approval.id),
+            [
+                {
+                    "allocation_id": allocation_id,
+                    "approver_id": payload.approver_id,
+                    "approved": decisions[allocation_id].approved,
+                    "notes": decisions[allocation_id].notes,
+                }
+                for allocation_id in rows
+            ],
+        )
+        approval_ids = dict(inserted.all())
+
+    results = []
+    for decision in payload.decisions:
+        row = rows.get(decision.allocation_id)
+        if row is None:
+            results.append({"allocation_id": decision.allocation_id, "outcome": "not_found"})
+            continue
+        results.append(
+            {
+                "allocation_id": decision.allocation_id,
+                "outcome": "approved" if decision.approved else "rejected",
+                "approval_id": approval_ids[decision.allocation_id],
+                "status": models.AllocationStatus.CONFIRMED if decision.approved else row.status,
+            }
+        )
+    outcomes = Counter(result["outcome"] for result in results)
+    summary = {
+        "approved": outcomes["approved"],
+        "rejected": outcomes["rejected"],
+        "not_found": outcomes["not_found"],
+        "results": results,
+    }
+    await db.run_sync(idempotency.save, summary)
+    await db.commit()
+
+    for result in results:
+        row = rows.get(result["allocation_id"])
+        if row is None:
+            continue
+        bus.publish(
+            f"allocation.{result['outcome']}",
+            {"allocation_id": row.id, "status": result["status"], "approval_id": result["approval_id"]},
+            beamline=row.beamline,
+            project_id=row.project_id,
+            manager_id=row.manager_id,
+        )
+    return summary
+
+
+@router.get("/reports/monthly", response_model=List[schemas.MonthlyReportItem])
+async def monthly_report(year: int, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(reports.monthly_counts, year)
+
+
+@router.get("/reports/monthly/rollup", response_model=List[schemas.MonthlyRollupItem])
+async def monthly_rollup(
+    start_year: int,
+    end_year: Optional[int] = None,
+    kind: Optional[models.RollupKind] = None,
+    beamline: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await db.run_sync(reports.rollup_rows, start_year, end_year or start_year, kind, beamline)
+
+
+@router.get("/search", response_model=List[schemas.SearchHit])
+async def search_texts(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=500),
+    kind: Optional[SearchKind] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Projects (title, description) and requests (justification) matching every keyword, best first."""
+
+    kinds = [kind] if kind else list(SearchKind)
+    hits, next_cursor = await search(db, q, kinds, limit, cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return hits
+
+
+@router.get("/analytics/utilization", response_model=schemas.UtilizationReport)
+async def beamline_utilization(
+    request: Request,
+    start: date,
+    end: date,
+    beamline: Optional[str] = None,
+    granularity: Granularity = Granularity.WEEK,
+    db: AsyncSession = Depends(get_async_db),
+    cache: ResponseCache = Depends(get_response_cache),
+    columns: ColumnCache = Depends(get_column_cache),
+):
+    window = analysis_window(start, end)
+
+    async def build():
+        slots = await columns.slots(db)
+        return await run_in_threadpool(analytics.utilization, slots, window, beamline, granularity), {}
+
+    return await cache.respond(request, analytics.SLOT_TABLES, build)
+
+
+@router.get("/analytics/gaps", response_model=List[schemas.BeamlineIdleGaps])
+async def beamline_idle_gaps(
+    request: Request,
+    start: date,
+    end: date,
+    beamline: Optional[str] = None,
+    min_hours: int = Query(1, ge=1),
+    db: AsyncSession = Depends(get_async_db),
+    cache: ResponseCache = Depends(get_response_cache),
+    columns: ColumnCache = Depends(get_column_cache),
+):
+    window = analysis_window(start, end)
+
+    async def build():
+        slots = await columns.slots(db)
+        return await run_in_threadpool(analytics.idle_gaps, slots, window, beamline, min_hours), {}
+
+    return await cache.respond(request, analytics.SLOT_TABLES, build)
+
+
+@router.get("/analytics/oversubscription", response_model=schemas.OversubscriptionReport)
+async def beamtime_oversubscription(
+    request: Request,
+    start: date,
+    end: date,
+    granularity: Granularity = Granularity.MONTH,
+    db: AsyncSession = Depends(get_async_db),
+    cache: ResponseCache = Depends(get_response_cache),
+    columns: ColumnCache = Depends(get_column_cache),
+):
+    window = analysis_window(start, end)
+
+    async def build():
+        slots, requests = await columns.slots(db), await columns.requests(db)
+        return await run_in_threadpool(analytics.oversubscription, slots, requests, window, granularity), {}
+
+    return await cache.respond(request, analytics.SLOT_TABLES + analytics.REQUEST_TABLES, build)
+
+
+@router.get("/analytics/shares", response_model=schemas.BeamtimeShareReport)
+async def beamtime_shares(
+    request: Request,
+    start: date,
+    end: date,
+    by: ShareGrouping = ShareGrouping.PI,
+    beamline: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+    cache: ResponseCache = Depends(get_response_cache),
+    columns: ColumnCache = Depends(get_column_cache),
+):
+    window = analysis_window(start, end)
+
+    async def build():
+        slots, requests = await columns.slots(db), await columns.requests(db)
+        return await run_in_threadpool(analytics.shares, slots, requests, window, beamline, by, limit), {}
+
+    return await cache.respond(request, analytics.SLOT_TABLES + analytics.REQUEST_TABLES, build)
+
+
+@router.get("/exports/allocations")
+async def export_allocations(
+    beamline: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    export_format: ExportFormat = Query(ExportFormat.CSV, alias="format"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    query = allocation_export_query(beamline, start, end)
+    return stream_export(db, query, ALLOCATION_COLUMNS, export_format, "allocations")
+
+
+@router.get("/exports/monthly")
+async def export_monthly_rollup(
+    start_year: int,
+    end_year: Optional[int] = None,
+    kind: Optional[models.RollupKind] = None,
+    beamline: Optional[str] = None,
+    export_format: ExportFormat = Query(ExportFormat.CSV, alias="format"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    query = monthly_export_query(start_year, end_year or start_year, kind, beamline)
+    return stream_export(db, query, MONTHLY_COLUMNS, export_format, "monthly_rollup")
+
+
+def create_app(app_settings: Optional[Settings] = None) -> FastAPI:
+    """Build the API application.
+
+    Database engines are process-wide and come from ``app.database``;
+    ``app_settings`` controls startup schema handling, the cross-worker change
+    feed and the profiler.  The schema step runs once in the lifespan hook
+    instead of at import time.
+    """
+
+    app_settings = app_settings or settings
+
+    @asynccontextmanager
+    async def lifespan(application: FastAPI):
+        await run_in_threadpool(prepare_schema, engine, app_settings.schema_on_startup)
+        if app_settings.cross_worker_invalidation:
+            await run_in_threadpool(change_feed.start, engine, app_settings.invalidation_poll_ms / 1000)
+        yield
+        change_feed.stop()
+        await async_engine.dispose()
+        engine.dispose()
+
+    application = FastAPI(title="Beamtime Management API", lifespan=lifespan)
+    application.add_middleware(
+        MetricsMiddleware,
+        profile_threshold_ms=app_settings.profile_slow_requests_ms,
+        profile_dir=app_settings.profile_dir,
+        profile_interval_ms=app_settings.profile_interval_ms,
     )
-    for allocation in allocations:
-        month = allocation.created_at.strftime("%Y-%m")
-        report[month]["allocations"] += 1
-
-    return [
-        schemas.MonthlyReportItem(
-            month=month,
-            request_count=data["requests"],
-            allocation_count=data["allocations"],
-        )
-        for month, data in sorted(report.items())
-    ]
+    application.add_exception_handler(IdempotentReplay, replay_response)
+    application.include_router(router)
+    return application
+
+
+app = create_app()
@@ -0,0 +1,336 @@
+"""Per-route request metrics exported in the Prometheus text format.
+
+``MetricsMiddleware`` is a plain ASGI middleware that times each request,
+counts the bytes it sends and collects the SQL statements executed on its
+behalf.  Statements are attributed through a context variable that engine
+events update, so sync handlers running in the threadpool and streaming
+bodies are covered alike.  Process memory is exported as gauges next to the
+per-route histograms.
+
+When ``profile_slow_requests_ms`` is set, a background thread samples the
+stacks of threads that are working for a request: the event loop while the
+request's task is the one running, and threadpool workers started through
+:func:`run_in_threadpool` here.  Requests slower than the threshold dump their
+own samples as collapsed stacks (``frame;frame;frame count``) that
+``flamegraph.pl`` or speedscope read directly; the file is written from the
+threadpool.
+"""
+
+import asyncio
+import bisect
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import concurrency
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+class RequestStats:
+    __slots__ = ("statements", "sql_seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("beamtime_request_stats", default=None)
+
+# Who a thread is working for, read by the stack sampler: event loops by
+# thread, the request of each task running on them, and threadpool workers.
+_loops: Dict[int, asyncio.AbstractEventLoop] = {}
+_task_requests: Dict[asyncio.Task, RequestStats] = {}
+_thread_requests: Dict[int, RequestStats] = {}
+
+
+async def run_in_threadpool(func, *args, **kwargs):
+    """``fastapi.concurrency.run_in_threadpool`` that tells the sampler whose work the thread is doing."""
+
+    stats = _current_request.get()
+    if stats is None:
+        return await concurrency.run_in_threadpool(func, *args, **kwargs)
+
+    def attributed():
+        thread_id = threading.get_ident()
+        _thread_requests[thread_id] = stats
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _thread_requests.pop(thread_id, None)
+
+    return await concurrency.run_in_threadpool(attributed)
+
+
+def _owner(thread_id: int) -> Optional[RequestStats]:
+    owner = _thread_requests.get(thread_id)
+    if owner is None:
+        loop = _loops.get(thread_id)
+        if loop is not None:
+            owner = _task_requests.get(asyncio.current_task(loop))
+    return owner
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    if _current_request.get() is not None:
+        conn.info.setdefault("beamtime_statement_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _finish_statement(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_request.get()
+    started = conn.info.get("beamtime_statement_started")
+    if stats is None or not started:
+        return
+    stats.statements += 1
+    stats.sql_seconds += time.perf_counter() - started.pop()
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+    def lines(self, name: str, labels: str) -> Iterable[str]:
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        cumulative += self.counts[-1]
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.total}"
+        yield f"{name}_count{{{labels}}} {cumulative}"
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.sql_seconds = Histogram(LATENCY_BUCKETS)
+        self.response_bytes = Histogram(SIZE_BUCKETS)
+        self.responses: Counter = Counter()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        self._lock = threading.Lock()
+
+    def observe(
+        self, method: str, route: str, status: int, seconds: float, stats: RequestStats, size: int
+    ) -> None:
+        with self._lock:
+            metrics = self._routes.get((method, route))
+            if metrics is None:
+                metrics = self._routes[(method, route)] = RouteMetrics()
+            metrics.latency.observe(seconds)
+            metrics.statements.observe(stats.statements)
+            metrics.sql_seconds.observe(stats.sql_seconds)
+            metrics.response_bytes.observe(size)
+            metrics.responses[status] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+
+    def render(self, gauges: Iterable[Tuple[str, str, Dict[str, str], float]] = ()) -> str:
+        """Prometheus text exposition; ``gauges`` adds ``(name, help, labels, value)`` samples."""
+
+        families = (
+            ("beamtime_http_request_duration_seconds", "histogram", "Request latency.", "latency"),
+            ("beamtime_http_request_sql_statements", "histogram", "SQL statements per request.", "statements"),
+            ("beamtime_http_request_sql_seconds", "histogram", "Time spent in SQL per request.", "sql_seconds"),
+            ("beamtime_http_response_size_bytes", "histogram", "Response body size.", "response_bytes"),
+        )
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines: List[str] = []
+            lines.append("# HELP beamtime_http_requests_total Requests by route and status code.")
+            lines.append("# TYPE beamtime_http_requests_total counter")
+            for (method, route), metrics in routes:
+                for status, count in sorted(metrics.responses.items()):
+                    lines.append(
+                        f'beamtime_http_requests_total{{method="{method}",route="{_escape(route)}",'
+                        f'status="{status}"}} {count}'
+                    )
+            for name, kind, help_text, attribute in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (method, route), metrics in routes:
+                    labels = f'method="{method}",route="{_escape(route)}"'
+                    lines.extend(getattr(metrics, attribute).lines(name, labels))
+
+        seen = set()
+        # Samples of one metric family must be contiguous in the exposition.
+        for name, help_text, labels, value in sorted(gauges, key=lambda gauge: gauge[0]):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+            rendered = ",".join(f'{key}="{_escape(str(item))}"' for key, item in labels.items())
+            lines.append(f"{name}{{{rendered}}} {value}" if rendered else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def memory_gauges() -> List[Tuple[str, str, Dict[str, str], float]]:
+    gauges = []
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+        gauges.append(
+            (
+                "beamtime_process_resident_memory_bytes",
+                "Resident set size.",
+                {},
+                resident_pages * os.sysconf("SC_PAGE_SIZE"),
+            )
+        )
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:  # pragma: no cover - Windows
+        return gauges
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS.
+    gauges.append(
+        (
+            "beamtime_process_peak_resident_memory_bytes",
+            "Peak resident set size.",
+            {},
+            peak if sys.platform == "darwin" else peak * 1024,
+        )
+    )
+    return gauges
+
+
+class StackSampler:
+    """Background sampler keeping a rolling window of stacks, tagged with the request they belong to."""
+
+    IDLE_MODULES = ("threading.py", "selectors.py", "queue.py", "base_events.py")
+
+    def __init__(self, interval: float, window: float = 60.0):
+        self.interval = interval
+        self._samples: deque = deque(maxlen=max(1, int(window / interval)))
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="beamtime-stack-sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                owner = _owner(thread_id) if thread_id != own else None
+                if owner is None:
+                    continue
+                stack = self._collapse(frame)
+                if stack:
+                    self._samples.append((owner, stack))
+
+    def _collapse(self, frame) -> Optional[str]:
+        if os.path.basename(frame.f_code.co_filename) in self.IDLE_MODULES:
+            return None
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return ";".join(reversed(frames))
+
+    def collapsed_for(self, stats: RequestStats) -> Counter:
+        return Counter(stack for owner, stack in list(self._samples) if owner is stats)
+
+
+class MetricsMiddleware:
+    def __init__(
+        self,
+        app,
+        profile_threshold_ms: Optional[float] = None,
+        profile_dir: str = "profiles",
+        profile_interval_ms: float = 5.0,
+    ):
+        self.app = app
+        self.profile_threshold = profile_threshold_ms / 1000 if profile_threshold_ms else None
+        self.profile_dir = Path(profile_dir)
+        self.sampler = None
+        if self.profile_threshold is not None:
+            self.sampler = StackSampler(profile_interval_ms / 1000)
+            self.sampler.start()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        task = None
+        if self.sampler is not None:
+            task = asyncio.current_task()
+            _loops[threading.get_ident()] = asyncio.get_running_loop()
+            _task_requests[task] = stats
+        status_code = 500
+        size = 0
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_request.reset(token)
+            _task_requests.pop(task, None)
+            route = scope.get("route")
+            route_path = getattr(route, "path", UNMATCHED_ROUTE)
+            registry.observe(scope["method"], route_path, status_code, elapsed, stats, size)
+            if self.sampler is not None and elapsed >= self.profile_threshold:
+                stacks = self.sampler.collapsed_for(stats)
+                if stacks:
+                    await concurrency.run_in_threadpool(
+                        self._dump_profile, scope["method"], route_path, started + elapsed, stacks
+                    )
+
+    def _dump_profile(self, method: str, route: str, finished: float, stacks: Counter) -> None:
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", f"{method}{route}").strip("_")
+        path = self.profile_dir / f"{time.strftime('%Y%m%dT%H%M%S')}-{int(finished * 1000) % 1000:03d}-{slug}.folded"
+        path.write_text("".join(f"{stack} {count}\n" for stack, count in stacks.most_common()))
@@ -8,9 +8,12 @@ from sqlalchemy import (
     DateTime,
     Enum,
     ForeignKey,
+    Index,
     Integer,
+    LargeBinary,
     String,
     Text,
+    UniqueConstraint,
 )
 from sqlalchemy.orm import relationship
 
@@ -37,6 +40,23 @@ class AllocationStatus(str, enum.Enum):
     COMPLETED = "COMPLETED"
 
 
+class RollupKind(str, enum.Enum):
+    REQUEST = "REQUEST"
+    ALLOCATION = "ALLOCATION"
+
+
+class CounterScope(str, enum.Enum):
+    PROJECT = "PROJECT"
+    MANAGER = "MANAGER"
+    BEAMLINE = "BEAMLINE"
+
+
+class ChangeChannel(str, enum.Enum):
+    TABLE = "TABLE"
+    BEAMLINE = "BEAMLINE"
+    USER = "USER"
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -59,8 +79,8 @@ class ResearchProject(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
     description = Column(Text, nullable=True)
-    pi_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    manager_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    pi_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    manager_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
 
     pi = relationship("User", foreign_keys=[pi_id], back_populates="projects")
     manager = relationship("User", foreign_keys=[manager_id], back_populates="managed_projects")
@@ -69,6 +89,8 @@ class ResearchProject(Base):
 
 class BeamtimeRequest(Base):
     __tablename__ = "beamtime_requests"
+    # The (project_id, status) index also serves lookups on project_id alone.
+    __table_args__ = (Index("ix_beamtime_requests_project_id_status", "project_id", "status"),)
 
     id = Column(Integer, primary_key=True, index=True)
     project_id = Column(Integer, ForeignKey("research_projects.id"), nullable=False)
@@ -76,7 +98,7 @@ class BeamtimeRequest(Base):
     duration_hours = Column(Integer, nullable=False)
     justification = Column(Text, nullable=True)
     status = Column(Enum(RequestStatus), default=RequestStatus.PENDING, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
 
     project = relationship("ResearchProject", back_populates="requests")
     allocations = relationship("Allocation", back_populates="request")
@@ -84,15 +106,16 @@ class BeamtimeRequest(Base):
 
 class Allocation(Base):
     __tablename__ = "allocations"
+    __table_args__ = (Index("ix_allocations_beamline_slot_date", "beamline", "slot_date"),)
 
     id = Column(Integer, primary_key=True, index=True)
-    request_id = Column(Integer, ForeignKey("beamtime_requests.id"), nullable=False)
+    request_id = Column(Integer, ForeignKey("beamtime_requests.id"), nullable=False, index=True)
     beamline = Column(String, nullable=False)
     slot_date = Column(Date, nullable=False)
     slot_time = Column(String, nullable=False)
     duration_hours = Column(Integer, nullable=False)
     status = Column(Enum(AllocationStatus), default=AllocationStatus.SCHEDULED, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
 
     request = relationship("BeamtimeRequest", back_populates="allocations")
     approvals = relationship("Approval", back_populates="allocation")
@@ -102,7 +125,7 @@ class Approval(Base):
     __tablename__ = "approvals"
 
     id = Column(Integer, primary_key=True, index=True)
-    allocation_id = Column(Integer, ForeignKey("allocations.id"), nullable=False)
+    allocation_id = Column(Integer, ForeignKey("allocations.id"), nullable=False, index=True)
     approver_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     approved = Column(Boolean, default=False, nullable=False)
     notes = Column(Text, nullable=True)
@@ -110,3 +133,60 @@ class Approval(Base):
 
     allocation = relationship("Allocation", back_populates="approvals")
     approver = relationship("User", back_populates="approvals")
+
+
+class MonthlyRollup(Base):
+    __tablename__ = "monthly_rollups"
+    __table_args__ = (
+        UniqueConstraint("month", "kind", "beamline", "status", name="uq_monthly_rollups_bucket"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    month = Column(String(7), nullable=False)
+    kind = Column(Enum(RollupKind), nullable=False)
+    # Requests are not tied to a beamline yet, so their buckets use "".
+    beamline = Column(String, nullable=False, default="")
+    status = Column(String, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class StatusCount(Base):
+    __tablename__ = "status_counts"
+    __table_args__ = (
+        UniqueConstraint("scope", "owner", "kind", "status", name="uq_status_counts_bucket"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(Enum(CounterScope), nullable=False)
+    # Project or manager id as text, or the beamline name.
+    owner = Column(String, nullable=False)
+    kind = Column(Enum(RollupKind), nullable=False)
+    status = Column(String, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String(255), nullable=False, unique=True)
+    # Digest of the method, path, query and body the key was first used with.
+    fingerprint = Column(String(32), nullable=False)
+    status_code = Column(Integer, nullable=False)
+    body = Column(LargeBinary, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class ChangeVersion(Base):
+    __tablename__ = "change_versions"
+    __table_args__ = (
+        UniqueConstraint("channel", "key", name="uq_change_versions_key"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    channel = Column(Enum(ChangeChannel), nullable=False)
+    # Table name, beamline or user id of the cached state that changed.
+    key = Column(String, nullable=False)
+    # Database-wide sequence: every commit stamps its keys with max(version) + 1.
+    version = Column(Integer, nullable=False, index=True)
+    changed_at = Column(DateTime, nullable=False)
@@ -0,0 +1,94 @@
+import base64
+import binascii
+from datetime import date
+from typing import AsyncIterator, Callable, Optional, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+STREAM_BATCH_SIZE = 1000
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def encode_cursor(slot_date: date, allocation_id: int) -> str:
+    raw = f"{slot_date.isoformat()}:{allocation_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[date, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        slot_date, allocation_id = raw.split(":", 1)
+        return date.fromisoformat(slot_date), int(allocation_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def filter_allocations(
+    query: Select,
+    beamline: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    cursor: Optional[str] = None,
+) -> Select:
+    """Apply the shared listing filters and keyset position to an allocation query.
+
+    Rows are ordered by ``(slot_date, id)`` so that a cursor taken from the last
+    row of one page selects exactly the rows that follow it.
+    """
+
+    allocation = models.Allocation
+    if beamline is not None:
+        query = query.filter(allocation.beamline == beamline)
+    if start is not None:
+        query = query.filter(allocation.slot_date >= start)
+    if end is not None:
+        query = query.filter(allocation.slot_date <= end)
+    if cursor is not None:
+        after_date, after_id = decode_cursor(cursor)
+        query = query.filter(
+            or_(
+                allocation.slot_date > after_date,
+                and_(allocation.slot_date == after_date, allocation.id > after_id),
+            )
+        )
+    return query.order_by(allocation.slot_date, allocation.id)
+
+
+async def paginate(db: AsyncSession, query: Select, limit: int, key: Callable) -> Tuple[list, Optional[str]]:
+    """Fetch one page plus a single look-ahead row to decide whether more exist."""
+
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+
+def stream_ndjson(db: AsyncSession, query: Select, serialize: Callable[[object], bytes]) -> StreamingResponse:
+    """Stream the rows of ``query`` as newline-delimited JSON, one row per line.
+
+    Rows are fetched through a server-side cursor in batches of
+    ``STREAM_BATCH_SIZE`` and each batch is sent as one chunk.  The session is
+    closed by the generator itself because the body is produced after the
+    request dependencies have already been torn down.
+    """
+
+    async def generate() -> AsyncIterator[bytes]:
+        try:
+            result = await db.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+            async for batch in result.partitions():
+                yield b"".join(serialize(row) + b"\n" for row in batch)
+        finally:
+            await db.close()
+
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,123 @@
+"""Statement builders that load everything an endpoint serializes up front.
+
+Each builder returns a ``Select`` usable from both the sync and async
+sessions.  Relationships that a handler touches are joined or eager-loaded
+here so that no endpoint depends on lazy loading.
+"""
+
+from sqlalchemy import Select, select
+from sqlalchemy.orm import joinedload
+
+from . import models
+
+
+REQUEST_FIELDS = tuple(models.BeamtimeRequest.__table__.columns.keys())
+# Leading columns of ``allocation_table_rows``, as serialized.
+ALLOCATION_TABLE_FIELDS = ("project_title", "beamline", "slot_date", "slot_time", "duration_hours", "status")
+
+
+def request_with_project(request_id: int) -> Select:
+    return (
+        select(models.BeamtimeRequest)
+        .options(joinedload(models.BeamtimeRequest.project))
+        .where(models.BeamtimeRequest.id == request_id)
+    )
+
+
+def request_owner(request_id: int) -> Select:
+    """``(project_id, manager_id)`` of a request; no row means it does not exist."""
+
+    return (
+        select(models.BeamtimeRequest.project_id, models.ResearchProject.manager_id)
+        .join(models.ResearchProject, models.ResearchProject.id == models.BeamtimeRequest.project_id)
+        .where(models.BeamtimeRequest.id == request_id)
+    )
+
+
+def allocation_with_project(allocation_id: int) -> Select:
+    return (
+        select(models.Allocation)
+        .options(joinedload(models.Allocation.request).joinedload(models.BeamtimeRequest.project))
+        .where(models.Allocation.id == allocation_id)
+    )
+
+
+def project_rows() -> Select:
+    return select(*models.ResearchProject.__table__.columns)
+
+
+def request_rows() -> Select:
+    return select(*models.BeamtimeRequest.__table__.columns)
+
+
+def project_requests(project_id: int) -> Select:
+    """Request columns of a project plus a trailing ``project_found`` marker.
+
+    The project is outer-joined, so no rows means the project does not exist
+    and a single row of NULL request columns means it has no requests.
+    """
+
+    return (
+        request_rows()
+        .add_columns(models.ResearchProject.id.label("project_found"))
+        .select_from(models.ResearchProject)
+        .outerjoin(models.BeamtimeRequest, models.BeamtimeRequest.project_id == models.ResearchProject.id)
+        .where(models.ResearchProject.id == project_id)
+        .order_by(models.BeamtimeRequest.id)
+    )
+
+
+def manager_requests(manager_id: int) -> Select:
+    return (
+        request_rows()
+        .join(models.ResearchProject, models.ResearchProject.id == models.BeamtimeRequest.project_id)
+        .where(models.ResearchProject.manager_id == manager_id)
+        .order_by(models.BeamtimeRequest.id)
+    )
+
+
+def allocation_rows() -> Select:
+    return select(*models.Allocation.__table__.columns)
+
+
+def allocation_table_rows() -> Select:
+    """Columns of ``AllocationTableRow`` in order, then the allocation id for the cursor."""
+
+    return (
+        select(
+            models.ResearchProject.title.label("project_title"),
+            models.Allocation.beamline,
+            models.Allocation.slot_date,
+            models.Allocation.slot_time,
+            models.Allocation.duration_hours,
+            models.Allocation.status,
+            models.Allocation.id,
+        )
+        .join(models.BeamtimeRequest, models.BeamtimeRequest.id == models.Allocation.request_id)
+        .join(models.ResearchProject, models.ResearchProject.id == models.BeamtimeRequest.project_id)
+    )
+
+
+def allocation_export_rows() -> Select:
+    """Allocations joined to their request and project, flattened for export."""
+
+    return (
+        select(
+            models.Allocation.id.label("allocation_id"),
+            models.Allocation.request_id,
+            models.BeamtimeRequest.project_id,
+            models.ResearchProject.title.label("project_title"),
+            models.ResearchProject.pi_id,
+            models.ResearchProject.manager_id,
+            models.Allocation.beamline,
+            models.Allocation.slot_date,
+            models.Allocation.slot_time,
+            models.Allocation.duration_hours,
+            models.Allocation.status.label("allocation_status"),
+            models.BeamtimeRequest.status.label("request_status"),
+            models.BeamtimeRequest.requested_date,
+            models.Allocation.created_at,
+        )
+        .join(models.BeamtimeRequest, models.BeamtimeRequest.id == models.Allocation.request_id)
+        .join(models.ResearchProject, models.ResearchProject.id == models.BeamtimeRequest.project_id)
+    )
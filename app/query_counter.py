@@ -0,0 +1,53 @@
+"""Count SQL statements issued through one or more engines.
+
+Used by the test-suite to pin per-endpoint query budgets so N+1 regressions
+fail loudly::
+
+    with assert_max_queries(2, engine):
+        client.get("/managers/1/requests")
+"""
+
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+def _sync_engine(engine) -> Engine:
+    return engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(*engines) -> Iterator[QueryCounter]:
+    counter = QueryCounter()
+    targets = [_sync_engine(engine) for engine in engines]
+    for target in targets:
+        event.listen(target, "before_cursor_execute", counter._record)
+    try:
+        yield counter
+    finally:
+        for target in targets:
+            event.remove(target, "before_cursor_execute", counter._record)
+
+
+@contextmanager
+def assert_max_queries(budget: int, *engines) -> Iterator[QueryCounter]:
+    with count_queries(*engines) as counter:
+        yield counter
+    if counter.count > budget:
+        listing = "\n".join(f"  {index + 1}. {statement}" for index, statement in enumerate(counter.statements))
+        raise AssertionError(f"Expected at most {budget} queries, got {counter.count}:\n{listing}")
@@ -0,0 +1,196 @@
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import String, func, insert, literal, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import FunctionElement
+
+from . import models, writes
+
+
+class year_month(FunctionElement):
+    """``YYYY-MM`` text for a date/datetime column, portable across backends."""
+
+    type = String()
+    inherit_cache = True
+    name = "year_month"
+
+
+@compiles(year_month)
+def _compile_year_month(element, compiler, **kw):
+    return "strftime('%%Y-%%m', %s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(year_month, "postgresql")
+def _compile_year_month_postgresql(element, compiler, **kw):
+    return "to_char(%s, 'YYYY-MM')" % compiler.process(element.clauses, **kw)
+
+
+def _month_key(value: datetime) -> str:
+    return value.strftime("%Y-%m")
+
+
+def monthly_counts(db: Session, year: int) -> List[Dict]:
+    start = datetime(year, 1, 1)
+    end = datetime(year, 12, 31, 23, 59, 59)
+    report: Dict[str, Dict[str, int]] = {}
+
+    for model, key in (
+        (models.BeamtimeRequest, "requests"),
+        (models.Allocation, "allocations"),
+    ):
+        month = year_month(model.created_at)
+        rows = db.execute(
+            select(month, func.count(model.id))
+            .where(model.created_at.between(start, end))
+            .group_by(month)
+        )
+        for month_value, count in rows:
+            report.setdefault(month_value, {"requests": 0, "allocations": 0})[key] = count
+
+    return [
+        {"month": month, "request_count": data["requests"], "allocation_count": data["allocations"]}
+        for month, data in sorted(report.items())
+    ]
+
+
+_ROLLUP_KEY = ("month", "kind", "beamline", "status")
+
+
+def _bump(db: Session, buckets: Dict[Tuple[str, models.RollupKind, str, str], int]) -> None:
+    """Add ``(month, kind, beamline, status)`` deltas to their rollup buckets in one statement."""
+
+    writes.add_counts(db, models.MonthlyRollup.__table__, _ROLLUP_KEY, buckets)
+
+
+def _move(db: Session, month: str, kind: models.RollupKind, beamline: str, previous: str, status: str) -> None:
+    """Move one row from bucket ``previous`` to ``status``."""
+
+    _bump(db, {(month, kind, beamline, previous): -1, (month, kind, beamline, status): 1})
+
+
+def record_request_created(db: Session, request: models.BeamtimeRequest) -> None:
+    _bump(db, {(_month_key(request.created_at), models.RollupKind.REQUEST, "", request.status.value): 1})
+
+
+def record_request_status_change(
+    db: Session, request: models.BeamtimeRequest, previous: models.RequestStatus
+) -> None:
+    if previous == request.status:
+        return
+    _move(db, _month_key(request.created_at), models.RollupKind.REQUEST, "", previous.value, request.status.value)
+
+
+def record_allocation_created(db: Session, allocation: models.Allocation) -> None:
+    record_allocations_created(db, [allocation])
+
+
+def record_allocations_created(db: Session, allocations: Iterable[models.Allocation]) -> None:
+    kind = models.RollupKind.ALLOCATION
+    _bump(
+        db,
+        Counter(
+            (_month_key(allocation.created_at), kind, allocation.beamline, allocation.status.value)
+            for allocation in allocations
+        ),
+    )
+
+
+def record_allocation_status_change(
+    db: Session, allocation: models.Allocation, previous: models.AllocationStatus
+) -> None:
+    if previous == allocation.status:
+        return
+    _move(
+        db,
+        _month_key(allocation.created_at),
+        models.RollupKind.ALLOCATION,
+        allocation.beamline,
+        previous.value,
+        allocation.status.value,
+    )
+
+
+def record_allocation_status_changes(
+    db: Session, changes: Iterable[Tuple[datetime, str, models.AllocationStatus]], status: models.AllocationStatus
+) -> None:
+    """Move allocations given as ``(created_at, beamline, previous)`` into ``status``."""
+
+    kind = models.RollupKind.ALLOCATION
+    buckets = Counter()
+    for created_at, beamline, previous in changes:
+        if previous != status:
+            month = _month_key(created_at)
+            buckets[month, kind, beamline, previous.value] -= 1
+            buckets[month, kind, beamline, status.value] += 1
+    _bump(db, buckets)
+
+
+def rebuild_monthly_rollup(db: Session) -> None:
+    """Recompute every rollup bucket from the source tables in two set-based statements."""
+
+    rollup = models.MonthlyRollup
+    request = models.BeamtimeRequest
+    allocation = models.Allocation
+    columns = ["month", "kind", "beamline", "status", "count"]
+
+    db.execute(rollup.__table__.delete())
+    request_month = year_month(request.created_at)
+    db.execute(
+        insert(rollup).from_select(
+            columns,
+            select(
+                request_month,
+                literal(models.RollupKind.REQUEST.value),
+                literal(""),
+                request.status,
+                func.count(request.id),
+            ).group_by(request_month, request.status),
+        )
+    )
+    allocation_month = year_month(allocation.created_at)
+    db.execute(
+        insert(rollup).from_select(
+            columns,
+            select(
+                allocation_month,
+                literal(models.RollupKind.ALLOCATION.value),
+                allocation.beamline,
+                allocation.status,
+                func.count(allocation.id),
+            ).group_by(allocation_month, allocation.beamline, allocation.status),
+        )
+    )
+
+
+def rollup_filters(
+    start_year: int,
+    end_year: int,
+    kind: Optional[models.RollupKind] = None,
+    beamline: Optional[str] = None,
+) -> list:
+    rollup = models.MonthlyRollup
+    criteria = [
+        rollup.month >= f"{start_year:04d}-01",
+        rollup.month <= f"{end_year:04d}-12",
+        rollup.count != 0,
+    ]
+    if kind is not None:
+        criteria.append(rollup.kind == kind)
+    if beamline is not None:
+        criteria.append(rollup.beamline == beamline)
+    return criteria
+
+
+def rollup_rows(
+    db: Session,
+    start_year: int,
+    end_year: int,
+    kind: Optional[models.RollupKind] = None,
+    beamline: Optional[str] = None,
+) -> List[models.MonthlyRollup]:
+    rollup = models.MonthlyRollup
+    query = db.query(rollup).filter(*rollup_filters(start_year, end_year, kind, beamline))
+    return query.order_by(rollup.month, rollup.kind, rollup.beamline, rollup.status).all()
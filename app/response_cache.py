@@ -0,0 +1,159 @@
+"""Versioned response cache with ETag / Last-Modified revalidation.
+
+Every committed write bumps a per-table version counter (tracked from the
+session's flushes and bulk statements).  A cached listing is keyed by route,
+query string and the versions of the tables it reads, so writes invalidate
+entries implicitly and an unchanged poll with ``If-None-Match`` is answered
+with ``304 Not Modified`` before a database connection is checked out.
+``Last-Modified`` is sent for information only: at one-second resolution it
+cannot tell two writes in the same second apart, so ``If-Modified-Since``
+alone never produces a 304 while the ETag can.
+"""
+
+import hashlib
+import json
+import threading
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, Set, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .cache import TTLCache
+from .serialization import dumps
+
+RESPONSE_CACHE_TTL_SECONDS = 300.0
+RESPONSE_CACHE_MAXSIZE = 256
+
+WRITTEN_TABLES_KEY = "written_tables"
+
+
+class TableVersions:
+    """Monotonic per-table version counters with last-modified timestamps."""
+
+    def __init__(self):
+        # Restarting the process must not turn old ETags into false 304s.
+        self.epoch = uuid.uuid4().hex[:12]
+        self.started = datetime.now(timezone.utc).replace(microsecond=0)
+        self._versions: Dict[str, Tuple[int, datetime]] = {}
+        self._lock = threading.Lock()
+
+    def bump(self, tables: Iterable[str]) -> None:
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        with self._lock:
+            for table in tables:
+                version, _ = self._versions.get(table, (0, now))
+                self._versions[table] = (version + 1, now)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._versions.clear()
+
+    def advance(self, table: str, version: int, modified: datetime) -> None:
+        """Move ``table`` to a version assigned elsewhere (see :mod:`app.changes`)."""
+
+        with self._lock:
+            if version > self._versions.get(table, (0, modified))[0]:
+                self._versions[table] = (version, modified.replace(microsecond=0))
+
+    def snapshot(self, tables: Iterable[str]) -> Tuple[Tuple[Tuple[str, int], ...], datetime]:
+        with self._lock:
+            entries = [(table, self._versions.get(table, (0, self.started))) for table in sorted(tables)]
+        versions = tuple((table, version) for table, (version, _) in entries)
+        last_modified = max((modified for _, (_, modified) in entries), default=self.started)
+        return versions, last_modified
+
+
+table_versions = TableVersions()
+
+
+def _written(session: Session) -> Set[str]:
+    return session.info.setdefault(WRITTEN_TABLES_KEY, set())
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flushed_tables(session: Session, flush_context) -> None:
+    written = _written(session)
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(instance, "__table__", None)
+        if table is not None:
+            written.add(table.name)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_statements(state) -> None:
+    if state.is_insert or state.is_update or state.is_delete:
+        table = getattr(state.statement, "table", None)
+        if table is not None:
+            _written(state.session).add(table.name)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_committed_tables(session: Session) -> None:
+    written = session.info.pop(WRITTEN_TABLES_KEY, None)
+    if written:
+        table_versions.bump(written)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_uncommitted_tables(session: Session, transaction) -> None:
+    if transaction.parent is None:
+        session.info.pop(WRITTEN_TABLES_KEY, None)
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    candidates = {candidate.strip() for candidate in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates or etag.removeprefix("W/") in candidates
+
+
+class ResponseCache:
+    def __init__(self, versions: TableVersions, maxsize: int, ttl: float):
+        self.versions = versions
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def respond(
+        self,
+        request: Request,
+        tables: Iterable[str],
+        build: Callable[[], Awaitable[Tuple[Any, Dict[str, str]]]],
+    ) -> Response:
+        """Serve ``build()``'s ``(content, headers)`` through the cache.
+
+        The snapshot is taken before building, so a write racing the build can
+        only make the cached body newer than its ETag, never staler.
+        """
+
+        versions, last_modified = self.versions.snapshot(tables)
+        fingerprint = json.dumps(
+            [self.versions.epoch, request.url.path, sorted(request.query_params.multi_items()), versions]
+        )
+        etag = f'W/"{hashlib.blake2b(fingerprint.encode(), digest_size=12).hexdigest()}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": format_datetime(last_modified, usegmt=True),
+            "Cache-Control": "no-cache",
+        }
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+
+        entry = self.entries.get(etag)
+        if entry is None:
+            content, extra_headers = await build()
+            body = dumps(content)
+            entry = (body, extra_headers)
+            self.entries.set(etag, entry)
+        body, extra_headers = entry
+        return Response(body, media_type="application/json", headers={**headers, **extra_headers})
+
+
+response_cache = ResponseCache(table_versions, RESPONSE_CACHE_MAXSIZE, RESPONSE_CACHE_TTL_SECONDS)
+
+
+def get_response_cache() -> ResponseCache:
+    return response_cache
@@ -0,0 +1,377 @@
+"""Draft beamline schedules for approved requests that have no allocation yet.
+
+Time is handled in whole hours counted from the start of the scheduling
+window.  Each beamline is a sorted list of free gaps: the window (or the
+beamline's availability) minus blackouts and already booked slots.
+
+``plan`` works in two phases:
+
+1. Greedy packing.  Requests are taken by requested date (longest first on the
+   same day) and put on the beamline and aligned start time closest to their
+   requested date.  A bisect finds the gap around the target and the scan
+   stops as soon as no further gap can beat the best deviation so far.
+2. Local improvement.  Requests of the same length can swap slots freely, so
+   each length class is re-matched in target order, which minimises their
+   summed deviation.  Every request is then taken out and re-inserted at its
+   best position, which can never make it worse, and unscheduled requests are
+   retried in the space that frees up.  The passes repeat while the total
+   deviation keeps falling.
+
+The result is conflict-free by construction and its items have the shape
+``POST /allocations/bulk`` accepts.
+"""
+
+import bisect
+import time as timer
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import exists, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .conflicts import slot_index
+
+# One hour of deviation from the requested date costs this many scheduled hours.
+DEVIATION_PENALTY = 0.01
+IMPROVEMENT_ROUNDS = 5
+
+NO_CAPACITY = "No free window long enough within the allowed shift"
+
+
+class Candidate(NamedTuple):
+    request_id: int
+    target: int
+    duration: int
+
+
+class Placement(NamedTuple):
+    request_id: int
+    beamline: str
+    start: int
+    duration: int
+    target: int
+
+    @property
+    def deviation(self) -> int:
+        return abs(self.start - self.target)
+
+
+class FreeTime:
+    """Disjoint free ``[start, end)`` hour ranges of one beamline, sorted by start."""
+
+    def __init__(self, start: int, end: int, blocked: Iterable[Tuple[int, int]] = ()):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        cursor = start
+        for block_start, block_end in sorted(blocked):
+            if block_start > cursor:
+                self._append(cursor, min(block_start, end))
+            cursor = max(cursor, block_end)
+            if cursor >= end:
+                break
+        if cursor < end:
+            self._append(cursor, end)
+
+    def _append(self, start: int, end: int) -> None:
+        if end > start:
+            self.starts.append(start)
+            self.ends.append(end)
+
+    @property
+    def hours(self) -> int:
+        return sum(end - start for start, end in zip(self.starts, self.ends))
+
+    def best_start(self, target: int, duration: int, step: int, bound: float) -> Optional[int]:
+        """Aligned start closest to ``target`` whose deviation is below ``bound``."""
+
+        best = None
+        position = max(bisect.bisect_right(self.starts, target) - 1, 0)
+        # Walk right: gaps only get further from the target.
+        for index in range(position, len(self.starts)):
+            gap_start, gap_end = self.starts[index], self.ends[index]
+            if gap_start - target >= bound:
+                break
+            start = _fit(gap_start, gap_end, target, duration, step)
+            if start is not None and abs(start - target) < bound:
+                best, bound = start, abs(start - target)
+        # Walk left: a gap ending at ``e`` cannot start the slot later than ``e - duration``.
+        for index in range(position - 1, -1, -1):
+            gap_start, gap_end = self.starts[index], self.ends[index]
+            if target - (gap_end - duration) >= bound:
+                break
+            start = _fit(gap_start, gap_end, target, duration, step)
+            if start is not None and abs(start - target) < bound:
+                best, bound = start, abs(start - target)
+        return best
+
+    def occupy(self, start: int, end: int) -> None:
+        index = bisect.bisect_right(self.starts, start) - 1
+        gap_start, gap_end = self.starts[index], self.ends[index]
+        assert gap_start <= start and end <= gap_end, "occupying time that is not free"
+        del self.starts[index], self.ends[index]
+        if end < gap_end:
+            self.starts.insert(index, end)
+            self.ends.insert(index, gap_end)
+        if gap_start < start:
+            self.starts.insert(index, gap_start)
+            self.ends.insert(index, start)
+
+    def release(self, start: int, end: int) -> None:
+        index = bisect.bisect_left(self.starts, start)
+        if index < len(self.starts) and self.starts[index] == end:
+            end = self.ends[index]
+            del self.starts[index], self.ends[index]
+        if index > 0 and self.ends[index - 1] == start:
+            start = self.starts[index - 1]
+            index -= 1
+            del self.starts[index], self.ends[index]
+        self.starts.insert(index, start)
+        self.ends.insert(index, end)
+
+
+def _fit(gap_start: int, gap_end: int, target: int, duration: int, step: int) -> Optional[int]:
+    earliest = -(-gap_start // step) * step
+    latest = (gap_end - duration) // step * step
+    if latest < earliest:
+        return None
+    start = min(max(target, earliest), latest)
+    # Both bounds are aligned, so only an in-range target can be off the grid.
+    down = start // step * step
+    return down if start - down <= down + step - start else down + step
+
+
+class Planner:
+    def __init__(self, free: Dict[str, FreeTime], step: int = 1, max_shift: Optional[int] = None):
+        self.free = free
+        self.step = step
+        self.limit = float("inf") if max_shift is None else max_shift + 1
+        self.beamlines = sorted(free)
+
+    def best(self, candidate: Candidate) -> Optional[Tuple[str, int]]:
+        choice = None
+        bound = self.limit
+        for beamline in self.beamlines:
+            start = self.free[beamline].best_start(candidate.target, candidate.duration, self.step, bound)
+            if start is not None:
+                choice, bound = (beamline, start), abs(start - candidate.target)
+                if bound == 0:
+                    break
+        return choice
+
+    def place(self, candidate: Candidate) -> Optional[Placement]:
+        choice = self.best(candidate)
+        if choice is None:
+            return None
+        beamline, start = choice
+        self.free[beamline].occupy(start, start + candidate.duration)
+        return Placement(candidate.request_id, beamline, start, candidate.duration, candidate.target)
+
+    def remove(self, placement: Placement) -> Candidate:
+        self.free[placement.beamline].release(placement.start, placement.start + placement.duration)
+        return Candidate(placement.request_id, placement.target, placement.duration)
+
+
+def _rematch(placements: List[Placement]) -> List[Placement]:
+    """Reassign same-length slots so requests and slots pair up in time order."""
+
+    by_duration: Dict[int, List[Placement]] = defaultdict(list)
+    for placement in placements:
+        by_duration[placement.duration].append(placement)
+    rematched = []
+    for duration, group in by_duration.items():
+        slots = sorted((placement.start, placement.beamline) for placement in group)
+        wanted = sorted((placement.target, placement.request_id) for placement in group)
+        rematched.extend(
+            Placement(request_id, beamline, start, duration, target)
+            for (start, beamline), (target, request_id) in zip(slots, wanted)
+        )
+    return rematched
+
+
+def plan(
+    candidates: Sequence[Candidate],
+    free: Dict[str, FreeTime],
+    step: int = 1,
+    max_shift: Optional[int] = None,
+    rounds: int = IMPROVEMENT_ROUNDS,
+    time_budget: Optional[float] = None,
+) -> Tuple[List[Placement], List[Candidate]]:
+    """Place ``candidates`` into ``free`` (mutated) and return ``(placements, unscheduled)``.
+
+    Requests that cannot start within ``max_shift`` hours of their target stay unscheduled.
+    """
+
+    deadline = timer.perf_counter() + time_budget if time_budget is not None else None
+    planner = Planner(free, step, max_shift)
+    placements: List[Placement] = []
+    unscheduled: List[Candidate] = []
+    for candidate in sorted(candidates, key=lambda c: (c.target, -c.duration, c.request_id)):
+        placement = planner.place(candidate)
+        if placement is None:
+            unscheduled.append(candidate)
+        else:
+            placements.append(placement)
+
+    total = sum(placement.deviation for placement in placements)
+    for _ in range(rounds):
+        if deadline is not None and timer.perf_counter() > deadline:
+            break
+        placements = _rematch(placements)
+        improved = []
+        for placement in sorted(placements, key=lambda p: -p.deviation):
+            if placement.deviation == 0:
+                improved.append(placement)
+                continue
+            improved.append(planner.place(planner.remove(placement)))
+        placements = improved
+        retry, unscheduled = unscheduled, []
+        for candidate in retry:
+            placement = planner.place(candidate)
+            if placement is None:
+                unscheduled.append(candidate)
+            else:
+                placements.append(placement)
+        new_total = sum(placement.deviation for placement in placements)
+        if new_total >= total and len(unscheduled) == len(retry):
+            break
+        total = new_total
+    placements.sort(key=lambda p: (p.beamline, p.start))
+    return placements, unscheduled
+
+
+def score(placements: Sequence[Placement], unscheduled: Sequence[Candidate], capacity_hours: int) -> dict:
+    scheduled_hours = sum(placement.duration for placement in placements)
+    deviation = sum(placement.deviation for placement in placements)
+    return {
+        "scheduled": len(placements),
+        "unscheduled": len(unscheduled),
+        "scheduled_hours": scheduled_hours,
+        "requested_hours": scheduled_hours + sum(candidate.duration for candidate in unscheduled),
+        "total_deviation_hours": deviation,
+        "mean_deviation_hours": deviation / len(placements) if placements else 0.0,
+        "utilization": scheduled_hours / capacity_hours if capacity_hours else 0.0,
+        "score": scheduled_hours - DEVIATION_PENALTY * deviation,
+    }
+
+
+def _hours(moment: datetime, origin: datetime, round_up: bool) -> int:
+    seconds = (moment - origin).total_seconds()
+    whole, remainder = divmod(seconds, 3600)
+    return int(whole) + (1 if round_up and remainder else 0)
+
+
+def unallocated_approved_requests(db: Session, start: date, end: date, request_ids: Optional[List[int]] = None):
+    query = (
+        select(
+            models.BeamtimeRequest.id,
+            models.BeamtimeRequest.requested_date,
+            models.BeamtimeRequest.duration_hours,
+        )
+        .where(
+            models.BeamtimeRequest.status == models.RequestStatus.APPROVED,
+            models.BeamtimeRequest.requested_date >= start,
+            models.BeamtimeRequest.requested_date <= end,
+            ~exists().where(models.Allocation.request_id == models.BeamtimeRequest.id),
+        )
+        .order_by(models.BeamtimeRequest.id)
+    )
+    if request_ids is not None:
+        query = query.where(models.BeamtimeRequest.id.in_(request_ids))
+    return db.execute(query).all()
+
+
+def schedule_inputs(
+    db: Session,
+    start: date,
+    end: date,
+    beamlines: Sequence,
+    blackouts: Sequence = (),
+    request_ids: Optional[List[int]] = None,
+) -> Tuple[Dict[str, FreeTime], List[Candidate]]:
+    """Free time per beamline and the requests to place for ``[start, end]`` (inclusive dates).
+
+    ``beamlines`` have ``name`` and optional ``available_from``/``available_until``;
+    ``blackouts`` have an optional ``beamline`` (all when missing), ``start`` and ``end``.
+    """
+
+    origin = datetime.combine(start, time())
+    horizon = datetime.combine(end + timedelta(days=1), time())
+    window_end = _hours(horizon, origin, round_up=False)
+
+    free = {}
+    for beamline in beamlines:
+        available_from = max(beamline.available_from or origin, origin)
+        available_until = min(beamline.available_until or horizon, horizon)
+        blocked = [
+            (_hours(blackout.start, origin, False), _hours(blackout.end, origin, True))
+            for blackout in blackouts
+            if blackout.beamline in (None, beamline.name)
+        ]
+        blocked.extend(
+            (_hours(slot.start, origin, False), _hours(slot.end, origin, True))
+            for slot in slot_index.conflicts(db, beamline.name, origin, horizon)
+        )
+        free[beamline.name] = FreeTime(
+            _hours(available_from, origin, True), min(_hours(available_until, origin, False), window_end), blocked
+        )
+
+    candidates = [
+        Candidate(row.id, (row.requested_date - start).days * 24, row.duration_hours)
+        for row in unallocated_approved_requests(db, start, end, request_ids)
+    ]
+    return free, candidates
+
+
+def draft_schedule(
+    start: date,
+    free: Dict[str, FreeTime],
+    candidates: List[Candidate],
+    step_hours: int = 1,
+    max_shift_hours: Optional[int] = None,
+) -> dict:
+    """Place ``candidates`` in ``free``; pure CPU work, so it can run off the event loop."""
+
+    started = timer.perf_counter()
+    origin = datetime.combine(start, time())
+    capacity = sum(gaps.hours for gaps in free.values())
+    placements, unscheduled = plan(candidates, free, step_hours, max_shift_hours)
+
+    items = []
+    for placement in placements:
+        slot_start = origin + timedelta(hours=placement.start)
+        items.append(
+            {
+                "request_id": placement.request_id,
+                "beamline": placement.beamline,
+                "slot_date": slot_start.date(),
+                "slot_time": slot_start.strftime("%H:%M"),
+                "duration_hours": placement.duration,
+                "deviation_hours": placement.deviation,
+            }
+        )
+    return {
+        "items": items,
+        "unscheduled": [
+            {"request_id": candidate.request_id, "reason": NO_CAPACITY} for candidate in unscheduled
+        ],
+        "score": score(placements, unscheduled, capacity),
+        "solve_seconds": timer.perf_counter() - started,
+    }
+
+
+def propose_schedule(
+    db: Session,
+    start: date,
+    end: date,
+    beamlines: Sequence,
+    blackouts: Sequence = (),
+    step_hours: int = 1,
+    max_shift_hours: Optional[int] = None,
+    request_ids: Optional[List[int]] = None,
+) -> dict:
+    """Draft a schedule for ``[start, end]`` (inclusive dates) in one call."""
+
+    free, candidates = schedule_inputs(db, start, end, beamlines, blackouts, request_ids)
+    return draft_schedule(start, free, candidates, step_hours, max_shift_hours)
@@ -1,9 +1,9 @@
-from datetime import date, datetime
-from typing import List, Optional
+from datetime import date, datetime, time
+from typing import Dict, List, Optional
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, validator
 
-from .models import AllocationStatus, RequestStatus, UserRole
+from .models import AllocationStatus, RequestStatus, RollupKind, UserRole
 
 
 class UserBase(BaseModel):
@@ -87,7 +87,43 @@ class AllocationBase(BaseModel):
 
 
 class AllocationCreate(AllocationBase):
-    pass
+    @validator("slot_time")
+    def slot_time_is_clock_time(cls, value):
+        """Accept a local ``HH:MM`` start and store it as such.
+
+        Slots are minute-granular and compared as naive datetimes, so seconds
+        and UTC offsets are rejected rather than dropped.
+        """
+
+        try:
+            clock = time.fromisoformat(value)
+        except ValueError:
+            clock = None
+        if clock is None or clock.tzinfo is not None or clock.second or clock.microsecond:
+            raise ValueError("slot_time must be a local time of day in minutes such as 08:00")
+        return clock.strftime("%H:%M")
+
+    @validator("duration_hours")
+    def duration_is_positive(cls, value):
+        if value <= 0:
+            raise ValueError("duration_hours must be positive")
+        return value
+
+
+class AllocationBulkItem(AllocationCreate):
+    request_id: int
+
+
+class AllocationBulkCreate(BaseModel):
+    allocator_id: int
+    items: List[AllocationBulkItem]
+    atomic: bool = False
+
+
+class SlotConflictResult(BaseModel):
+    index: int
+    conflicting_allocation_ids: List[int]
+    conflicting_indexes: List[int]
 
 
 class Allocation(AllocationBase):
@@ -100,6 +136,102 @@ class Allocation(AllocationBase):
         orm_mode = True
 
 
+class AllocationBulkError(BaseModel):
+    index: int
+    detail: str
+    conflicting_allocation_ids: List[Optional[int]] = []
+
+
+class AllocationBulkResult(BaseModel):
+    created: List[Allocation]
+    errors: List[AllocationBulkError]
+
+
+def _local_moment(value: Optional[datetime]) -> Optional[datetime]:
+    # Schedules run on the facility's clock, like slot_date and slot_time.
+    if value is not None and value.tzinfo is not None:
+        raise ValueError("must be a local date and time without a UTC offset")
+    return value
+
+
+class BeamlineAvailability(BaseModel):
+    name: str
+    available_from: Optional[datetime] = None
+    available_until: Optional[datetime] = None
+
+    _local = validator("available_from", "available_until", allow_reuse=True)(_local_moment)
+
+
+class Blackout(BaseModel):
+    beamline: Optional[str] = None
+    start: datetime
+    end: datetime
+
+    _local = validator("start", "end", allow_reuse=True)(_local_moment)
+
+    @validator("end")
+    def end_after_start(cls, value, values):
+        if "start" in values and value <= values["start"]:
+            raise ValueError("end must be after start")
+        return value
+
+
+class ScheduleProposalCreate(BaseModel):
+    allocator_id: int
+    start: date
+    end: date
+    beamlines: List[BeamlineAvailability]
+    blackouts: List[Blackout] = []
+    step_hours: int = 1
+    max_shift_hours: Optional[int] = None
+    request_ids: Optional[List[int]] = None
+
+    @validator("end")
+    def end_not_before_start(cls, value, values):
+        if "start" in values and value < values["start"]:
+            raise ValueError("end must not be before start")
+        return value
+
+    @validator("beamlines")
+    def has_beamlines(cls, value):
+        if not value:
+            raise ValueError("at least one beamline is required")
+        return value
+
+    @validator("step_hours")
+    def step_divides_day(cls, value):
+        if value <= 0 or 24 % value:
+            raise ValueError("step_hours must divide 24")
+        return value
+
+
+class ScheduledAllocation(AllocationBulkItem):
+    deviation_hours: int
+
+
+class UnscheduledRequest(BaseModel):
+    request_id: int
+    reason: str
+
+
+class ScheduleScore(BaseModel):
+    scheduled: int
+    unscheduled: int
+    scheduled_hours: int
+    requested_hours: int
+    total_deviation_hours: int
+    mean_deviation_hours: float
+    utilization: float
+    score: float
+
+
+class ScheduleProposal(BaseModel):
+    items: List[ScheduledAllocation]
+    unscheduled: List[UnscheduledRequest]
+    score: ScheduleScore
+    solve_seconds: float
+
+
 class ApprovalBase(BaseModel):
     approver_id: int
     notes: Optional[str] = None
@@ -119,12 +251,147 @@ class Approval(ApprovalBase):
         orm_mode = True
 
 
+class ApprovalDecision(BaseModel):
+    allocation_id: int
+    approved: bool = True
+    notes: Optional[str] = None
+
+
+class ApprovalBatchCreate(BaseModel):
+    approver_id: int
+    decisions: List[ApprovalDecision]
+
+    @validator("decisions")
+    def allocation_ids_are_unique(cls, value):
+        ids = [decision.allocation_id for decision in value]
+        if len(ids) != len(set(ids)):
+            raise ValueError("each allocation may appear only once per batch")
+        return value
+
+
+class ApprovalBatchItemResult(BaseModel):
+    allocation_id: int
+    outcome: str
+    approval_id: Optional[int] = None
+    status: Optional[AllocationStatus] = None
+
+
+class ApprovalBatchResult(BaseModel):
+    approved: int
+    rejected: int
+    not_found: int
+    results: List[ApprovalBatchItemResult]
+
+
 class MonthlyReportItem(BaseModel):
     month: str
     request_count: int
     allocation_count: int
 
 
+class MonthlyRollupItem(BaseModel):
+    month: str
+    kind: RollupKind
+    beamline: str
+    status: str
+    count: int
+
+    class Config:
+        orm_mode = True
+
+
+class StatusSummary(BaseModel):
+    requests: Dict[RequestStatus, int] = {}
+    allocations: Dict[AllocationStatus, int] = {}
+
+
+class SearchHit(BaseModel):
+    kind: str
+    id: int
+    project_id: int
+    project_title: str
+    snippet: str
+    score: float
+
+
+class BeamlineUtilization(BaseModel):
+    beamline: str
+    booked_hours: List[int]
+    double_booked_hours: List[int]
+    utilization: List[float]
+    total_booked_hours: int
+    total_utilization: float
+
+
+class UtilizationReport(BaseModel):
+    start: date
+    end: date
+    granularity: str
+    bucket_starts: List[date]
+    capacity_hours: List[int]
+    beamlines: List[BeamlineUtilization]
+
+
+class CalendarSlots(BaseModel):
+    id: List[int]
+    request_id: List[int]
+    project_title: List[str]
+    slot_time: List[str]
+    duration_hours: List[int]
+    status: List[AllocationStatus]
+
+
+class BeamlineCalendar(BaseModel):
+    beamline: str
+    start: date
+    end: date
+    days: List[int]
+    occupied_hours: List[int]
+    total_occupied_hours: int
+    slot_counts: Optional[List[int]] = None
+    slots: Optional[CalendarSlots] = None
+
+
+class BeamlineIdleGaps(BaseModel):
+    beamline: str
+    gap_count: int
+    idle_hours: int
+    mean_gap_hours: float
+    longest_gap_hours: int
+    longest_gap_start: Optional[datetime] = None
+
+
+class OversubscriptionReport(BaseModel):
+    start: date
+    end: date
+    granularity: str
+    beamline_count: int
+    bucket_starts: List[date]
+    capacity_hours: List[int]
+    booked_hours: List[int]
+    requested_hours: List[int]
+    oversubscription: List[Optional[float]]
+    requested_per_booked: List[Optional[float]]
+
+
+class BeamtimeShare(BaseModel):
+    id: int
+    booked_hours: float
+    booked_share: float
+    requested_hours: float
+    requested_share: float
+
+
+class BeamtimeShareReport(BaseModel):
+    start: date
+    end: date
+    grouping: str
+    owner_count: int
+    total_booked_hours: float
+    total_requested_hours: float
+    items: List[BeamtimeShare]
+
+
 class AllocationTableRow(BaseModel):
     project_title: str
     beamline: str
@@ -132,3 +399,27 @@ class AllocationTableRow(BaseModel):
     slot_time: str
     duration_hours: int
     status: AllocationStatus
+
+
+class CacheStats(BaseModel):
+    size: int
+    maxsize: int
+    ttl_seconds: float
+    hits: int
+    misses: int
+
+
+class PoolStatus(BaseModel):
+    pool_class: str
+    size: Optional[int] = None
+    checked_out: Optional[int] = None
+    overflow: Optional[int] = None
+    checkouts: Optional[int] = None
+    timeouts: Optional[int] = None
+    total_wait_seconds: Optional[float] = None
+    max_wait_seconds: Optional[float] = None
+
+
+class DatabasePoolStatus(BaseModel):
+    sync_pool: PoolStatus
+    async_pool: PoolStatus
@@ -0,0 +1,248 @@
+"""Ranked full-text search over project texts and request justifications.
+
+On SQLite each searchable table gets an external-content FTS5 index
+(``<table>_fts``, porter-stemmed) kept in sync by insert/update/delete
+triggers, so bulk Core writes are indexed too.  On PostgreSQL the table gets a
+generated, weighted ``search_vector`` column with a GIN index.  Both are
+created with the tables (``create_all``) and by the 0005 migration.
+
+Keywords are reduced to word tokens and all must match, after stemming (so
+"crystals" finds "crystal").  There is no prefix matching: a prefix query
+reads the full posting list of every term it expands to.  Results from both
+kinds are merged by score (higher is better) and paged with a
+``(score, kind, id)`` keyset cursor.  Ranking and the keyset run in SQL;
+snippets are only built for the rows on the page.
+"""
+
+import base64
+import binascii
+import enum
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import DDL, bindparam, event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .database import Base
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_SEARCH_TOKENS = 16
+SNIPPET_TOKENS = 16
+HIGHLIGHT = ("**", "**")
+
+TOKEN = re.compile(r"\w+")
+
+
+class SearchKind(str, enum.Enum):
+    PROJECT = "project"
+    REQUEST = "request"
+
+
+class Source(NamedTuple):
+    kind: SearchKind
+    table: str
+    columns: Tuple[str, ...]
+    # bm25 weight per column; PostgreSQL maps the order onto weights A, B, ...
+    weights: Tuple[float, ...]
+
+    @property
+    def fts_table(self) -> str:
+        return f"{self.table}_fts"
+
+
+SOURCES = (
+    Source(SearchKind.PROJECT, models.ResearchProject.__tablename__, ("title", "description"), (10.0, 1.0)),
+    Source(SearchKind.REQUEST, models.BeamtimeRequest.__tablename__, ("justification",), (1.0,)),
+)
+
+
+def sqlite_index_statements(source: Source) -> List[str]:
+    fts, table = source.fts_table, source.table
+    columns = ", ".join(source.columns)
+    new = ", ".join(f"new.{column}" for column in source.columns)
+    old = ", ".join(f"old.{column}" for column in source.columns)
+    remove = f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old});"
+    add = f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({columns}, "
+        f"content='{table}', content_rowid='id', tokenize='porter unicode61')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {add} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN {remove} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {columns} ON {table} "
+        f"BEGIN {remove} {add} END",
+    ]
+
+
+def sqlite_drop_statements(source: Source) -> List[str]:
+    # The triggers go with their table.
+    return [f"DROP TABLE IF EXISTS {source.fts_table}"]
+
+
+def postgres_index_statements(source: Source) -> List[str]:
+    vector = " || ".join(
+        f"setweight(to_tsvector('english', coalesce({column}, '')), '{'ABCD'[position]}')"
+        for position, column in enumerate(source.columns)
+    )
+    return [
+        f"ALTER TABLE {source.table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        f"GENERATED ALWAYS AS ({vector}) STORED",
+        f"CREATE INDEX IF NOT EXISTS ix_{source.table}_search_vector ON {source.table} USING gin (search_vector)",
+    ]
+
+
+def postgres_drop_statements(source: Source) -> List[str]:
+    return [
+        f"DROP INDEX IF EXISTS ix_{source.table}_search_vector",
+        f"ALTER TABLE {source.table} DROP COLUMN IF EXISTS search_vector",
+    ]
+
+
+def _create_indexes_with_tables() -> None:
+    for source in SOURCES:
+        table = Base.metadata.tables[source.table]
+        for statement in sqlite_index_statements(source):
+            event.listen(table, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+        for statement in postgres_index_statements(source):
+            event.listen(table, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+        for statement in sqlite_drop_statements(source):
+            event.listen(table, "after_drop", DDL(statement).execute_if(dialect="sqlite"))
+
+
+_create_indexes_with_tables()
+
+
+def search_tokens(query: str) -> List[str]:
+    return TOKEN.findall(query.lower())[:MAX_SEARCH_TOKENS]
+
+
+def fts5_match(tokens: Sequence[str]) -> str:
+    return " ".join(f'"{token}"' for token in tokens)
+
+
+def postgres_tsquery(tokens: Sequence[str]) -> str:
+    return " & ".join(tokens)
+
+
+class Cursor(NamedTuple):
+    score: float
+    kind: str
+    id: int
+
+
+def encode_search_cursor(cursor: Cursor) -> str:
+    raw = f"{cursor.score!r}:{cursor.kind}:{cursor.id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_search_cursor(value: str) -> Cursor:
+    try:
+        padded = value + "=" * (-len(value) % 4)
+        score, kind, hit_id = base64.urlsafe_b64decode(padded.encode()).decode().split(":")
+        return Cursor(float(score), SearchKind(kind).value, int(hit_id))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def _after(source: Source, cursor: Optional[Cursor]) -> str:
+    """Keyset condition on ``score`` and ``id`` for rows ranked after ``cursor``."""
+
+    if cursor is None:
+        return "1 = 1"
+    if source.kind.value < cursor.kind:
+        return "score < :after_score"
+    if source.kind.value > cursor.kind:
+        return "score <= :after_score"
+    return "(score < :after_score OR (score = :after_score AND id > :after_id))"
+
+
+def _ranked_sql(source: Source, dialect: str, cursor: Optional[Cursor]) -> str:
+    if dialect == "postgresql":
+        ranked = (
+            f"SELECT id, ts_rank_cd(search_vector, to_tsquery('english', :match)) AS score "
+            f"FROM {source.table} WHERE search_vector @@ to_tsquery('english', :match)"
+        )
+    else:
+        weights = ", ".join(str(weight) for weight in source.weights)
+        ranked = (
+            f"SELECT rowid AS id, -bm25({source.fts_table}, {weights}) AS score "
+            f"FROM {source.fts_table} WHERE {source.fts_table} MATCH :match"
+        )
+    return (
+        f"SELECT id, score FROM ({ranked}) AS ranked WHERE {_after(source, cursor)} "
+        f"ORDER BY score DESC, id LIMIT :limit"
+    )
+
+
+def _snippet_sql(source: Source, dialect: str) -> str:
+    start, stop = HIGHLIGHT
+    if source.kind is SearchKind.PROJECT:
+        owner = "t.id AS project_id, t.title AS project_title"
+        joins = ""
+    else:
+        owner = "p.id AS project_id, p.title AS project_title"
+        joins = "JOIN research_projects AS p ON p.id = t.project_id "
+    if dialect == "postgresql":
+        text_column = f"concat_ws(' ', {', '.join(f't.{column}' for column in source.columns)})"
+        snippet = (
+            f"ts_headline('english', {text_column}, to_tsquery('english', :match), "
+            f"'StartSel={start}, StopSel={stop}, MaxWords={SNIPPET_TOKENS}, MinWords={SNIPPET_TOKENS // 2}')"
+        )
+        return f"SELECT t.id, {snippet} AS snippet, {owner} FROM {source.table} AS t {joins}WHERE t.id IN :ids"
+    fts = source.fts_table
+    snippet = f"snippet({fts}, -1, '{start}', '{stop}', '…', {SNIPPET_TOKENS})"
+    return (
+        f"SELECT t.id, {snippet} AS snippet, {owner} FROM {fts} JOIN {source.table} AS t ON t.id = {fts}.rowid "
+        f"{joins}WHERE {fts} MATCH :match AND {fts}.rowid IN :ids"
+    )
+
+
+async def search(
+    db: AsyncSession,
+    query: str,
+    kinds: Sequence[SearchKind],
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    cursor: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """One page of hits ranked best first, plus the cursor of the next page."""
+
+    tokens = search_tokens(query)
+    if not tokens:
+        return [], None
+    after = decode_search_cursor(cursor) if cursor else None
+    connection = await db.connection()
+    dialect = connection.dialect.name
+    match = postgres_tsquery(tokens) if dialect == "postgresql" else fts5_match(tokens)
+    params = {"match": match, "limit": limit + 1}
+    if after is not None:
+        params.update(after_score=after.score, after_id=after.id)
+
+    sources = [source for source in SOURCES if source.kind in kinds]
+    ranked: List[Tuple[float, str, int, Source]] = []
+    for source in sources:
+        rows = await connection.execute(text(_ranked_sql(source, dialect, after)), params)
+        ranked.extend((score, source.kind.value, hit_id, source) for hit_id, score in rows)
+    ranked.sort(key=lambda hit: (-hit[0], hit[1], hit[2]))
+    page, more = ranked[:limit], len(ranked) > limit
+
+    details: Dict[Tuple[str, int], dict] = {}
+    for source in sources:
+        ids = [hit_id for _, kind, hit_id, hit_source in page if hit_source is source]
+        if not ids:
+            continue
+        statement = text(_snippet_sql(source, dialect)).bindparams(bindparam("ids", expanding=True))
+        for row in await connection.execute(statement, {"match": match, "ids": ids}):
+            details[(source.kind.value, row.id)] = dict(row._mapping)
+
+    hits = [
+        {"kind": kind, "score": score, **details[(kind, hit_id)]}
+        for score, kind, hit_id, _ in page
+        if (kind, hit_id) in details
+    ]
+    next_cursor = None
+    if more and page:
+        score, kind, hit_id, _ = page[-1]
+        next_cursor = encode_search_cursor(Cursor(score, kind, hit_id))
+    return hits, next_cursor
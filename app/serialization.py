@@ -0,0 +1,55 @@
+"""Trusted-output JSON for listings read straight from our own tables.
+
+Listing endpoints select plain columns and return ``FastJSONResponse`` over
+``records(rows)``.  Returning a ``Response`` skips FastAPI's per-row Pydantic
+validation and ``jsonable_encoder`` pass; the routes keep their
+``response_model`` for the OpenAPI schema, so the columns selected must match
+it.  Only use this for rows the database produced, never for client input.
+
+Encoding uses orjson, with NumPy arrays and scalars serialized natively so
+the analytics reports need no conversion pass.
+"""
+
+import enum
+from datetime import date, datetime, time
+from typing import Any, List, Optional, Sequence
+
+import orjson
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+
+
+def records(rows: Sequence, fields: Optional[Sequence[str]] = None) -> List[dict]:
+    """Rows as dicts keyed by ``fields`` (default: the rows' own column names).
+
+    Columns beyond ``fields`` are dropped, so a query may select extra trailing
+    columns (existence markers, cursor keys) that are not part of the output.
+    """
+
+    if not rows:
+        return []
+    fields = fields or rows[0]._fields
+    return [dict(zip(fields, row)) for row in rows]
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
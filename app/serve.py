@@ -0,0 +1,47 @@
+"""Run the API under uvicorn with one or more worker processes::
+
+    python -m app.serve --workers 4 --port 8000
+
+The schema step runs once here, before the workers start, instead of racing
+in every worker's lifespan.  With more than one worker the cross-worker change
+feed (:mod:`app.changes`) is switched on, so caches in each worker follow
+commits made by the others; ``/events`` is then refused, since its events stay
+in the worker that published them.  Settings come from the usual ``BEAMTIME_*``
+environment variables, which the workers inherit.
+"""
+
+import argparse
+import os
+from typing import List, Optional
+
+import uvicorn
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    # The app module imports every table and DDL hook (FTS indexes) the schema step creates.
+    from .main import engine, prepare_schema, settings
+
+    parser = argparse.ArgumentParser(description="Serve the beamtime API with several workers.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    prepare_schema(engine, settings.schema_on_startup)
+    engine.dispose()
+    os.environ["BEAMTIME_SCHEMA_ON_STARTUP"] = "skip"
+    if args.workers > 1:
+        os.environ.setdefault("BEAMTIME_CROSS_WORKER_INVALIDATION", "true")
+    uvicorn.run(
+        "app.main:create_app",
+        factory=True,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level=args.log_level,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Single-statement writes that hand back the row they wrote.
+
+``INSERT ... RETURNING`` and ``UPDATE ... RETURNING`` return every column,
+including defaults such as ``created_at`` and ``status``, so handlers never
+re-read a row after writing it.  Existence and ownership checks go into the
+statement's ``WHERE`` clause: no row back means the check failed, and the
+handler then works out which error to report.
+
+Rows written here never pass through a flush, so session listeners that
+inspect flushed objects (the slot index in :mod:`app.conflicts`) do not see
+them; callers update such state themselves.  Serialize the returned objects
+before ``commit()`` expires them.
+"""
+
+from typing import Dict, Optional, Sequence, Tuple, Type, TypeVar
+
+from sqlalchemy import Table, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import Base
+
+ModelT = TypeVar("ModelT", bound=Base)
+
+# Rows per upsert statement, well below SQLite's bound parameter limit.
+UPSERT_CHUNK_SIZE = 500
+
+
+def insert_returning(db: Session, model: Type[ModelT], values: dict) -> ModelT:
+    return db.scalars(insert(model).returning(model), [values]).one()
+
+
+def update_returning(db: Session, model: Type[ModelT], row_id: int, values: dict) -> Optional[ModelT]:
+    """Apply ``values`` to row ``row_id``; ``None`` if there is no such row."""
+
+    if not values:
+        return db.get(model, row_id)
+    statement = (
+        update(model)
+        .where(model.id == row_id)
+        .values(**values)
+        .returning(model)
+        .execution_options(synchronize_session=False)
+    )
+    return db.scalars(statement).first()
+
+
+def insert_request_for_pi(
+    db: Session, project_id: int, pi_id: int, values: dict
+) -> Optional[Tuple[models.BeamtimeRequest, int]]:
+    """Insert a request only if ``pi_id`` owns project ``project_id``.
+
+    Returns the new request and the project's manager id, or ``None`` when the
+    project does not exist or belongs to another PI.
+    """
+
+    request = models.BeamtimeRequest
+    project = models.ResearchProject
+    row = {"project_id": project_id, **values}
+    owned = select(project.id).where(project.id == project_id, project.pi_id == pi_id).exists()
+    source = select(*(literal(value, request.__table__.c[name].type) for name, value in row.items())).where(owned)
+    manager_id = select(project.manager_id).where(project.id == project_id).scalar_subquery()
+    return db.execute(insert(request).from_select(list(row), source).returning(request, manager_id)).first()
+
+
+def add_counts(db: Session, table: Table, key_fields: Sequence[str], deltas: Dict[tuple, int]) -> None:
+    """Add each delta to the ``count`` of its key's row, creating rows that do not exist yet.
+
+    One ``INSERT ... ON CONFLICT DO UPDATE`` per chunk, so two transactions
+    creating the same new bucket add up instead of one failing on the unique
+    constraint over ``key_fields``.  Keys must be distinct within a call.
+    """
+
+    rows = [{**dict(zip(key_fields, key)), "count": delta} for key, delta in deltas.items() if delta]
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        statement = dialect.insert(table).values(rows[start:start + UPSERT_CHUNK_SIZE])
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=list(key_fields), set_={"count": table.c.count + statement.excluded.count}
+            )
+        )
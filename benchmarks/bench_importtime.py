@@ -0,0 +1,125 @@
+"""Cold-start cost of the API: ``-X importtime`` breakdown and time to first response.
+
+Each run starts a fresh interpreter, so nothing is shared between samples::
+
+    python -m benchmarks.bench_importtime --runs 7 --output importtime.json
+
+``import`` is the cumulative ``-X importtime`` figure for ``app.main``; the
+package table sums self time per top-level package from the median run.
+``ready`` times import, ``create_app()``, the lifespan startup and one request
+in a single process, which is what a restarted worker pays before serving.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+READY_SCRIPT = """
+import asyncio, json, time
+started = time.perf_counter()
+import httpx
+from app.main import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+
+async def first_request():
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        started_up = time.perf_counter()
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.get("/cache/roles")
+            response.raise_for_status()
+    return started_up
+
+started_up = asyncio.run(first_request())
+served = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "create_app": created - imported,
+    "startup": started_up - created,
+    "first_request": served - started_up,
+    "ready": served - started,
+}))
+"""
+
+
+def import_profile(env: Dict[str, str]) -> Tuple[float, Counter]:
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0.0
+    packages: Counter = Counter()
+    for line in completed.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, _, module = match.groups()
+        packages[module.split(".")[0]] += int(self_us) / 1e6
+        if module == "app.main":
+            total = int(cumulative_us) / 1e6
+    return total, packages
+
+
+def ready_timings(env: Dict[str, str]) -> Dict[str, float]:
+    completed = subprocess.run(
+        [sys.executable, "-c", READY_SCRIPT], env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12, help="packages to list")
+    parser.add_argument("--database", type=Path, help="SQLite file to start against (default: a fresh temp file)")
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    database = args.database or Path(os.environ.get("TMPDIR", "/tmp")) / "bench_importtime.db"
+    env.setdefault("DATABASE_URL", f"sqlite:///{database}")
+
+    # Warm the bytecode cache once so every sample measures the same thing.
+    import_profile(env)
+    imports: List[Tuple[float, Counter]] = [import_profile(env) for _ in range(args.runs)]
+    readies = [ready_timings(env) for _ in range(args.runs)]
+
+    imports.sort(key=lambda sample: sample[0])
+    median_import, packages = imports[len(imports) // 2]
+    report = {
+        "runs": args.runs,
+        "python": sys.version.split()[0],
+        "import_app_main_seconds": {
+            "median": median_import,
+            "min": imports[0][0],
+            "max": imports[-1][0],
+        },
+        "self_seconds_by_package": dict(packages.most_common(args.top)),
+        "ready_seconds": {key: statistics.median(run[key] for run in readies) for key in readies[0]},
+    }
+
+    print(f"import app.main   median {median_import * 1000:7.1f} ms  (min {imports[0][0] * 1000:.1f}, max {imports[-1][0] * 1000:.1f})")
+    for package, seconds in packages.most_common(args.top):
+        print(f"  {package:<24} {seconds * 1000:7.1f} ms")
+    for phase, seconds in report["ready_seconds"].items():
+        print(f"{phase:<17} median {seconds * 1000:7.1f} ms")
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""EXPLAIN plans and latency for the hot filter queries, without and with indexes.
+
+Seeds a throwaway SQLite database (about ``--rows`` rows across all tables),
+runs each query with only the primary-key indexes in place, then creates the
+secondary indexes from migration 0004 (plus ``(beamline, slot_date)`` from
+0003) and runs them again::
+
+    python -m benchmarks.bench_indexes --rows 1000000 --output bench_indexes.json
+"""
+
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
+
+from app.database import Base
+
+from .datagen import Volumes, seed
+
+BENCH_INDEXES = (
+    "ix_research_projects_pi_id",
+    "ix_research_projects_manager_id",
+    "ix_beamtime_requests_created_at",
+    "ix_beamtime_requests_project_id_status",
+    "ix_allocations_request_id",
+    "ix_allocations_created_at",
+    "ix_allocations_beamline_slot_date",
+    "ix_approvals_allocation_id",
+)
+
+QUERIES = {
+    "projects_by_pi": "SELECT * FROM research_projects WHERE pi_id = :pi_id",
+    "projects_by_manager": "SELECT * FROM research_projects WHERE manager_id = :user_id",
+    "requests_by_project": "SELECT * FROM beamtime_requests WHERE project_id = :project_id",
+    "requests_by_project_status": (
+        "SELECT * FROM beamtime_requests WHERE project_id = :project_id AND status = 'APPROVED'"
+    ),
+    "requests_created_in_month": (
+        "SELECT count(*) FROM beamtime_requests WHERE created_at BETWEEN :month_start AND :month_end"
+    ),
+    "manager_requests_join": (
+        "SELECT beamtime_requests.* FROM beamtime_requests "
+        "JOIN research_projects ON research_projects.id = beamtime_requests.project_id "
+        "WHERE research_projects.manager_id = :user_id"
+    ),
+    "allocations_by_request": "SELECT * FROM allocations WHERE request_id = :request_id",
+    "allocations_created_in_month": (
+        "SELECT count(*) FROM allocations WHERE created_at BETWEEN :month_start AND :month_end"
+    ),
+    "beamline_calendar_month": (
+        "SELECT * FROM allocations WHERE beamline = :beamline AND slot_date BETWEEN :day_start AND :day_end"
+    ),
+    "approvals_by_allocation": "SELECT * FROM approvals WHERE allocation_id = :allocation_id",
+}
+
+def measure(connection, params: dict, repeat: int) -> dict:
+    results = {}
+    for name, sql in QUERIES.items():
+        plan = [
+            row[-1] for row in connection.execute(text("EXPLAIN QUERY PLAN " + sql), params)
+        ]
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            connection.execute(text(sql), params).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = {"plan": plan, "median_ms": statistics.median(timings), "max_ms": max(timings)}
+    return results
+
+
+def run(total_rows: int, repeat: int, database: Path, seed_value: int) -> dict:
+    rng = random.Random(seed_value)
+    engine = create_engine(f"sqlite:///{database}")
+    indexes = {
+        index.name: index
+        for table in Base.metadata.sorted_tables
+        for index in table.indexes
+        if index.name in BENCH_INDEXES
+    }
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for index in indexes.values():
+            index.drop(connection)
+        dataset = seed(connection, Volumes.for_rows(total_rows), rng)
+        connection.exec_driver_sql("ANALYZE")
+
+    volumes = dataset.volumes
+    params = {
+        "pi_id": dataset.pi_ids[len(dataset.pi_ids) // 2],
+        "user_id": dataset.manager_ids[len(dataset.manager_ids) // 2],
+        "project_id": volumes.research_projects // 2,
+        "request_id": volumes.beamtime_requests // 2,
+        "allocation_id": volumes.allocations // 2,
+        "beamline": dataset.beamlines[0],
+        "month_start": datetime(2020, 3, 1),
+        "month_end": datetime(2020, 3, 31, 23, 59, 59),
+        "day_start": date(2020, 3, 1),
+        "day_end": date(2020, 3, 31),
+    }
+    with engine.connect() as connection:
+        before = measure(connection, params, repeat)
+    with engine.begin() as connection:
+        for index in indexes.values():
+            index.create(connection)
+        connection.exec_driver_sql("ANALYZE")
+    with engine.connect() as connection:
+        after = measure(connection, params, repeat)
+    engine.dispose()
+
+    return {
+        "rows": {name: value for name, value in vars(volumes).items() if name != "beamlines"},
+        "total_rows": sum(value for name, value in vars(volumes).items() if name != "beamlines"),
+        "indexes": sorted(indexes),
+        "queries": {
+            name: {"sql": QUERIES[name], "before": before[name], "after": after[name]} for name in QUERIES
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database", type=Path, help="SQLite file to build (default: a temp file)")
+    parser.add_argument("--output", type=Path, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = args.database or Path(tmp) / "bench_indexes.db"
+        if database.exists():
+            database.unlink()
+        report = run(args.rows, args.repeat, database, args.seed)
+
+    for name, result in report["queries"].items():
+        before, after = result["before"], result["after"]
+        print(f"{name:32s} {before['median_ms']:10.3f} ms -> {after['median_ms']:8.3f} ms")
+        print(f"    before: {'; '.join(before['plan'])}")
+        print(f"    after:  {'; '.join(after['plan'])}")
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Solve time and schedule quality of the draft scheduler on a synthetic cycle.
+
+Builds ``--requests`` requests with facility-like lengths spread over a cycle
+of ``--days`` days on ``--beamlines`` beamlines with a maintenance day every
+two weeks, then plans it greedily and with the improvement passes::
+
+    python -m benchmarks.bench_scheduler --requests 5000 --beamlines 30 --days 120
+"""
+
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+from typing import Dict
+
+from app.scheduler import IMPROVEMENT_ROUNDS, Candidate, FreeTime, plan, score
+
+from .datagen import beamline_names
+
+DURATIONS = (4, 8, 8, 12, 24, 48)
+MAINTENANCE_EVERY_DAYS = 14
+
+
+def cycle(beamlines: int, days: int) -> Dict[str, FreeTime]:
+    maintenance = [(day * 24, day * 24 + 24) for day in range(0, days, MAINTENANCE_EVERY_DAYS)]
+    return {name: FreeTime(0, days * 24, maintenance) for name in beamline_names(beamlines)}
+
+
+def run(requests: int, beamlines: int, days: int, seed: int, rounds: int, max_shift) -> dict:
+    rng = random.Random(seed)
+    candidates = [
+        Candidate(index, rng.randrange(days) * 24, rng.choice(DURATIONS)) for index in range(requests)
+    ]
+    free = cycle(beamlines, days)
+    capacity = sum(gaps.hours for gaps in free.values())
+    started = time.perf_counter()
+    placements, unscheduled = plan(candidates, free, max_shift=max_shift, rounds=rounds)
+    return {"solve_seconds": time.perf_counter() - started, **score(placements, unscheduled, capacity)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--beamlines", type=int, default=30)
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--max-shift-hours", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    report = {
+        "parameters": vars(args) | {"output": None},
+        "greedy": run(args.requests, args.beamlines, args.days, args.seed, 0, args.max_shift_hours),
+        "improved": run(
+            args.requests, args.beamlines, args.days, args.seed, IMPROVEMENT_ROUNDS, args.max_shift_hours
+        ),
+    }
+    for phase in ("greedy", "improved"):
+        result = report[phase]
+        print(
+            f"{phase:<9} {result['solve_seconds']:7.3f} s  scheduled {result['scheduled']:>6}"
+            f"  unscheduled {result['unscheduled']:>5}  mean deviation {result['mean_deviation_hours']:7.2f} h"
+            f"  utilization {result['utilization']:.1%}"
+        )
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Read throughput of ``python -m app.serve`` as the number of workers grows.
+
+Seeds one database, then for each worker count starts the server, warms it up
+and drives read endpoints from several client processes for a fixed time, so
+the load generator is not the bottleneck.  Reports requests per second,
+p50/p95 latency and the speedup over the smallest worker count::
+
+    python -m benchmarks.bench_workers --workers 1 2 4 8 --rows 50000 --output workers.json
+
+Scaling stops at the number of CPU cores, which the client processes share
+with the server; run it on a machine with cores to spare.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import httpx
+from sqlalchemy import create_engine
+
+from .datagen import build_database
+from .harness import Call, build_scenarios, percentile, start_server, wait_ready
+
+DEFAULT_SCENARIOS = ("allocation_table", "list_allocations", "manager_requests", "project_summary")
+CALLS_PER_CLIENT = 2000
+
+
+async def _drive(base_url: str, method: str, calls: List[Call], concurrency: int, duration: float) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+
+        async def loop(offset: int) -> None:
+            nonlocal errors
+            i = offset
+            while time.perf_counter() < deadline:
+                path, params, body = calls[i % len(calls)]
+                started = time.perf_counter()
+                response = await client.request(method, path, params=params, json=body)
+                await response.aread()
+                latencies.append((time.perf_counter() - started) * 1000)
+                errors += response.status_code >= 400
+                i += concurrency
+
+        await asyncio.gather(*(loop(offset) for offset in range(concurrency)))
+    return {"latencies": latencies, "errors": errors}
+
+
+def _client(args: Tuple[str, str, List[Call], int, float]) -> dict:
+    return asyncio.run(_drive(*args))
+
+
+def measure(base_url: str, method: str, calls: List[Call], clients: int, concurrency: int, duration: float) -> dict:
+    shares = [calls[index::clients] or calls for index in range(clients)]
+    with multiprocessing.get_context("spawn").Pool(clients) as pool:
+        results = pool.map(_client, [(base_url, method, share, concurrency, duration) for share in shares])
+    latencies = [latency for result in results for latency in result["latencies"]]
+    return {
+        "requests": len(latencies),
+        "errors": sum(result["errors"] for result in results),
+        "throughput_rps": len(latencies) / duration,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+    }
+
+
+async def _warm_up(base_url: str, method: str, calls: List[Call], seconds: float) -> None:
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await wait_ready(client)
+        # Long enough for every worker to start and load its caches.
+        await _drive(base_url, method, calls, 8, seconds)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scenarios", nargs="+", default=list(DEFAULT_SCENARIOS))
+    parser.add_argument("--clients", type=int, default=os.cpu_count() or 1, help="load generator processes")
+    parser.add_argument("--concurrency", type=int, default=8, help="connections per client process")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per measurement")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    if max(args.workers) > cpus:
+        print(f"warning: {cpus} CPU(s); worker counts above that measure contention, not scaling", flush=True)
+    results: Dict[str, Dict[int, dict]] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Path(tmp) / "bench.db"
+        dataset = build_database(database, args.rows, args.seed)
+        engine = create_engine(f"sqlite:///{database}")
+        scenarios = {
+            scenario.name: scenario
+            for scenario in build_scenarios(dataset, engine, random.Random(args.seed))
+            if scenario.name in args.scenarios
+        }
+        engine.dispose()
+        calls = {name: [scenario.build(i) for i in range(CALLS_PER_CLIENT)] for name, scenario in scenarios.items()}
+
+        for workers in args.workers:
+            server, base_url = start_server(database, workers)
+            try:
+                for name, scenario in scenarios.items():
+                    asyncio.run(_warm_up(base_url, scenario.method, calls[name], args.warmup))
+                    result = measure(
+                        base_url, scenario.method, calls[name], args.clients, args.concurrency, args.duration
+                    )
+                    results.setdefault(name, {})[workers] = result
+                    print(
+                        f"{name:20s} workers {workers:2d}  {result['throughput_rps']:8.1f} req/s"
+                        f"  p50 {result['p50_ms']:7.2f} ms  p95 {result['p95_ms']:7.2f} ms"
+                        f"  errors {result['errors']}",
+                        flush=True,
+                    )
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+    print("\nSpeedup over", min(args.workers), "worker(s):")
+    for name, by_workers in results.items():
+        base = by_workers[min(by_workers)]["throughput_rps"]
+        for workers, result in sorted(by_workers.items()):
+            result["speedup"] = result["throughput_rps"] / base if base else 0.0
+            result["efficiency"] = result["speedup"] / (workers / min(by_workers))
+        print(
+            f"{name:20s} "
+            + "  ".join(f"{workers}w {result['speedup']:.2f}x" for workers, result in sorted(by_workers.items()))
+        )
+    if args.output:
+        report = {
+            "meta": {"cpus": cpus, "rows": args.rows, "clients": args.clients, **vars(args)},
+            "scenarios": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Seeded synthetic data for benchmarks and load tests.
+
+Volumes scale from ``--rows`` (approximate total across all tables) with
+facility-like proportions: a few hundred staff, many PIs, roughly fifteen
+requests per project and allocations packed back to back on each beamline so
+that no two slots on the same beamline overlap::
+
+    python -m benchmarks.datagen --database seeded.db --rows 200000 --seed 7
+"""
+
+import argparse
+import random
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Iterable, Iterator, List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app import models, search  # noqa: F401  (search adds the full-text indexes to create_all)
+from app.counters import rebuild_status_counts
+from app.database import Base
+from app.reports import rebuild_monthly_rollup
+
+EPOCH = datetime(2016, 1, 1)
+SPAN_DAYS = 10 * 365
+CHUNK = 20_000
+
+WORDS = (
+    "diffraction crystallography spectroscopy tomography scattering operando catalyst "
+    "battery cathode protein membrane perovskite thin-film magnetic ordering phonon "
+    "high-pressure cryogenic time-resolved nanoscale imaging microbeam powder "
+    "synthesis interface polymer alloy fatigue corrosion quantum"
+).split()
+
+
+@dataclass
+class Volumes:
+    users: int
+    research_projects: int
+    beamtime_requests: int
+    allocations: int
+    approvals: int
+    beamlines: int
+
+    @classmethod
+    def for_rows(cls, total_rows: int) -> "Volumes":
+        users = max(40, total_rows // 500)
+        projects = max(20, total_rows // 50)
+        requests = max(50, total_rows * 3 // 10)
+        allocations = max(50, total_rows * 55 // 100)
+        approvals = max(20, total_rows - users - projects - requests - allocations)
+        beamlines = max(4, min(60, allocations // 2000))
+        return cls(users, projects, requests, allocations, approvals, beamlines)
+
+
+@dataclass
+class Dataset:
+    """Ids a load test needs to build realistic calls against the seeded data."""
+
+    volumes: Volumes
+    pi_ids: List[int]
+    manager_ids: List[int]
+    allocator_ids: List[int]
+    approver_ids: List[int]
+    project_owner: dict
+    beamlines: List[str]
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _chunks(rows: Iterable[dict], size: int = CHUNK) -> Iterator[List[dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _created(rng: random.Random) -> datetime:
+    return EPOCH + timedelta(days=rng.randrange(SPAN_DAYS), seconds=rng.randrange(86400))
+
+
+def beamline_names(count: int) -> List[str]:
+    return [f"BL{number:02d}" for number in range(1, count + 1)]
+
+
+def seed(connection, volumes: Volumes, rng: random.Random) -> Dataset:
+    """Insert ``volumes`` worth of rows through ``connection`` (Core executemany)."""
+
+    # 70% PIs, the rest split across managers, allocators and approvers.
+    staff = max(4, volumes.users * 3 // 10)
+    roles = (
+        [models.UserRole.PROJECT_MANAGER] * (staff // 2)
+        + [models.UserRole.ALLOCATOR] * (staff // 4)
+        + [models.UserRole.APPROVER] * (staff - staff // 2 - staff // 4)
+    )
+    roles += [models.UserRole.PI] * (volumes.users - len(roles))
+    by_role = {role: [] for role in models.UserRole}
+    users = []
+    for index, role in enumerate(roles, start=1):
+        by_role[role].append(index)
+        users.append(
+            {
+                "id": index,
+                "name": f"User {index}",
+                "email": f"user{index}@facility.example",
+                "affiliation": f"Institute {rng.randrange(1, 200)}",
+                "role": role.name,
+            }
+        )
+    connection.execute(models.User.__table__.insert(), users)
+
+    project_owner = {}
+    projects = []
+    for index in range(1, volumes.research_projects + 1):
+        pi_id = rng.choice(by_role[models.UserRole.PI])
+        project_owner[index] = (pi_id, rng.choice(by_role[models.UserRole.PROJECT_MANAGER]))
+        projects.append(
+            {
+                "id": index,
+                "title": _sentence(rng, 4),
+                "description": _sentence(rng, 20),
+                "pi_id": pi_id,
+                "manager_id": project_owner[index][1],
+            }
+        )
+    for batch in _chunks(projects):
+        connection.execute(models.ResearchProject.__table__.insert(), batch)
+
+    statuses = [status.name for status in models.RequestStatus]
+    for batch in _chunks(
+        {
+            "id": index,
+            "project_id": rng.randrange(1, volumes.research_projects + 1),
+            "requested_date": date(2016, 1, 1) + timedelta(days=rng.randrange(SPAN_DAYS)),
+            "duration_hours": rng.choice((4, 8, 12, 24, 48)),
+            "justification": _sentence(rng, 40),
+            "status": rng.choices(statuses, weights=(2, 2, 5, 1))[0],
+            "created_at": _created(rng),
+        }
+        for index in range(1, volumes.beamtime_requests + 1)
+    ):
+        connection.execute(models.BeamtimeRequest.__table__.insert(), batch)
+
+    beamlines = beamline_names(volumes.beamlines)
+    allocation_statuses = [status.name for status in models.AllocationStatus]
+
+    def allocations() -> Iterator[dict]:
+        # Fill each beamline day by day with back-to-back slots (plus random
+        # idle gaps) that never cross midnight.
+        per_beamline = -(-volumes.allocations // len(beamlines))
+        allocation_id = 0
+        for beamline in beamlines:
+            day = EPOCH.date()
+            hour = 0
+            for _ in range(per_beamline):
+                if allocation_id == volumes.allocations:
+                    return
+                hours = rng.choice((4, 8, 8, 12))
+                hour += rng.choice((0, 0, 4, 8))
+                if hour + hours > 24:
+                    day += timedelta(days=1)
+                    hour = 0
+                allocation_id += 1
+                yield {
+                    "id": allocation_id,
+                    "request_id": rng.randrange(1, volumes.beamtime_requests + 1),
+                    "beamline": beamline,
+                    "slot_date": day,
+                    "slot_time": f"{hour:02d}:00",
+                    "duration_hours": hours,
+                    "status": rng.choice(allocation_statuses),
+                    "created_at": _created(rng),
+                }
+                hour += hours
+
+    for batch in _chunks(allocations()):
+        connection.execute(models.Allocation.__table__.insert(), batch)
+
+    for batch in _chunks(
+        {
+            "id": index,
+            "allocation_id": rng.randrange(1, volumes.allocations + 1),
+            "approver_id": rng.choice(by_role[models.UserRole.APPROVER]),
+            "approved": rng.random() < 0.9,
+            "notes": None,
+            "created_at": _created(rng),
+        }
+        for index in range(1, volumes.approvals + 1)
+    ):
+        connection.execute(models.Approval.__table__.insert(), batch)
+
+    return Dataset(
+        volumes=volumes,
+        pi_ids=by_role[models.UserRole.PI],
+        manager_ids=by_role[models.UserRole.PROJECT_MANAGER],
+        allocator_ids=by_role[models.UserRole.ALLOCATOR],
+        approver_ids=by_role[models.UserRole.APPROVER],
+        project_owner=project_owner,
+        beamlines=beamlines,
+    )
+
+
+def build_database(database: Path, total_rows: int, seed_value: int = 1) -> Dataset:
+    """Create a fresh SQLite file at ``database`` with the full schema and seeded rows."""
+
+    if database.exists():
+        database.unlink()
+    engine = create_engine(f"sqlite:///{database}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        dataset = seed(connection, Volumes.for_rows(total_rows), random.Random(seed_value))
+        rebuild_monthly_rollup(Session(bind=connection))
+        rebuild_status_counts(Session(bind=connection))
+        connection.exec_driver_sql("ANALYZE")
+    engine.dispose()
+    return dataset
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", type=Path, required=True)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    dataset = build_database(args.database, args.rows, args.seed)
+    print(asdict(dataset.volumes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""Per-endpoint latency and throughput for every route of the FastAPI app.
+
+Builds a seeded database with :mod:`benchmarks.datagen`, then drives each
+route with realistic arguments either in-process through the ASGI app or over
+HTTP against ``uvicorn``, and writes p50/p95/p99 latency and throughput as
+JSON so runs can be compared across commits::
+
+    python -m benchmarks.harness --rows 50000 --output bench.json
+    python -m benchmarks.harness --mode uvicorn --workers 2 --output bench-uvicorn.json
+    python -m benchmarks.harness --baseline bench.json --output bench-new.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from .datagen import WORDS as SEARCH_WORDS, Dataset, build_database
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# (path, query params, json body) for the i-th call of a scenario.
+Call = Tuple[str, Optional[dict], Optional[object]]
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    route: str
+    build: Callable[[int], Call]
+
+
+def _sample(engine, sql: str, limit: int = 2000) -> List[tuple]:
+    with engine.connect() as connection:
+        return [tuple(row) for row in connection.execute(text(sql + f" LIMIT {limit}"))]
+
+
+def build_scenarios(dataset: Dataset, engine, rng: random.Random) -> List[Scenario]:
+    requests_with_manager = _sample(
+        engine,
+        "SELECT beamtime_requests.id, research_projects.manager_id FROM beamtime_requests "
+        "JOIN research_projects ON research_projects.id = beamtime_requests.project_id "
+        "ORDER BY beamtime_requests.id DESC",
+    )
+    allocation_ids = [row[0] for row in _sample(engine, "SELECT id FROM allocations ORDER BY id DESC")]
+    projects = list(dataset.project_owner.items())
+    beamline = dataset.beamlines[0]
+    stamp = int(time.time())
+
+    def pick(values):
+        return values[rng.randrange(len(values))]
+
+    def new_slot(i: int, beamline: str = "BENCH") -> dict:
+        return {
+            "beamline": beamline,
+            "slot_date": (date(2040, 1, 1) + timedelta(days=i)).isoformat(),
+            "slot_time": "08:00",
+            "duration_hours": 8,
+        }
+
+    def create_request(i: int) -> Call:
+        project_id, (pi_id, _) = pick(projects)
+        body = {"requested_date": "2030-01-01", "duration_hours": 8, "justification": "Benchmark"}
+        return f"/projects/{project_id}/requests", {"pi_id": pi_id}, body
+
+    def update_status(i: int) -> Call:
+        request_id, manager_id = pick(requests_with_manager)
+        body = {"status": pick(["REVIEWED", "APPROVED"])}
+        return f"/requests/{request_id}/status", {"manager_id": manager_id}, body
+
+    def create_project(i: int) -> Call:
+        _, (pi_id, manager_id) = pick(projects)
+        body = {"title": f"Bench {i}", "pi_id": pi_id, "manager_id": manager_id}
+        return "/projects/", None, body
+
+    def bulk(i: int) -> Call:
+        items = [
+            {"request_id": pick(requests_with_manager)[0], **new_slot(i * 20 + offset, "BENCH-BULK")}
+            for offset in range(20)
+        ]
+        return "/allocations/bulk", None, {"allocator_id": pick(dataset.allocator_ids), "items": items}
+
+    month = {"beamline": beamline, "start": "2017-03-01", "end": "2017-03-31"}
+    return [
+        Scenario("create_user", "POST", "/users/", lambda i: (
+            "/users/", None, {"name": "Bench", "email": f"bench-{stamp}-{i}@example.org", "role": "PI"}
+        )),
+        Scenario("update_user", "PUT", "/users/{user_id}", lambda i: (
+            f"/users/{pick(dataset.pi_ids)}", None, {"affiliation": f"Institute {i}"}
+        )),
+        Scenario("role_cache_stats", "GET", "/cache/roles", lambda i: ("/cache/roles", None, None)),
+        Scenario("database_pool_status", "GET", "/database/pool", lambda i: ("/database/pool", None, None)),
+        Scenario("metrics", "GET", "/metrics", lambda i: ("/metrics", None, None)),
+        Scenario("list_projects_for_pi", "GET", "/users/{user_id}/projects", lambda i: (
+            f"/users/{pick(projects)[1][0]}/projects", None, None
+        )),
+        Scenario("pi_summary", "GET", "/users/{user_id}/summary", lambda i: (
+            f"/users/{pick(projects)[1][0]}/summary", None, None
+        )),
+        Scenario("create_project", "POST", "/projects/", create_project),
+        Scenario("update_project", "PUT", "/projects/{project_id}", lambda i: (
+            f"/projects/{pick(projects)[0]}", None, {"description": f"Revision {i}"}
+        )),
+        # Deletes the childless projects added by the create_project scenario.
+        Scenario("delete_project", "DELETE", "/projects/{project_id}", lambda i: (
+            f"/projects/{dataset.volumes.research_projects + 1 + i}", None, None
+        )),
+        Scenario("create_request", "POST", "/projects/{project_id}/requests", create_request),
+        Scenario("list_requests", "GET", "/projects/{project_id}/requests", lambda i: (
+            f"/projects/{pick(projects)[0]}/requests", None, None
+        )),
+        Scenario("manager_requests", "GET", "/managers/{manager_id}/requests", lambda i: (
+            f"/managers/{pick(dataset.manager_ids)}/requests", None, None
+        )),
+        Scenario("project_summary", "GET", "/projects/{project_id}/summary", lambda i: (
+            f"/projects/{pick(projects)[0]}/summary", None, None
+        )),
+        Scenario("manager_summary", "GET", "/managers/{manager_id}/summary", lambda i: (
+            f"/managers/{pick(dataset.manager_ids)}/summary", None, None
+        )),
+        Scenario("beamline_summary", "GET", "/beamlines/{beamline}/summary", lambda i: (
+            f"/beamlines/{pick(dataset.beamlines)}/summary", None, None
+        )),
+        Scenario("beamline_calendar", "GET", "/beamlines/{beamline}/calendar", lambda i: (
+            f"/beamlines/{pick(dataset.beamlines)}/calendar", {"start": "2017-03-01", "end": "2017-03-31"}, None
+        )),
+        Scenario("beamline_calendar_year", "GET", "/beamlines/{beamline}/calendar", lambda i: (
+            f"/beamlines/{pick(dataset.beamlines)}/calendar",
+            {"start": f"{2016 + i % 3}-01-01", "end": f"{2016 + i % 3}-12-31", "detail": "hours"},
+            None,
+        )),
+        Scenario("update_request_status", "PATCH", "/requests/{request_id}/status", update_status),
+        Scenario("create_allocation", "POST", "/requests/{request_id}/allocations", lambda i: (
+            f"/requests/{pick(requests_with_manager)[0]}/allocations",
+            {"allocator_id": pick(dataset.allocator_ids)},
+            new_slot(i),
+        )),
+        Scenario("bulk_create_allocations", "POST", "/allocations/bulk", bulk),
+        Scenario("propose_schedule", "POST", "/allocations/schedule", lambda i: (
+            "/allocations/schedule",
+            None,
+            {
+                "allocator_id": pick(dataset.allocator_ids),
+                "start": f"{2016 + i % 10}-01-01",
+                "end": f"{2016 + i % 10}-06-30",
+                "beamlines": [{"name": name} for name in dataset.beamlines],
+            },
+        )),
+        Scenario("check_allocation_conflicts", "POST", "/allocations/conflicts", lambda i: (
+            "/allocations/conflicts",
+            None,
+            [{**new_slot(offset, beamline), "slot_date": f"2017-03-{offset % 28 + 1:02d}"} for offset in range(50)],
+        )),
+        Scenario("list_allocations", "GET", "/allocations/", lambda i: ("/allocations/", month, None)),
+        Scenario("list_allocations_page", "GET", "/allocations/", lambda i: ("/allocations/", None, None)),
+        Scenario("allocation_table", "GET", "/allocations/table", lambda i: ("/allocations/table", month, None)),
+        Scenario("allocation_table_stream", "GET", "/allocations/table", lambda i: (
+            "/allocations/table", {**month, "end": "2017-12-31", "stream": "true"}, None
+        )),
+        Scenario("approve_allocation", "POST", "/allocations/{allocation_id}/approve", lambda i: (
+            f"/allocations/{pick(allocation_ids)}/approve",
+            None,
+            {"approver_id": pick(dataset.approver_ids), "approved": True},
+        )),
+        Scenario("export_allocations_csv", "GET", "/exports/allocations", lambda i: (
+            "/exports/allocations", {**month, "end": "2017-12-31"}, None
+        )),
+        Scenario("export_allocations_parquet", "GET", "/exports/allocations", lambda i: (
+            "/exports/allocations", {**month, "end": "2017-12-31", "format": "parquet"}, None
+        )),
+        Scenario("export_monthly", "GET", "/exports/monthly", lambda i: (
+            "/exports/monthly", {"start_year": 2016, "end_year": 2025}, None
+        )),
+        Scenario("approve_allocations_batch", "POST", "/allocations/approvals", lambda i: (
+            "/allocations/approvals",
+            None,
+            {
+                "approver_id": pick(dataset.approver_ids),
+                "decisions": [
+                    {"allocation_id": allocation_id, "approved": offset % 5 != 0}
+                    for offset, allocation_id in enumerate(allocation_ids[i * 50 % len(allocation_ids):][:50])
+                ],
+            },
+        )),
+        Scenario("search", "GET", "/search", lambda i: (
+            "/search", {"q": " ".join(rng.sample(SEARCH_WORDS, 2))}, None
+        )),
+        Scenario("analytics_utilization", "GET", "/analytics/utilization", lambda i: (
+            "/analytics/utilization", {"start": f"{2016 + i % 5}-01-01", "end": "2025-12-31", "granularity": "day"}, None
+        )),
+        Scenario("analytics_gaps", "GET", "/analytics/gaps", lambda i: (
+            "/analytics/gaps", {"start": f"{2016 + i % 5}-01-01", "end": "2025-12-31"}, None
+        )),
+        Scenario("analytics_oversubscription", "GET", "/analytics/oversubscription", lambda i: (
+            "/analytics/oversubscription", {"start": f"{2016 + i % 5}-01-01", "end": "2025-12-31"}, None
+        )),
+        Scenario("analytics_shares", "GET", "/analytics/shares", lambda i: (
+            "/analytics/shares", {"start": f"{2016 + i % 5}-01-01", "end": "2025-12-31", "by": "project"}, None
+        )),
+        Scenario("monthly_report", "GET", "/reports/monthly", lambda i: (
+            "/reports/monthly", {"year": 2016 + i % 10}, None
+        )),
+        Scenario("monthly_rollup", "GET", "/reports/monthly/rollup", lambda i: (
+            "/reports/monthly/rollup", {"start_year": 2016, "end_year": 2025}, None
+        )),
+    ]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[position]
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors: Dict[int, int] = {}
+
+    async def one(i: int) -> None:
+        path, params, body = scenario.build(i)
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.request(scenario.method, path, params=params, json=body)
+            await response.aread()
+            latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            errors[response.status_code] = errors.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "method": scenario.method,
+        "route": scenario.route,
+        "count": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "mean_ms": statistics.fmean(latencies) if latencies else 0.0,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+async def run_all(client: httpx.AsyncClient, scenarios: List[Scenario], requests: int, concurrency: int) -> dict:
+    results = {}
+    for scenario in scenarios:
+        # One warm-up call so first-use costs (role cache, slot index) are not measured.
+        path, params, body = scenario.build(requests)
+        await client.request(scenario.method, path, params=params, json=body)
+        results[scenario.name] = await run_scenario(client, scenario, requests, concurrency)
+        print(
+            f"{scenario.name:30s} p50 {results[scenario.name]['p50_ms']:8.2f} ms"
+            f"  p95 {results[scenario.name]['p95_ms']:8.2f} ms"
+            f"  {results[scenario.name]['throughput_rps']:8.1f} req/s",
+            flush=True,
+        )
+    return results
+
+
+def _install_overrides(app, database: Path) -> None:
+    from app.dependencies import get_async_db
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{database}", poolclass=NullPool)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_asgi(database: Path, scenarios: List[Scenario], requests: int, concurrency: int) -> dict:
+    from app.main import app
+
+    _install_overrides(app, database)
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        return await run_all(client, scenarios, requests, concurrency)
+
+
+def start_server(database: Path, workers: int) -> Tuple[subprocess.Popen, str]:
+    """Start ``python -m app.serve`` on ``database``; returns the process and its base URL."""
+
+    port = _free_port()
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{database}"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(client: httpx.AsyncClient) -> None:
+    for _ in range(300):
+        try:
+            if (await client.get("/database/pool")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("uvicorn did not become ready")
+
+
+async def run_uvicorn(
+    database: Path, scenarios: List[Scenario], requests: int, concurrency: int, workers: int
+) -> dict:
+    server, base_url = start_server(database, workers)
+    try:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+            await wait_ready(client)
+            return await run_all(client, scenarios, requests, concurrency)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+# Long-lived streams have no meaningful per-request latency.
+UNTIMED_ROUTES = {("GET", "/events")}
+
+
+def unbenchmarked_routes(scenarios: List[Scenario]) -> List[str]:
+    from app.main import app
+
+    covered = {(scenario.method, scenario.route) for scenario in scenarios} | UNTIMED_ROUTES
+    missing = []
+    for route in app.routes:
+        for method in sorted(getattr(route, "methods", None) or ()):
+            if method in ("HEAD", "OPTIONS") or route.path.startswith(("/docs", "/redoc", "/openapi")):
+                continue
+            if (method, route.path) not in covered:
+                missing.append(f"{method} {route.path}")
+    return missing
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, current: dict) -> None:
+    print("\nChange vs baseline (p95 latency, throughput):")
+    for name, result in current["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous or not previous["p95_ms"] or not previous["throughput_rps"]:
+            continue
+        p95 = (result["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"] * 100
+        rps = (result["throughput_rps"] - previous["throughput_rps"]) / previous["throughput_rps"] * 100
+        print(f"{name:30s} p95 {p95:+7.1f}%  throughput {rps:+7.1f}%")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("asgi", "uvicorn"), default="asgi")
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=200, help="calls per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers (uvicorn mode)")
+    parser.add_argument("--only", nargs="*", help="run only these scenario names")
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--baseline", type=Path, help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Path(tmp) / "bench.db"
+        dataset = build_database(database, args.rows, args.seed)
+        engine = create_engine(f"sqlite:///{database}")
+        scenarios = build_scenarios(dataset, engine, random.Random(args.seed))
+        engine.dispose()
+        missing = unbenchmarked_routes(scenarios)
+        if args.only:
+            scenarios = [scenario for scenario in scenarios if scenario.name in args.only]
+
+        if args.mode == "asgi":
+            endpoints = asyncio.run(run_asgi(database, scenarios, args.requests, args.concurrency))
+        else:
+            endpoints = asyncio.run(
+                run_uvicorn(database, scenarios, args.requests, args.concurrency, args.workers)
+            )
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "mode": args.mode,
+            "workers": args.workers if args.mode == "uvicorn" else None,
+            "rows": args.rows,
+            "seed": args.seed,
+            "requests_per_endpoint": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "endpoints": endpoints,
+        "unbenchmarked_routes": missing,
+    }
+    if missing:
+        print("Routes without a scenario:", ", ".join(missing))
+    if args.baseline:
+        compare(json.loads(args.baseline.read_text()), report)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
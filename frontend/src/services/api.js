@@ -1,13 +1,24 @@
 import axios from 'axios';
 
+const baseURL = import.meta.env.VITE_API_URL || '/api';
+
 const client = axios.create({
-  baseURL: import.meta.env.VITE_API_URL || '/api',
+  baseURL,
   timeout: 10000
 });
 
+// POSTs that time out or lose the connection are retried with the same
+// Idempotency-Key, so the server replays the first result instead of writing twice.
+const MAX_RETRIES = 2;
+
 client.interceptors.response.use(
   response => response,
   error => {
+    const { config } = error;
+    if (!error.response && config?.headers?.['Idempotency-Key'] && (config.retries || 0) < MAX_RETRIES) {
+      config.retries = (config.retries || 0) + 1;
+      return client.request(config);
+    }
     if (error.response) {
       console.error('API error', error.response.data);
     }
@@ -15,7 +26,50 @@ client.interceptors.response.use(
   }
 );
 
+export const newIdempotencyKey = () => crypto.randomUUID();
+
 export const get = (url, config = {}) => client.get(url, config);
-export const post = (url, payload, config = {}) => client.post(url, payload, config);
+// Pass `idempotencyKey` to reuse one key across resubmissions of the same form.
+export const post = (url, payload, { idempotencyKey = newIdempotencyKey(), ...config } = {}) =>
+  client.post(url, payload, { ...config, headers: { ...config.headers, 'Idempotency-Key': idempotencyKey } });
 export const patch = (url, payload, config = {}) => client.patch(url, payload, config);
 export const del = (url, config = {}) => client.delete(url, config);
+
+// One beamline's bookings between `start` and `end` (YYYY-MM-DD), expanded from
+// the columnar calendar payload into `{ date, occupiedHours, slots }` per booked
+// day. Use `detail: 'hours'` for month/year zoom; days then carry no slots.
+export const getBeamlineCalendar = async (beamline, { start, end, detail = 'slots' }) => {
+  const { data } = await get(`/beamlines/${encodeURIComponent(beamline)}/calendar`, {
+    params: { start, end, detail }
+  });
+  const origin = Date.parse(`${data.start}T00:00:00Z`);
+  const fields = Object.keys(data.slots || {});
+  let next = 0;
+  return data.days.map((offset, index) => {
+    const count = data.slot_counts ? data.slot_counts[index] : 0;
+    const slots = Array.from({ length: count }, (_, position) =>
+      Object.fromEntries(fields.map(field => [field, data.slots[field][next + position]]))
+    );
+    next += count;
+    return {
+      date: new Date(origin + offset * 86400000).toISOString().slice(0, 10),
+      occupiedHours: data.occupied_hours[index],
+      slots
+    };
+  });
+};
+
+// Listen to the server-sent event feed. EventSource reconnects by itself and
+// resumes from the last event id it saw; a `reset` event means history was lost
+// and the caller should re-fetch. Returns a function that closes the stream.
+export const subscribe = (filters, onEvent) => {
+  const params = new URLSearchParams(
+    Object.entries(filters || {}).filter(([, value]) => value !== undefined && value !== null)
+  );
+  const source = new EventSource(`${baseURL}/events?${params}`);
+  const types = ['allocation.created', 'allocation.approved', 'allocation.rejected', 'request.status_changed', 'reset'];
+  types.forEach(type =>
+    source.addEventListener(type, event => onEvent(type, JSON.parse(event.data)))
+  );
+  return () => source.close();
+};
@@ -1,33 +1,51 @@
-from datetime import date
+import asyncio
+import io
+import json
+import sys
+import threading
+from datetime import date, datetime
 
+import numpy
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
-from app.database import Base
-from app.dependencies import get_db
-from app.main import app
+from app.config import Settings
+from app.database import Base, create_db_engine, pool_status, prepare_schema
+from app.dependencies import get_async_db
+from app.events import EventFilter, event_bus, sse_stream
+from app.main import app, create_app
+from app import models, schemas, serialization
+from app.metrics import MetricsMiddleware
+from app.query_counter import assert_max_queries
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 test_engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
+# TestClient may run each request on a fresh event loop, so never reuse
+# aiosqlite connections between requests.
+test_async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(test_async_engine, autoflush=False, expire_on_commit=False)
 
 Base.metadata.drop_all(bind=test_engine)
 Base.metadata.create_all(bind=test_engine)
 
 
-def override_get_db():
-    db = TestingSessionLocal()
-    try:
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 client = TestClient(app)
 
 
@@ -126,3 +144,892 @@ def test_full_workflow():
     table_resp = client.get("/allocations/table")
     assert table_resp.status_code == 200
     assert table_resp.json()[0]["project_title"] == "Project A"
+
+
+def create_allocator_request(suffix):
+    pi_id = create_user({"name": "PI", "email": f"pi-{suffix}@example.com", "role": "PI"})
+    manager_id = create_user({
+        "name": "Manager",
+        "email": f"manager-{suffix}@example.com",
+        "role": "PROJECT_MANAGER",
+    })
+    allocator_id = create_user({
+        "name": "Allocator",
+        "email": f"allocator-{suffix}@example.com",
+        "role": "ALLOCATOR",
+    })
+    project_resp = client.post(
+        "/projects/",
+        json={"title": f"Project {suffix}", "pi_id": pi_id, "manager_id": manager_id},
+    )
+    project_id = project_resp.json()["id"]
+    request_resp = client.post(
+        f"/projects/{project_id}/requests",
+        params={"pi_id": pi_id},
+        json={"requested_date": "2030-01-01", "duration_hours": 4},
+    )
+    return {
+        "pi_id": pi_id,
+        "manager_id": manager_id,
+        "allocator_id": allocator_id,
+        "project_id": project_id,
+        "request_id": request_resp.json()["id"],
+    }
+
+
+def test_allocation_listing_pagination_and_streaming():
+    ids = create_allocator_request("pagination")
+    for day, slot_time in ((3, "08:00"), (1, "08:00"), (2, "08:00"), (1, "10:00")):
+        resp = client.post(
+            f"/requests/{ids['request_id']}/allocations",
+            params={"allocator_id": ids["allocator_id"]},
+            json={
+                "beamline": "BL-PAGE",
+                "slot_date": f"2030-02-0{day}",
+                "slot_time": slot_time,
+                "duration_hours": 1,
+            },
+        )
+        assert resp.status_code == 200
+
+    seen = []
+    params = {"beamline": "BL-PAGE", "limit": 3}
+    page = client.get("/allocations/", params=params)
+    assert page.status_code == 200
+    seen.extend(page.json())
+    cursor = page.headers["X-Next-Cursor"]
+    page = client.get("/allocations/", params={**params, "cursor": cursor})
+    seen.extend(page.json())
+    assert "X-Next-Cursor" not in page.headers
+    assert [row["slot_date"] for row in seen] == ["2030-02-01", "2030-02-01", "2030-02-02", "2030-02-03"]
+    assert len({row["id"] for row in seen}) == 4
+
+    ranged = client.get(
+        "/allocations/table",
+        params={"beamline": "BL-PAGE", "start": "2030-02-02", "end": "2030-02-03"},
+    )
+    assert [row["slot_date"] for row in ranged.json()] == ["2030-02-02", "2030-02-03"]
+    assert ranged.json()[0]["project_title"] == "Project pagination"
+
+    streamed = client.get("/allocations/table", params={"beamline": "BL-PAGE", "stream": True})
+    assert streamed.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in streamed.text.splitlines()]
+    assert len(lines) == 4
+
+    assert client.get("/allocations/", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_monthly_rollup_tracks_inserts_and_status_changes():
+    year = date.today().year
+    before = client.get("/reports/monthly/rollup", params={"start_year": year, "beamline": "BL-ROLLUP"})
+    assert before.json() == []
+
+    ids = create_allocator_request("rollup")
+    client.patch(
+        f"/requests/{ids['request_id']}/status",
+        params={"manager_id": ids["manager_id"]},
+        json={"status": "APPROVED"},
+    )
+    client.post(
+        f"/requests/{ids['request_id']}/allocations",
+        params={"allocator_id": ids["allocator_id"]},
+        json={"beamline": "BL-ROLLUP", "slot_date": "2030-03-01", "slot_time": "08:00", "duration_hours": 2},
+    )
+
+    rollup = client.get(
+        "/reports/monthly/rollup",
+        params={"start_year": year, "kind": "ALLOCATION", "beamline": "BL-ROLLUP"},
+    ).json()
+    assert [(row["status"], row["count"]) for row in rollup] == [("SCHEDULED", 1)]
+
+    requests_rollup = client.get(
+        "/reports/monthly/rollup", params={"start_year": year, "kind": "REQUEST"}
+    ).json()
+    statuses = {row["status"] for row in requests_rollup}
+    assert "APPROVED" in statuses
+
+    monthly = client.get("/reports/monthly", params={"year": year}).json()
+    month = date.today().strftime("%Y-%m")
+    current = next(item for item in monthly if item["month"] == month)
+    assert current["request_count"] == sum(row["count"] for row in requests_rollup if row["month"] == month)
+
+
+def test_role_cache_serves_repeat_lookups_and_is_invalidated_on_update():
+    ids = create_allocator_request("roles")
+    before = client.get("/cache/roles").json()
+    client.get(f"/users/{ids['pi_id']}/projects")
+    client.get(f"/users/{ids['pi_id']}/projects")
+    after = client.get("/cache/roles").json()
+    assert after["hits"] - before["hits"] == 2
+    assert after["misses"] == before["misses"]
+
+    client.put(f"/users/{ids['pi_id']}", json={"affiliation": "New Lab"})
+    client.get(f"/users/{ids['pi_id']}/projects")
+    assert client.get("/cache/roles").json()["misses"] == after["misses"] + 1
+
+
+def test_create_allocation_rejects_overlapping_slots():
+    ids = create_allocator_request("conflicts")
+
+    def book(slot_time, hours, beamline="BL-CONFLICT"):
+        return client.post(
+            f"/requests/{ids['request_id']}/allocations",
+            params={"allocator_id": ids["allocator_id"]},
+            json={"beamline": beamline, "slot_date": "2030-04-01", "slot_time": slot_time, "duration_hours": hours},
+        )
+
+    first = book("08:00", 4)
+    assert first.status_code == 200
+    assert book("12:00", 2).status_code == 200
+    clash = book("10:00", 1)
+    assert clash.status_code == 409
+    assert clash.json()["detail"]["conflicting_allocation_ids"] == [first.json()["id"]]
+    assert book("10:00", 1, beamline="BL-OTHER").status_code == 200
+    assert book("8am", 1).status_code == 422
+    # Offsets would make tz-aware bounds that cannot be compared with the booked ones.
+    assert book("10:00+09:00", 1).status_code == 422
+    assert book("16:00:30", 1).status_code == 422
+    assert book("16:00:00", 1).json()["slot_time"] == "16:00"
+
+    check = client.post(
+        "/allocations/conflicts",
+        json=[
+            {"beamline": "BL-CONFLICT", "slot_date": "2030-04-01", "slot_time": "06:00", "duration_hours": 3},
+            {"beamline": "BL-CONFLICT", "slot_date": "2030-04-01", "slot_time": "20:00", "duration_hours": 2},
+            {"beamline": "BL-CONFLICT", "slot_date": "2030-04-01", "slot_time": "21:00", "duration_hours": 1},
+        ],
+    )
+    assert check.status_code == 200
+    results = check.json()
+    assert results[0]["conflicting_allocation_ids"] == [first.json()["id"]]
+    assert results[1] == {"index": 1, "conflicting_allocation_ids": [], "conflicting_indexes": [2]}
+    assert results[2]["conflicting_indexes"] == [1]
+
+
+def test_bulk_allocation_import_reports_per_row_errors():
+    ids = create_allocator_request("bulk")
+
+    def item(slot_time, request_id=ids["request_id"]):
+        return {
+            "request_id": request_id,
+            "beamline": "BL-BULK",
+            "slot_date": "2030-05-01",
+            "slot_time": slot_time,
+            "duration_hours": 2,
+        }
+
+    atomic = client.post(
+        "/allocations/bulk",
+        json={"allocator_id": ids["allocator_id"], "atomic": True, "items": [item("08:00"), item("09:00")]},
+    )
+    assert atomic.status_code == 409
+    assert client.get("/allocations/", params={"beamline": "BL-BULK"}).json() == []
+
+    resp = client.post(
+        "/allocations/bulk",
+        json={
+            "allocator_id": ids["allocator_id"],
+            "items": [item("08:00"), item("09:00"), item("12:00", request_id=999999), item("10:00")],
+        },
+    )
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [row["slot_time"] for row in body["created"]] == ["08:00", "10:00"]
+    assert all(row["status"] == "SCHEDULED" and row["id"] for row in body["created"])
+    assert [(error["index"], error["detail"]) for error in body["errors"]] == [
+        (1, "Beamline slot overlaps an existing allocation"),
+        (2, "Request not found"),
+    ]
+    listed = client.get("/allocations/", params={"beamline": "BL-BULK"}).json()
+    assert [row["id"] for row in listed] == [row["id"] for row in body["created"]]
+
+
+def test_engine_factory_applies_sqlite_pragmas_and_reports_pool_stats(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'pragmas.db'}")
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+    stats = pool_status(engine)
+    assert stats["pool_class"] == "InstrumentedQueuePool"
+    assert stats["checkouts"] == 1 and stats["checked_out"] == 0
+    engine.dispose()
+
+    resp = client.get("/database/pool")
+    assert resp.status_code == 200
+    assert set(resp.json()) == {"sync_pool", "async_pool"}
+
+
+def test_endpoints_stay_within_query_budgets():
+    ids = create_allocator_request("budget")
+    for _ in range(3):
+        client.post(
+            f"/projects/{ids['project_id']}/requests",
+            params={"pi_id": ids["pi_id"]},
+            json={"requested_date": "2030-06-01", "duration_hours": 2},
+        )
+    engines = (test_engine, test_async_engine)
+    # Budgets allow one users lookup per role check on a cold role cache. A
+    # status change is then the request read, one ON CONFLICT upsert each for
+    # the rollup and the status counters, and the UPDATE flushed on commit.
+    budgets = [
+        (2, lambda: client.get(f"/users/{ids['pi_id']}/projects")),
+        (1, lambda: client.get(f"/projects/{ids['project_id']}/requests")),
+        (2, lambda: client.get(f"/managers/{ids['manager_id']}/requests")),
+        (5, lambda: client.patch(
+            f"/requests/{ids['request_id']}/status",
+            params={"manager_id": ids["manager_id"]},
+            json={"status": "REVIEWED"},
+        )),
+        (1, lambda: client.get("/allocations/table", params={"beamline": "BL1"})),
+    ]
+    for budget, call in budgets:
+        with assert_max_queries(budget, *engines):
+            assert call().status_code == 200
+
+    assert len(client.get(f"/managers/{ids['manager_id']}/requests").json()) == 4
+
+
+def test_writes_return_their_rows_and_fold_checks_into_the_statement():
+    ids = create_allocator_request("returning")
+    engines = (test_engine, test_async_engine)
+    # The role cache is warm for the PI and manager but not yet for the allocator.
+    with assert_max_queries(1, *engines):
+        user = client.post("/users/", json={"name": "New", "email": "returning@example.com", "role": "PI"})
+    with assert_max_queries(1, *engines):
+        renamed = client.put(f"/users/{user.json()['id']}", json={"affiliation": "Lab"})
+    assert renamed.json()["affiliation"] == "Lab"
+    with assert_max_queries(1, *engines):
+        project = client.post(
+            "/projects/", json={"title": "Returning", "pi_id": ids["pi_id"], "manager_id": ids["manager_id"]}
+        )
+    with assert_max_queries(1, *engines):
+        assert client.put(f"/projects/{project.json()['id']}", json={"title": "Renamed"}).json()["title"] == "Renamed"
+    with assert_max_queries(3, *engines):
+        created = client.post(
+            f"/projects/{ids['project_id']}/requests",
+            params={"pi_id": ids["pi_id"]},
+            json={"requested_date": "2030-03-01", "duration_hours": 2},
+        )
+    assert created.json()["status"] == "PENDING" and created.json()["created_at"]
+    slot = {"beamline": "BL-RETURNING", "slot_date": "2030-03-02", "slot_time": "08:00", "duration_hours": 4}
+    # Allocator role, request lookup, slot index load, INSERT ... RETURNING,
+    # then one ON CONFLICT upsert each for the rollup and the status counters.
+    with assert_max_queries(6, *engines):
+        allocation = client.post(
+            f"/requests/{ids['request_id']}/allocations", params={"allocator_id": ids["allocator_id"]}, json=slot
+        )
+    assert allocation.json()["status"] == "SCHEDULED"
+
+    overlap = client.post(
+        f"/requests/{ids['request_id']}/allocations",
+        params={"allocator_id": ids["allocator_id"]},
+        json={**slot, "slot_time": "10:00"},
+    )
+    assert overlap.status_code == 409
+    assert overlap.json()["detail"]["conflicting_allocation_ids"] == [allocation.json()["id"]]
+
+    other_pi = create_user({"name": "Other", "email": "returning-other@example.com", "role": "PI"})
+    request_body = {"requested_date": "2030-03-01", "duration_hours": 2}
+    assert client.post(
+        f"/projects/{ids['project_id']}/requests", params={"pi_id": other_pi}, json=request_body
+    ).status_code == 403
+    assert client.post("/projects/999999/requests", params={"pi_id": ids["pi_id"]}, json=request_body).status_code == 404
+    assert client.put("/users/999999", json={"name": "Nobody"}).status_code == 404
+    assert client.put("/projects/999999", json={"title": "Nothing"}).status_code == 404
+    assert len(client.get(f"/projects/{ids['project_id']}/requests").json()) == 2
+
+
+def test_metrics_report_latency_sql_and_response_size(tmp_path):
+    ids = create_allocator_request("metrics")
+    client.get(f"/projects/{ids['project_id']}/requests")
+
+    body = client.get("/metrics").text
+    route = 'method="GET",route="/projects/{project_id}/requests"'
+    assert f'beamtime_http_requests_total{{{route},status="200"}}' in body
+    assert f'beamtime_http_request_duration_seconds_bucket{{{route},le="+Inf"}}' in body
+    assert f'beamtime_http_request_sql_statements_bucket{{{route},le="0"}} 0' in body
+    assert f"beamtime_http_response_size_bytes_sum{{{route}}}" in body
+    assert "beamtime_role_cache_hits" in body
+
+    profiled = MetricsMiddleware(
+        app, profile_threshold_ms=0.001, profile_dir=str(tmp_path), profile_interval_ms=1
+    )
+    stop = threading.Event()
+
+    def unrelated_busy_thread():
+        while not stop.is_set():
+            sum(range(1000))
+
+    busy = threading.Thread(target=unrelated_busy_thread)
+    busy.start()
+    # Fast requests hold the GIL for their whole run at the default 5 ms switch interval.
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(0.0001)
+    try:
+        profiled_client = TestClient(profiled)
+        for _ in range(200):
+            profiled_client.get("/allocations/table", params={"beamline": "BL-PAGE"})
+            if list(tmp_path.glob("*.folded")):
+                break
+    finally:
+        sys.setswitchinterval(switch_interval)
+        stop.set()
+        busy.join()
+        profiled.sampler.stop()
+    dumps = list(tmp_path.glob("*-GET_allocations_table.folded"))
+    assert dumps
+    stack, count = dumps[0].read_text().splitlines()[0].rsplit(" ", 1)
+    assert ";" in stack and int(count) >= 1
+    assert all("unrelated_busy_thread" not in dump.read_text() for dump in dumps)
+
+
+def test_listing_endpoints_revalidate_with_etags_until_a_write():
+    ids = create_allocator_request("etag")
+    params = {"beamline": "BL-ETAG"}
+    first = client.get("/allocations/table", params=params)
+    etag = first.headers["etag"]
+    assert first.json() == [] and first.headers["last-modified"]
+
+    with assert_max_queries(0, test_engine, test_async_engine):
+        cached = client.get("/allocations/table", params=params, headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.headers["etag"] == etag
+    # Second resolution cannot rule out a later write in the same second.
+    dated = client.get(
+        "/allocations/table", params=params, headers={"If-Modified-Since": first.headers["last-modified"]}
+    )
+    assert dated.status_code == 200
+
+    allocation = client.post(
+        f"/requests/{ids['request_id']}/allocations",
+        params={"allocator_id": ids["allocator_id"]},
+        json={"beamline": "BL-ETAG", "slot_date": "2030-07-01", "slot_time": "09:00", "duration_hours": 4},
+    )
+    assert allocation.status_code == 200
+    changed = client.get("/allocations/table", params=params, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert [row["beamline"] for row in changed.json()] == ["BL-ETAG"]
+
+    manager_etag = client.get(f"/managers/{ids['manager_id']}/requests").headers["etag"]
+    client.patch(
+        f"/requests/{ids['request_id']}/status",
+        params={"manager_id": ids["manager_id"]},
+        json={"status": "REVIEWED"},
+    )
+    refreshed = client.get(f"/managers/{ids['manager_id']}/requests", headers={"If-None-Match": manager_etag})
+    assert refreshed.status_code == 200
+    assert refreshed.json()[0]["status"] == "REVIEWED"
+
+
+def test_write_handlers_publish_events_that_resume_from_last_event_id():
+    ids = create_allocator_request("events")
+    approver_id = create_user({"name": "Approver", "email": "approver-events@example.com", "role": "APPROVER"})
+    resume_from = event_bus.last_event_id
+    allocation = client.post(
+        f"/requests/{ids['request_id']}/allocations",
+        params={"allocator_id": ids["allocator_id"]},
+        json={"beamline": "BL-EVENTS", "slot_date": "2030-08-01", "slot_time": "09:00", "duration_hours": 4},
+    ).json()
+    client.post(
+        f"/allocations/{allocation['id']}/approve",
+        json={"approver_id": approver_id, "approved": True},
+    )
+    client.patch(
+        f"/requests/{ids['request_id']}/status",
+        params={"manager_id": ids["manager_id"]},
+        json={"status": "APPROVED"},
+    )
+
+    async def replay(filters, count):
+        chunks = sse_stream(event_bus, filters, resume_from, heartbeat=0.05)
+        try:
+            return [await chunks.__anext__() for _ in range(count)]
+        finally:
+            await chunks.aclose()
+
+    beamline_chunks = asyncio.run(replay(EventFilter(beamline="BL-EVENTS"), 4))
+    assert beamline_chunks[0].startswith("retry:")
+    assert "event: allocation.created" in beamline_chunks[1]
+    assert "event: allocation.approved" in beamline_chunks[2]
+    assert beamline_chunks[3] == ": keepalive\n\n"
+
+    manager_chunks = asyncio.run(replay(EventFilter(manager_id=ids["manager_id"]), 4))
+    assert [chunk.split("\n")[1] for chunk in manager_chunks[1:]] == [
+        "event: allocation.created",
+        "event: allocation.approved",
+        "event: request.status_changed",
+    ]
+    payload = json.loads(manager_chunks[3].split("data: ", 1)[1])
+    assert payload["status"] == "APPROVED"
+
+
+def test_schedule_proposal_avoids_bookings_and_blackouts_and_commits_in_bulk():
+    ids = create_allocator_request("schedule")
+    request_ids = []
+    for requested_date in ("2031-03-02", "2031-03-02", "2031-03-02", "2031-03-03"):
+        created = client.post(
+            f"/projects/{ids['project_id']}/requests",
+            params={"pi_id": ids["pi_id"]},
+            json={"requested_date": requested_date, "duration_hours": 12},
+        ).json()
+        client.patch(
+            f"/requests/{created['id']}/status",
+            params={"manager_id": ids["manager_id"]},
+            json={"status": "APPROVED"},
+        )
+        request_ids.append(created["id"])
+    client.post(
+        f"/requests/{ids['request_id']}/allocations",
+        params={"allocator_id": ids["allocator_id"]},
+        json={"beamline": "BL-SCHED-A", "slot_date": "2031-03-02", "slot_time": "00:00", "duration_hours": 12},
+    )
+
+    payload = {
+        "allocator_id": ids["allocator_id"],
+        "start": "2031-03-01",
+        "end": "2031-03-07",
+        "beamlines": [{"name": "BL-SCHED-A"}, {"name": "BL-SCHED-B"}],
+        "blackouts": [
+            {"beamline": "BL-SCHED-B", "start": "2031-03-02T00:00:00", "end": "2031-03-02T12:00:00"}
+        ],
+        "request_ids": request_ids,
+    }
+    # Schedules run on the facility's local clock; UTC offsets are rejected rather than guessed at.
+    utc_blackout = {"start": "2031-03-02T00:00:00Z", "end": "2031-03-02T12:00:00Z"}
+    offset_beamline = {"name": "BL-SCHED-A", "available_from": "2031-03-01T08:00:00+09:00"}
+    for invalid in ({"blackouts": [utc_blackout]}, {"beamlines": [offset_beamline]}):
+        assert client.post("/allocations/schedule", json={**payload, **invalid}).status_code == 422
+
+    proposal = client.post("/allocations/schedule", json=payload).json()
+    assert proposal["score"]["scheduled"] == 4 and proposal["unscheduled"] == []
+    assert sorted(item["request_id"] for item in proposal["items"]) == request_ids
+    assert proposal["score"]["total_deviation_hours"] == 36
+    placed = {(item["beamline"], item["slot_date"], item["slot_time"]) for item in proposal["items"]}
+    assert ("BL-SCHED-A", "2031-03-02", "00:00") not in placed
+    assert ("BL-SCHED-B", "2031-03-02", "00:00") not in placed
+
+    items = [{key: value for key, value in item.items() if key != "deviation_hours"} for item in proposal["items"]]
+    assert not any(
+        result["conflicting_allocation_ids"] or result["conflicting_indexes"]
+        for result in client.post("/allocations/conflicts", json=items).json()
+    )
+    committed = client.post(
+        "/allocations/bulk", json={"allocator_id": ids["allocator_id"], "items": items, "atomic": True}
+    )
+    assert committed.status_code == 200 and len(committed.json()["created"]) == 4
+    assert client.post("/allocations/schedule", json=payload).json()["items"] == []
+
+
+def test_exports_stream_csv_and_parquet_with_filters():
+    ids = create_allocator_request("export")
+    for day in ("2032-01-05", "2032-01-06", "2032-02-01"):
+        client.post(
+            f"/requests/{ids['request_id']}/allocations",
+            params={"allocator_id": ids["allocator_id"]},
+            json={"beamline": "BL-EXPORT", "slot_date": day, "slot_time": "08:00", "duration_hours": 8},
+        )
+    params = {"beamline": "BL-EXPORT", "start": "2032-01-01", "end": "2032-01-31"}
+
+    resp = client.get("/exports/allocations", params=params)
+    assert resp.headers["content-type"].startswith("text/csv")
+    header, *lines = resp.text.strip().splitlines()
+    assert header.split(",")[:4] == ["allocation_id", "request_id", "project_id", "project_title"]
+    assert [line.split(",")[7] for line in lines] == ["2032-01-05", "2032-01-06"]
+    assert all(",SCHEDULED," in line for line in lines)
+
+    resp = client.get("/exports/allocations", params={**params, "format": "parquet"})
+    table = pq.read_table(io.BytesIO(resp.content))
+    assert table.column("slot_date").to_pylist() == [date(2032, 1, 5), date(2032, 1, 6)]
+    assert set(table.column("project_title").to_pylist()) == {"Project export"}
+
+    resp = client.get("/exports/monthly", params={"start_year": date.today().year, "kind": "ALLOCATION", "format": "arrow"})
+    rollup = ipc.open_stream(resp.content).read_all()
+    assert sum(rollup.column("count").to_pylist()) >= 3
+
+
+def test_batch_approval_updates_allocations_in_one_transaction():
+    ids = create_allocator_request("batch-approve")
+    approver_id = create_user(
+        {"name": "Approver", "email": "approver-batch@example.com", "role": "APPROVER"}
+    )
+    allocation_ids = [
+        client.post(
+            f"/requests/{ids['request_id']}/allocations",
+            params={"allocator_id": ids["allocator_id"]},
+            json={"beamline": "BL-APPROVE", "slot_date": f"2033-01-0{day}", "slot_time": "08:00", "duration_hours": 8},
+        ).json()["id"]
+        for day in (1, 2, 3)
+    ]
+    decisions = [
+        {"allocation_id": allocation_ids[0]},
+        {"allocation_id": allocation_ids[1], "notes": "Week signed off"},
+        {"allocation_id": allocation_ids[2], "approved": False, "notes": "Shutdown"},
+        {"allocation_id": 10**9},
+    ]
+    # Role check, locked read, one UPDATE, one upsert each for the rollup and the
+    # status counters, one multi-row INSERT.
+    with assert_max_queries(6, test_engine, test_async_engine):
+        resp = client.post("/allocations/approvals", json={"approver_id": approver_id, "decisions": decisions})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert (body["approved"], body["rejected"], body["not_found"]) == (2, 1, 1)
+    assert [result["outcome"] for result in body["results"]] == ["approved", "approved", "rejected", "not_found"]
+    assert [result["status"] for result in body["results"][:3]] == ["CONFIRMED", "CONFIRMED", "SCHEDULED"]
+    assert all(result["approval_id"] for result in body["results"][:3])
+
+    listed = client.get("/allocations/", params={"beamline": "BL-APPROVE"}).json()
+    assert [row["status"] for row in listed] == ["CONFIRMED", "CONFIRMED", "SCHEDULED"]
+    rollup = client.get(
+        "/reports/monthly/rollup",
+        params={"start_year": date.today().year, "kind": "ALLOCATION", "beamline": "BL-APPROVE"},
+    ).json()
+    assert {row["status"]: row["count"] for row in rollup} == {"CONFIRMED": 2, "SCHEDULED": 1}
+
+    duplicate = client.post(
+        "/allocations/approvals",
+        json={"approver_id": approver_id, "decisions": [decisions[0], decisions[0]]},
+    )
+    assert duplicate.status_code == 422
+
+
+def test_analytics_report_utilization_gaps_demand_and_shares():
+    ids = create_allocator_request("analytics")
+    client.post(
+        f"/projects/{ids['project_id']}/requests",
+        params={"pi_id": ids["pi_id"]},
+        json={"requested_date": "2035-01-02", "duration_hours": 24},
+    )
+    for day, clock, hours in (("2035-01-01", "08:00", 8), ("2035-01-02", "22:00", 4), ("2035-01-09", "00:00", 24)):
+        client.post(
+            f"/requests/{ids['request_id']}/allocations",
+            params={"allocator_id": ids["allocator_id"]},
+            json={"beamline": "BL-ANALYTICS", "slot_date": day, "slot_time": clock, "duration_hours": hours},
+        )
+    window = {"start": "2035-01-01", "end": "2035-01-14"}
+
+    resp = client.get("/analytics/utilization", params={**window, "beamline": "BL-ANALYTICS"})
+    report = resp.json()
+    assert report["bucket_starts"] == ["2035-01-01", "2035-01-08"]
+    assert report["capacity_hours"] == [168, 168]
+    [series] = report["beamlines"]
+    assert series["booked_hours"] == [12, 24] and series["total_booked_hours"] == 36
+    assert series["utilization"] == [round(12 / 168, 4), round(24 / 168, 4)]
+    with assert_max_queries(0, test_engine, test_async_engine):
+        cached = client.get(
+            "/analytics/utilization",
+            params={**window, "beamline": "BL-ANALYTICS"},
+            headers={"If-None-Match": resp.headers["etag"]},
+        )
+    assert cached.status_code == 304
+
+    [gaps] = client.get("/analytics/gaps", params={**window, "beamline": "BL-ANALYTICS"}).json()
+    assert (gaps["gap_count"], gaps["idle_hours"], gaps["longest_gap_hours"]) == (4, 300, 142)
+    assert gaps["longest_gap_start"] == "2035-01-03T02:00:00"
+
+    demand = client.get("/analytics/oversubscription", params=window).json()
+    assert (demand["booked_hours"], demand["requested_hours"], demand["capacity_hours"]) == ([36], [24], [336])
+    assert demand["requested_per_booked"] == [round(24 / 36, 4)]
+
+    shares = client.get("/analytics/shares", params={**window, "beamline": "BL-ANALYTICS"}).json()
+    assert [(item["id"], item["booked_share"], item["requested_hours"]) for item in shares["items"]] == [
+        (ids["pi_id"], 1.0, 24.0)
+    ]
+    assert client.get("/analytics/gaps", params={"start": "2035-01-02", "end": "2035-01-01"}).status_code == 400
+
+    # A 400-hour slot starting twelve days before the window still fills its first 112 hours.
+    client.post(
+        f"/requests/{ids['request_id']}/allocations",
+        params={"allocator_id": ids["allocator_id"]},
+        json={"beamline": "BL-LONG", "slot_date": "2034-12-20", "slot_time": "00:00", "duration_hours": 400},
+    )
+    long_report = client.get("/analytics/utilization", params={**window, "beamline": "BL-LONG"}).json()
+    assert [series["booked_hours"] for series in long_report["beamlines"]] == [[112, 0]]
+
+
+def test_listings_skip_validation_but_keep_their_schemas():
+    ids = create_allocator_request("fastjson")
+    client.post(
+        f"/requests/{ids['request_id']}/allocations",
+        params={"allocator_id": ids["allocator_id"]},
+        json={"beamline": "BL-FAST", "slot_date": "2030-04-01", "slot_time": "08:00", "duration_hours": 2},
+    )
+    listed = client.get("/allocations/", params={"beamline": "BL-FAST"})
+    assert listed.headers["content-type"] == "application/json"
+    [allocation] = listed.json()
+    assert set(allocation) == set(schemas.Allocation.__fields__)
+    assert schemas.Allocation.parse_obj(allocation).slot_date == date(2030, 4, 1)
+    [request] = client.get(f"/projects/{ids['project_id']}/requests").json()
+    assert set(request) == set(schemas.BeamtimeRequest.__fields__) and request["status"] == "PENDING"
+    [table_row] = client.get("/allocations/table", params={"beamline": "BL-FAST"}).json()
+    assert table_row == {
+        "project_title": "Project fastjson",
+        "beamline": "BL-FAST",
+        "slot_date": "2030-04-01",
+        "slot_time": "08:00",
+        "duration_hours": 2,
+        "status": "SCHEDULED",
+    }
+    assert [project["id"] for project in client.get(f"/users/{ids['pi_id']}/projects").json()] == [ids["project_id"]]
+
+    paths = client.get("/openapi.json").json()["paths"]
+    schema = paths["/allocations/"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert schema["items"]["$ref"].endswith("/Allocation")
+
+    sample = {
+        "when": datetime(2030, 1, 2, 3, 4, 5, 6),
+        "day": date(2030, 1, 2),
+        "status": models.AllocationStatus.CONFIRMED,
+        "hours": numpy.array([1, 2], dtype=numpy.int64),
+        "share": numpy.float64(0.5),
+    }
+    assert json.loads(serialization.dumps(sample)) == {
+        "when": "2030-01-02T03:04:05.000006",
+        "day": "2030-01-02",
+        "status": "CONFIRMED",
+        "hours": [1, 2],
+        "share": 0.5,
+    }
+
+
+def test_search_ranks_projects_and_justifications_and_follows_updates():
+    ids = create_allocator_request("search")
+    client.put(f"/projects/{ids['project_id']}", json={"description": "Serial femtosecond crystallography"})
+    request_ids = [
+        client.post(
+            f"/projects/{ids['project_id']}/requests",
+            params={"pi_id": ids["pi_id"]},
+            json={"requested_date": "2036-01-01", "duration_hours": 8, "justification": justification},
+        ).json()["id"]
+        for justification in (
+            "Femtosecond pump-probe crystallography of photosystem II",
+            "Powder diffraction of battery cathodes",
+        )
+    ]
+
+    hits = client.get("/search", params={"q": "crystallography"}).json()
+    assert [(hit["kind"], hit["id"]) for hit in hits] == [("project", ids["project_id"]), ("request", request_ids[0])]
+    assert hits[1]["project_title"] == "Project search" and "**" in hits[1]["snippet"]
+
+    first = client.get("/search", params={"q": "femtosecond", "limit": 1})
+    second = client.get("/search", params={"q": "femtosecond", "cursor": first.headers["x-next-cursor"]})
+    assert [hit["id"] for hit in first.json() + second.json()] == [hit["id"] for hit in hits]
+    assert "x-next-cursor" not in second.headers
+
+    cathodes = client.get("/search", params={"q": "battery cathode", "kind": "request"}).json()
+    assert [hit["id"] for hit in cathodes] == [request_ids[1]]
+    client.put(f"/projects/{ids['project_id']}", json={"description": "Small-angle scattering"})
+    assert [hit["kind"] for hit in client.get("/search", params={"q": "crystallography"}).json()] == ["request"]
+    assert client.get("/search", params={"q": "***"}).json() == []
+    assert client.get("/search", params={"q": "beam", "cursor": "nope"}).status_code == 400
+
+
+def test_status_summaries_follow_writes_and_match_a_rebuild():
+    from app.counters import rebuild_status_counts
+
+    ids = create_allocator_request("summary")
+    approver_id = create_user({"name": "Approver", "email": "approver-summary@example.com", "role": "APPROVER"})
+    client.post(
+        f"/projects/{ids['project_id']}/requests",
+        params={"pi_id": ids["pi_id"]},
+        json={"requested_date": "2030-02-01", "duration_hours": 2},
+    )
+    client.patch(
+        f"/requests/{ids['request_id']}/status", params={"manager_id": ids["manager_id"]}, json={"status": "APPROVED"}
+    )
+    allocation = client.post(
+        f"/requests/{ids['request_id']}/allocations",
+        params={"allocator_id": ids["allocator_id"]},
+        json={"beamline": "BL-SUMMARY", "slot_date": "2030-04-01", "slot_time": "08:00", "duration_hours": 2},
+    ).json()
+    client.post(f"/allocations/{allocation['id']}/approve", json={"approver_id": approver_id, "approved": True})
+
+    project = client.get(f"/projects/{ids['project_id']}/summary").json()
+    assert project["requests"] == {"PENDING": 1, "REVIEWED": 0, "APPROVED": 1, "REJECTED": 0}
+    assert project["allocations"] == {"SCHEDULED": 0, "CONFIRMED": 1, "COMPLETED": 0}
+    assert client.get(f"/users/{ids['pi_id']}/summary").json() == project
+    assert client.get(f"/managers/{ids['manager_id']}/summary").json() == project
+    beamline = client.get("/beamlines/BL-SUMMARY/summary").json()
+    assert beamline == {"requests": {}, "allocations": project["allocations"]}
+
+    successor = create_user({"name": "Successor", "email": "successor-summary@example.com", "role": "PROJECT_MANAGER"})
+    client.put(f"/projects/{ids['project_id']}", json={"manager_id": successor})
+    assert client.get(f"/managers/{successor}/summary").json() == project
+    assert client.get(f"/managers/{ids['manager_id']}/summary").json()["requests"]["PENDING"] == 0
+
+    with TestingSessionLocal() as db:
+        rebuild_status_counts(db)
+        db.commit()
+    assert client.get(f"/projects/{ids['project_id']}/summary").json() == project
+    assert client.get(f"/managers/{successor}/summary").json() == project
+    assert client.get("/projects/999999/summary").status_code == 404
+    assert client.get(f"/managers/{ids['pi_id']}/summary").status_code == 400
+
+
+def test_beamline_calendar_groups_slots_by_day_in_columns():
+    ids = create_allocator_request("calendar")
+    slots = [("2036-02-29", "23:00", 3), ("2036-03-01", "08:00", 8), ("2036-03-01", "22:00", 4), ("2036-03-05", "10:30", 2)]
+    allocation_ids = [
+        client.post(
+            f"/requests/{ids['request_id']}/allocations",
+            params={"allocator_id": ids["allocator_id"]},
+            json={"beamline": "BL-CALENDAR", "slot_date": day, "slot_time": clock, "duration_hours": hours},
+        ).json()["id"]
+        for day, clock, hours in slots
+    ]
+    window = {"start": "2036-03-01", "end": "2036-03-07"}
+
+    # The beamline's longest slot, then the slots.
+    with assert_max_queries(2, test_engine, test_async_engine):
+        resp = client.get("/beamlines/BL-CALENDAR/calendar", params=window)
+    calendar = resp.json()
+    # The slot from February spills two hours into March 1st but is not listed.
+    assert (calendar["days"], calendar["occupied_hours"], calendar["slot_counts"]) == ([0, 1, 4], [12, 2, 3], [2, 0, 1])
+    assert calendar["total_occupied_hours"] == 17
+    assert calendar["slots"]["id"] == allocation_ids[1:]
+    assert calendar["slots"]["slot_time"] == ["08:00", "22:00", "10:30"]
+    assert calendar["slots"]["project_title"] == ["Project calendar"] * 3
+    assert schemas.BeamlineCalendar.parse_obj(calendar)
+    with assert_max_queries(0, test_engine, test_async_engine):
+        cached = client.get(
+            "/beamlines/BL-CALENDAR/calendar", params=window, headers={"If-None-Match": resp.headers["etag"]}
+        )
+    assert cached.status_code == 304
+
+    hours = client.get("/beamlines/BL-CALENDAR/calendar", params={**window, "detail": "hours"}).json()
+    assert (hours["days"], hours["occupied_hours"], hours["slots"]) == ([0, 1, 4], [12, 2, 3], None)
+    assert client.get("/beamlines/BL-NONE/calendar", params=window).json()["days"] == []
+    year = {"start": "2036-01-01", "end": "2038-01-31", "detail": "hours"}
+    assert client.get("/beamlines/BL-CALENDAR/calendar", params=year).status_code == 400
+
+    # Ten days long and starting eight days early: 48 hours fall on March 1st and 2nd.
+    client.post(
+        f"/requests/{ids['request_id']}/allocations",
+        params={"allocator_id": ids["allocator_id"]},
+        json={"beamline": "BL-CALENDAR-LONG", "slot_date": "2036-02-22", "slot_time": "00:00", "duration_hours": 240},
+    )
+    spill = client.get("/beamlines/BL-CALENDAR-LONG/calendar", params={**window, "detail": "hours"}).json()
+    assert (spill["days"], spill["occupied_hours"], spill["total_occupied_hours"]) == ([0, 1], [24, 24], 48)
+
+
+def test_idempotency_key_replays_the_first_response_instead_of_writing_again():
+    from app.idempotency import idempotency_store
+
+    ids = create_allocator_request("idempotent")
+    url = f"/projects/{ids['project_id']}/requests"
+    body = {"requested_date": "2031-01-01", "duration_hours": 3}
+    headers = {"Idempotency-Key": "retry-create-request"}
+    first = client.post(url, params={"pi_id": ids["pi_id"]}, json=body, headers=headers)
+    with assert_max_queries(0, test_engine, test_async_engine):
+        retried = client.post(url, params={"pi_id": ids["pi_id"]}, json=body, headers=headers)
+    assert retried.json() == first.json() and retried.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+
+    idempotency_store.recent.clear()
+    assert client.post(url, params={"pi_id": ids["pi_id"]}, json=body, headers=headers).json() == first.json()
+    assert len(client.get(url).json()) == 2
+    changed = client.post(url, params={"pi_id": ids["pi_id"]}, json={**body, "duration_hours": 4}, headers=headers)
+    assert changed.status_code == 422
+
+    with TestingSessionLocal() as db:
+        db.execute(
+            models.IdempotencyKey.__table__.update().values(expires_at=datetime(2000, 1, 1))
+        )
+        db.commit()
+    idempotency_store.recent.clear()
+    expired = client.post(url, params={"pi_id": ids["pi_id"]}, json=body, headers=headers)
+    assert expired.json()["id"] != first.json()["id"] and "idempotent-replayed" not in expired.headers
+
+    slot = {"beamline": "BL-IDEMPOTENT", "slot_date": "2031-01-02", "slot_time": "08:00", "duration_hours": 2}
+    allocation_url = f"/requests/{ids['request_id']}/allocations"
+    params = {"allocator_id": ids["allocator_id"]}
+    booked = [
+        client.post(allocation_url, params=params, json=slot, headers={"Idempotency-Key": "retry-allocation"})
+        for _ in range(2)
+    ]
+    assert [response.status_code for response in booked] == [200, 200]
+    assert booked[0].json() == booked[1].json()
+
+
+def test_concurrent_retries_with_one_idempotency_key_book_once(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from app.idempotency import Idempotency
+
+    ids = create_allocator_request("idempotent-race")
+    # Both requests miss the lookup before either claims the key.
+    arrived = threading.Barrier(2, timeout=10)
+    claim = Idempotency.claim
+
+    def claim_together(self, db):
+        arrived.wait()
+        claim(self, db)
+
+    monkeypatch.setattr(Idempotency, "claim", claim_together)
+    slot = {"beamline": "BL-IDEMPOTENT-RACE", "slot_date": "2031-02-02", "slot_time": "08:00", "duration_hours": 2}
+
+    def book(_):
+        return client.post(
+            f"/requests/{ids['request_id']}/allocations",
+            params={"allocator_id": ids["allocator_id"]},
+            json=slot,
+            headers={"Idempotency-Key": "race-allocation"},
+        )
+
+    with ThreadPoolExecutor(2) as pool:
+        responses = list(pool.map(book, range(2)))
+    assert [response.status_code for response in responses] == [200, 200]
+    assert responses[0].json() == responses[1].json()
+    assert sorted("idempotent-replayed" in response.headers for response in responses) == [False, True]
+    assert len(client.get("/allocations/", params={"beamline": "BL-IDEMPOTENT-RACE"}).json()) == 1
+
+
+def test_change_feed_carries_bookings_and_table_versions_between_workers():
+    from sqlalchemy import insert, select
+    from app.changes import _stamp, change_feed
+    from app.response_cache import table_versions
+
+    ids = create_allocator_request("feed")
+    url = f"/requests/{ids['request_id']}/allocations"
+    params = {"allocator_id": ids["allocator_id"]}
+    slot = {"beamline": "BL-FEED", "slot_date": "2031-05-01", "slot_time": "08:00", "duration_hours": 2}
+    assert client.post(url, params=params, json=slot).status_code == 200
+    versions = models.ChangeVersion.__table__
+    change_feed.start(test_engine, interval=3600)
+    try:
+        assert client.post(url, params=params, json={**slot, "slot_time": "10:00"}).status_code == 200
+        with test_engine.connect() as connection:
+            stamped = {(row.channel, row.key): row.version for row in connection.execute(select(versions))}
+        assert (models.ChangeChannel.BEAMLINE, "BL-FEED") in stamped
+        allocations_version = stamped[(models.ChangeChannel.TABLE, "allocations")]
+        assert table_versions.snapshot(["allocations"])[0] == (("allocations", allocations_version),)
+
+        # Another worker books 12:00 with a Core insert, which this worker's
+        # session listeners never see; only its stamp announces the booking.
+        with TestingSessionLocal() as other:
+            other.execute(
+                insert(models.Allocation.__table__).values(
+                    request_id=ids["request_id"], status=models.AllocationStatus.SCHEDULED,
+                    created_at=datetime(2031, 1, 1), **{**slot, "slot_date": date(2031, 5, 1), "slot_time": "12:00"},
+                )
+            )
+            _stamp(other, {(models.ChangeChannel.BEAMLINE, "BL-FEED")})
+            other.commit()
+        clash = client.post(url, params=params, json={**slot, "slot_time": "13:00"})
+        assert clash.status_code == 409
+        # Events stay in the publishing worker, so the stream is refused rather than incomplete.
+        assert client.get("/events").status_code == 501
+    finally:
+        change_feed.stop()
+    assert table_versions.epoch != "shared"
+
+
+def test_app_factory_defers_schema_handling_to_the_lifespan(tmp_path):
+    empty = create_db_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+    with pytest.raises(RuntimeError, match="alembic upgrade head"):
+        prepare_schema(empty, "check")
+    prepare_schema(empty, "create")
+    prepare_schema(empty, "check")
+    empty.dispose()
+
+    factory_app = create_app(Settings(schema_on_startup="skip"))
+    paths = {route.path for route in factory_app.routes}
+    assert {"/users/", "/allocations/table", "/metrics"} <= paths